@@ -1,14 +1,31 @@
 from typing import List
 from abc import ABC
+from collections import namedtuple
+
+
+# what Turn.perform changed, so Turn.undo can put it back
+# position_key is the state's position_key() from before the turn, e.g. for spotting repeated positions
+TurnRecord = namedtuple('TurnRecord', ['turn', 'player', 'action_records', 'player_turn', 'turn_phase', 'game_phase', 'position_key'])
 
 
 class Action():
-    def __init__(self, fn, params) -> None:
+    # fn(board_game_state, player, **params) makes the change and returns whatever undo_fn needs to reverse it
+    # undo_fn(board_game_state, player, record, **params) takes it back; actions without one can't be undone
+    def __init__(self, fn, params, undo_fn=None) -> None:
         self.fn = fn
         self.params = params
+        self.undo_fn = undo_fn
 
     def _perform(self, board_game_state, player):
-        self.fn(board_game_state, player=player, **self.params)
+        return self.fn(board_game_state, player=player, **self.params)
+
+    def _undo(self, board_game_state, player, record):
+        if not self.reversible():
+            raise Exception('action can\'t be undone: ' + str(self))
+        self.undo_fn(board_game_state, player=player, record=record, **self.params)
+
+    def reversible(self):
+        return self.undo_fn is not None
     
     def __repr__(self) -> str:
         return str(self.params)
@@ -31,12 +48,42 @@ class Turn():
         if not self.validate(board_game_state):
             # print(self, player, board_game_state)
             raise Exception('invalid turn:' + str(self) + '\nby player:' + str(player) + '\nstate:' + str(board_game_state))
-        for action in self.actions:
-            action._perform(board_game_state=board_game_state, player=player)
-        
+        player_turn, turn_phase, game_phase = board_game_state.player_turn, board_game_state.turn_phase, board_game_state.game_phase
+        position_key = board_game_state.position_key()
+        action_records = []
+        try:
+            for action in self.actions:
+                action_records.append(action._perform(board_game_state=board_game_state, player=player))
+        except Exception:
+            # take back the actions already performed, so a turn that fails part way leaves the state as it was
+            for action, action_record in reversed(list(zip(self.actions, action_records))):
+                action._undo(board_game_state=board_game_state, player=player, record=action_record)
+            raise
+
         board_game_state.turns.append(self)
+        board_game_state.undo_records.append(TurnRecord(self, player, action_records, player_turn, turn_phase, game_phase, position_key))
         board_game_state.next_player()
+        board_game_state.version += 1
         board_game_state.done()  # TODO: rename
+
+    def reversible(self):
+        return all(action.reversible() for action in self.actions)
+
+    def undo(self, board_game_state):
+        # take this turn back; it must be the last turn performed on board_game_state
+        if not board_game_state.undo_records:
+            raise Exception('no turns performed on this state to undo')
+        record = board_game_state.undo_records[-1]
+        if record.turn is not self:
+            raise Exception('can only undo the last turn, which was:' + str(record.turn))
+        for action, action_record in reversed(list(zip(self.actions, record.action_records))):
+            action._undo(board_game_state=board_game_state, player=record.player, record=action_record)
+        board_game_state.undo_records.pop()
+        board_game_state.turns.pop()
+        board_game_state.player_turn = record.player_turn
+        board_game_state.turn_phase = record.turn_phase
+        board_game_state.game_phase = record.game_phase
+        board_game_state.version += 1
     
     def __repr__(self) -> str:
         return str(self.actions) + ' by ' + str(self.player)
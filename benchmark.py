@@ -0,0 +1,270 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from collections import namedtuple
+from actions import Turn
+from chess import Chess, ChessState, Move, moves_from_notation
+from evaluation import piece_square, encode_states, evaluate_batch
+from pgn import read_games, replay, replay_result
+from tictactoe import TicTacToe, Place_X, Place_O
+
+# timings of the hot paths, compared against a saved baseline so a change shows up as faster or slower
+# python benchmark.py                    run, and compare with benchmark_baseline.json if it exists
+# python benchmark.py --save             run and make this the baseline
+# python benchmark.py --filter chess     only benchmarks whose names contain 'chess'
+# exits with status 1 if anything got slower than the baseline by more than the tolerance
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DEFAULT_TOLERANCE = 0.25  # timings on a shared machine wobble; smaller differences aren't reported
+
+BenchmarkResult = namedtuple('BenchmarkResult', ['name', 'seconds_per_call', 'calls'])
+Comparison = namedtuple('Comparison', ['name', 'baseline', 'current', 'ratio', 'verdict'])
+
+
+def _chess_midgame():
+    state = Chess().state
+    for notation in ['e4 e5', 'Nf3 Nc6', 'Bc4 Bc5', 'd3 d6']:
+        for turn in moves_from_notation(state, notation):
+            turn.perform(board_game_state=state)
+    return state
+
+
+def _tictactoe_midgame():
+    tictactoe = TicTacToe()
+    state = tictactoe.state
+    for turn in [Turn([Place_X((0,0))], tictactoe.adam), Turn([Place_O((1,1))], tictactoe.jess), Turn([Place_X((2,0))], tictactoe.adam)]:
+        turn.perform(board_game_state=state)
+    return state
+
+
+# each benchmark makes its setup once and returns the function to time
+def bench_get_items():
+    board = _chess_midgame().board
+    locations = board.locations
+    def run():
+        for location in locations:
+            board.get_items(location)
+        board.get_items((0,0), (8,8))
+    return run
+
+
+def bench_get_item():
+    board = _chess_midgame().board
+    locations = board.locations
+    def run():
+        for location in locations:
+            board.get_item(location)
+    return run
+
+
+def bench_items_on_path():
+    board = _chess_midgame().board
+    paths = [((0,0), (0,7)), ((0,0), (7,7)), ((7,0), (0,7)), ((0,3), (7,3))]
+    def run():
+        for from_location, to_location in paths:
+            board.items_on_path(from_location, to_location)
+    return run
+
+
+def bench_after():
+    state = _chess_midgame()
+    turn = Turn([Move((1,0), (2,2))], player=state.player_turn)
+    return lambda: state.after(turn)
+
+
+def bench_chess_turn_perform():
+    state = _chess_midgame()
+    turn = Turn([Move((1,0), (2,2))], player=state.player_turn)
+    def run():
+        turn.perform(board_game_state=state)
+        turn.undo(state)
+    return run
+
+
+def bench_tictactoe_turn_perform():
+    state = _tictactoe_midgame()
+    turn = Turn([Place_O((1,0))], player=state.player_turn)
+    def run():
+        turn.perform(board_game_state=state)
+        turn.undo(state)
+    return run
+
+
+def bench_chess_win_condition_met():
+    # worked out afresh each time, not read from the caches
+    state = _chess_midgame()
+    def run():
+        state.end_of_game_cache = None
+        state.end_of_game_results.clear()
+        state.win_condition_met()
+    return run
+
+
+def bench_moves_from_notation():
+    state = Chess().state
+    return lambda: moves_from_notation(state, 'Nf3 Nc6')
+
+
+def bench_tictactoe_win_condition_met():
+    board = _tictactoe_midgame().board
+    return board.win_condition_met
+
+
+def bench_chess_from_fen():
+    fen = _chess_midgame().to_fen()
+    return lambda: Chess(fen=fen)
+
+
+def bench_chess_from_packed():
+    packed = _chess_midgame().to_packed()
+    return lambda: Chess(packed=packed)
+
+
+def bench_piece_square():
+    state = _chess_midgame()
+    return lambda: piece_square(state)
+
+
+def bench_evaluate_batch():
+    boards, black_to_move = encode_states([_chess_midgame()] * 1000)
+    return lambda: evaluate_batch(boards, black_to_move)
+
+
+def _opera_game():
+    # Morphy's opera game, 33 plies
+    return next(read_games('''[Event "Paris"]
+
+1.e4 e5 2.Nf3 d6 3.d4 Bg4 4.dxe5 Bxf3 5.Qxf3 dxe5 6.Bc4 Nf6 7.Qb3 Qe7 8.Nc3 c6 9.Bg5 b5 10.Nxb5 cxb5
+11.Bxb5+ Nbd7 12.O-O-O Rd8 13.Rxd7 Rxd7 14.Rd1 Qe6 15.Bxd7+ Nxd7 16.Qb8+ Nxb8 17.Rd8# 1-0'''.splitlines()))
+
+
+def bench_pgn_replay():
+    game = _opera_game()
+    return lambda: replay(game)
+
+
+def bench_pgn_replay_result():
+    # what each validate_games worker does per game
+    game = _opera_game()
+    return lambda: replay_result(game)
+
+
+def bench_board_repr():
+    board = _chess_midgame().board
+    return lambda: repr(board)
+
+
+BENCHMARKS = {
+    'BoardGrid.get_items': bench_get_items,
+    'BoardGrid.get_item': bench_get_item,
+    'BoardGrid.items_on_path': bench_items_on_path,
+    'BoardGameState.after (chess)': bench_after,
+    'Turn.perform + undo (chess)': bench_chess_turn_perform,
+    'Turn.perform + undo (tictactoe)': bench_tictactoe_turn_perform,
+    'ChessState.win_condition_met': bench_chess_win_condition_met,
+    'moves_from_notation': bench_moves_from_notation,
+    'TicTacToeBoard.win_condition_met': bench_tictactoe_win_condition_met,
+    'BoardGrid.__repr__ (chess)': bench_board_repr,
+    'Chess(fen=...)': bench_chess_from_fen,
+    'Chess(packed=...)': bench_chess_from_packed,
+    'piece_square': bench_piece_square,
+    'evaluate_batch (1000 positions)': bench_evaluate_batch,
+    'pgn.replay (33 plies)': bench_pgn_replay,
+    'pgn.replay_result (33 plies)': bench_pgn_replay_result,
+}
+
+
+def measure(fn, min_seconds=0.05, repeats=5):
+    # best of repeats, each running fn enough times to take min_seconds; the best is the least disturbed by other work
+    calls = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        seconds = time.perf_counter() - started
+        if seconds >= min_seconds:
+            break
+        calls *= 2 if seconds <= 0 else max(2, min(10, int(min_seconds / seconds) + 1))
+    best = seconds
+    for _ in range(repeats - 1):
+        started = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        best = min(best, time.perf_counter() - started)
+    return best / calls, calls
+
+
+def run_benchmarks(names=None, min_seconds=0.05, repeats=5):
+    results = []
+    for name, make in BENCHMARKS.items():
+        if names is not None and name not in names:
+            continue
+        seconds_per_call, calls = measure(make(), min_seconds, repeats)
+        results.append(BenchmarkResult(name, seconds_per_call, calls))
+    return results
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    data = {
+        'python': sys.version.split()[0],
+        'machine': platform.machine(),
+        'benchmarks': {result.name: {'seconds_per_call': result.seconds_per_call, 'calls': result.calls} for result in results},
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return {name: entry['seconds_per_call'] for name, entry in json.load(f)['benchmarks'].items()}
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    # 'slower' beyond the tolerance is a regression, 'faster' beyond it an improvement, 'new' has no baseline
+    comparisons = []
+    for result in results:
+        before = baseline.get(result.name) if baseline else None
+        if before is None:
+            comparisons.append(Comparison(result.name, None, result.seconds_per_call, None, 'new'))
+            continue
+        ratio = result.seconds_per_call / before if before else float('inf')
+        if ratio > 1 + tolerance:
+            verdict = 'slower'
+        elif ratio < 1 - tolerance:
+            verdict = 'faster'
+        else:
+            verdict = 'same'
+        comparisons.append(Comparison(result.name, before, result.seconds_per_call, ratio, verdict))
+    return comparisons
+
+
+def format_comparisons(comparisons):
+    lines = ['{:<36} {:>12} {:>12} {:>7}'.format('benchmark', 'baseline us', 'now us', 'ratio')]
+    for c in comparisons:
+        baseline = '{:.2f}'.format(c.baseline * 1e6) if c.baseline is not None else '-'
+        ratio = '{:.2f}'.format(c.ratio) if c.ratio is not None else '-'
+        lines.append('{:<36} {:>12} {:>12.2f} {:>7}  {}'.format(c.name, baseline, c.current * 1e6, ratio, c.verdict))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='time the hot paths and compare with a saved baseline')
+    parser.add_argument('--save', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--filter', default='')
+    args = parser.parse_args()
+    names = [name for name in BENCHMARKS if args.filter.lower() in name.lower()]
+    results = run_benchmarks(names)
+    comparisons = compare(results, load_baseline(args.baseline), args.tolerance)
+    print(format_comparisons(comparisons))
+    if args.save:
+        save_baseline(results, args.baseline)
+        print('saved baseline to', args.baseline)
+    elif any(c.verdict == 'slower' for c in comparisons):
+        raise SystemExit(1)
@@ -0,0 +1,25 @@
+import os
+import tempfile
+import unittest
+
+from benchmark import BENCHMARKS, BenchmarkResult, run_benchmarks, compare, save_baseline, load_baseline
+
+class TestBenchmark(unittest.TestCase):
+    def test_every_benchmark_runs(self):
+        results = run_benchmarks(min_seconds=0.001, repeats=1)
+        assert [result.name for result in results] == list(BENCHMARKS)
+        assert all(result.seconds_per_call > 0 and result.calls >= 1 for result in results)
+
+    def test_baseline_round_trip_and_compare(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            save_baseline([BenchmarkResult('a', 1e-6, 100), BenchmarkResult('b', 2e-6, 100), BenchmarkResult('c', 1e-6, 100)], path)
+            baseline = load_baseline(path)
+            assert baseline == {'a': 1e-6, 'b': 2e-6, 'c': 1e-6}
+            now = [BenchmarkResult('a', 1.5e-6, 100), BenchmarkResult('b', 1e-6, 100), BenchmarkResult('c', 1.1e-6, 100), BenchmarkResult('d', 1e-6, 100)]
+            verdicts = {c.name: c.verdict for c in compare(now, baseline, tolerance=0.25)}
+            assert verdicts == {'a': 'slower', 'b': 'faster', 'c': 'same', 'd': 'new'}
+            assert load_baseline(path + '.missing') is None
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,367 @@
+from board import ORTHOGONAL_DIRECTIONS, DIAGONAL_DIRECTIONS, KNIGHT_JUMPS
+
+# 64 bit integer boards for 8x8 games: bit (y * 8 + x) is set when square (x, y) is
+# used by Bitboards to mirror the ChessPiece items on a ChessBoard
+
+SQUARES = range(64)
+FULL = (1 << 64) - 1
+
+
+def square(location):
+    return location[1] * 8 + location[0]
+
+
+def location(square):
+    return (square % 8, square // 8)
+
+
+def squares(bitboard):
+    # indices of the set bits, lowest first
+    while bitboard:
+        lowest = bitboard & -bitboard
+        yield lowest.bit_length() - 1
+        bitboard ^= lowest
+
+
+def _inbounds(x, y):
+    return 0 <= x < 8 and 0 <= y < 8
+
+
+def _steps(steps):
+    table = []
+    for sq in SQUARES:
+        x, y = location(sq)
+        table.append(sum(1 << square((x + dx, y + dy)) for dx, dy in steps if _inbounds(x + dx, y + dy)))
+    return table
+
+
+def _rays(direction):
+    table = []
+    for sq in SQUARES:
+        x, y = location(sq)
+        bitboard = 0
+        x, y = x + direction[0], y + direction[1]
+        while _inbounds(x, y):
+            bitboard |= 1 << square((x, y))
+            x, y = x + direction[0], y + direction[1]
+        table.append(bitboard)
+    return table
+
+
+KNIGHT_ATTACKS = _steps(KNIGHT_JUMPS)
+KING_ATTACKS = _steps(ORTHOGONAL_DIRECTIONS + DIAGONAL_DIRECTIONS)
+PAWN_ATTACKS = {'white': _steps([(1, 1), (-1, 1)]), 'black': _steps([(1, -1), (-1, -1)])}
+PAWN_DIRECTION = {'white': 1, 'black': -1}
+PAWN_START_RANK = {'white': 1, 'black': 6}
+
+# castling right (as written in FEN) -> (colour, king from, king to, rook from, rook to); the king passes rook to
+CASTLING = {
+    'K': ('white', 4, 6, 7, 5),
+    'Q': ('white', 4, 2, 0, 3),
+    'k': ('black', 60, 62, 63, 61),
+    'q': ('black', 60, 58, 56, 59),
+}
+
+RAYS = {direction: _rays(direction) for direction in ORTHOGONAL_DIRECTIONS + DIAGONAL_DIRECTIONS}
+# rays going up the board find their nearest blocker with the lowest set bit, rays going down with the highest
+POSITIVE_DIRECTIONS = [d for d in RAYS if d[1] > 0 or (d[1] == 0 and d[0] > 0)]
+ROOK_RAYS = [sum(RAYS[d][sq] for d in ORTHOGONAL_DIRECTIONS) for sq in SQUARES]
+BISHOP_RAYS = [sum(RAYS[d][sq] for d in DIAGONAL_DIRECTIONS) for sq in SQUARES]
+
+# BETWEEN[a][b]: squares strictly between two aligned squares, 0 if they are adjacent or not aligned
+BETWEEN = [[0] * 64 for _ in SQUARES]
+for _direction, _table in RAYS.items():
+    for _from in SQUARES:
+        for _to in squares(_table[_from]):
+            BETWEEN[_from][_to] = _table[_from] & ~_table[_to] & ~(1 << _to)
+
+
+def _slide(sq, occupied, directions):
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][sq]
+        blockers = ray & occupied
+        if blockers:
+            if direction in POSITIVE_DIRECTIONS:
+                nearest = (blockers & -blockers).bit_length() - 1
+            else:
+                nearest = blockers.bit_length() - 1
+            attacks |= ray ^ RAYS[direction][nearest]
+        else:
+            attacks |= ray
+    return attacks
+
+
+def rook_attacks(sq, occupied):
+    return _slide(sq, occupied, ORTHOGONAL_DIRECTIONS)
+
+
+def bishop_attacks(sq, occupied):
+    return _slide(sq, occupied, DIAGONAL_DIRECTIONS)
+
+
+def queen_attacks(sq, occupied):
+    return _slide(sq, occupied, ORTHOGONAL_DIRECTIONS + DIAGONAL_DIRECTIONS)
+
+
+class Bitboards():
+    # occupancy per (colour, piece letter), per colour and overall, as 64 bit ints
+    # ChessBoard keeps it in step with its ChessPiece items as they are added, moved and taken
+    def __init__(self) -> None:
+        self.pieces = {(colour, letter): 0 for colour in ('white', 'black') for letter in 'KQRBNP'}
+        self.colours = {'white': 0, 'black': 0}
+        self.occupied = 0
+        self.piece_on = [None] * 64  # (colour, letter) on each square
+        self.attack_maps = AttackMaps(self)
+
+    def add(self, colour, letter, sq):
+        bit = 1 << sq
+        self.pieces[(colour, letter)] |= bit
+        self.colours[colour] |= bit
+        self.occupied |= bit
+        self.piece_on[sq] = (colour, letter)
+        self.attack_maps.changed |= bit
+
+    def remove(self, colour, letter, sq):
+        bit = ~(1 << sq)
+        self.pieces[(colour, letter)] &= bit
+        self.colours[colour] &= bit
+        self.occupied &= bit
+        self.piece_on[sq] = None
+        self.attack_maps.changed |= 1 << sq
+
+    @staticmethod
+    def enemy(colour):
+        return 'black' if colour == 'white' else 'white'
+
+    def attacks(self, colour, letter, sq):
+        # squares a piece attacks, whatever is on them
+        if letter == 'N':
+            return KNIGHT_ATTACKS[sq]
+        if letter == 'K':
+            return KING_ATTACKS[sq]
+        if letter == 'P':
+            return PAWN_ATTACKS[colour][sq]
+        if letter == 'R':
+            return rook_attacks(sq, self.occupied)
+        if letter == 'B':
+            return bishop_attacks(sq, self.occupied)
+        return queen_attacks(sq, self.occupied)
+
+    def pawn_pushes(self, colour, sq):
+        empty = ~self.occupied
+        step = 8 * PAWN_DIRECTION[colour]
+        one = sq + step
+        if not 0 <= one < 64 or not (empty >> one) & 1:
+            return 0
+        pushes = 1 << one
+        if sq // 8 == PAWN_START_RANK[colour] and (empty >> (one + step)) & 1:
+            pushes |= 1 << (one + step)
+        return pushes
+
+    def move_targets(self, colour, letter, sq, en_passant=None, castling=''):
+        # pseudo-legal destinations: the king may be left in check
+        # en_passant is the square a pawn can capture onto en passant, castling the rights still held, e.g. 'KQkq'
+        if letter == 'P':
+            targets = self.pawn_pushes(colour, sq) | (PAWN_ATTACKS[colour][sq] & self.colours[self.enemy(colour)])
+            if en_passant is not None and self.en_passant_capture(colour, sq, en_passant):
+                targets |= 1 << en_passant
+            return targets
+        targets = self.attacks(colour, letter, sq) & ~self.colours[colour]
+        if letter == 'K' and castling:
+            targets |= self.castling_targets(colour, sq, castling)
+        return targets
+
+    def en_passant_capture(self, colour, sq, en_passant):
+        # whether the pawn on sq can take en passant onto en_passant, past an enemy pawn that has just moved two squares
+        captured = en_passant - 8 * PAWN_DIRECTION[colour]
+        return bool(PAWN_ATTACKS[colour][sq] >> en_passant & 1 and self.pieces[(self.enemy(colour), 'P')] >> captured & 1)
+
+    def castling_targets(self, colour, sq, castling, legal=False):
+        # squares the king on sq can castle to: it and the rook are still at home with nothing between them
+        # legal=True also needs the king not to be in check, nor to pass through or land on an attacked square
+        targets = 0
+        for right in castling:
+            side, king_from, king_to, rook_from, rook_to = CASTLING[right]
+            if side != colour or sq != king_from or not self.pieces[(colour, 'R')] >> rook_from & 1:
+                continue
+            if BETWEEN[king_from][rook_from] & self.occupied:
+                continue
+            if legal and self.attack_maps.attacked(self.enemy(colour)) & (1 << king_from | 1 << rook_to | 1 << king_to):
+                continue
+            targets |= 1 << king_to
+        return targets
+
+    def can_move(self, colour, letter, from_sq, to_sq, en_passant=None, castling=''):
+        # the same answer as move_targets(...) >> to_sq & 1, without building every target, except that castling must
+        # also be legal: not out of check, nor through or onto an attacked square, so a Move performed directly can't
+        to_bit = 1 << to_sq
+        if self.colours[colour] & to_bit:
+            return False
+        if letter == 'N':
+            return bool(KNIGHT_ATTACKS[from_sq] & to_bit)
+        if letter == 'K':
+            return bool(KING_ATTACKS[from_sq] & to_bit) or bool(castling and self.castling_targets(colour, from_sq, castling, legal=True) & to_bit)
+        if letter == 'P':
+            return bool(self.move_targets(colour, letter, from_sq, en_passant) & to_bit)
+        if letter == 'R':
+            aligned = ROOK_RAYS[from_sq] & to_bit
+        elif letter == 'B':
+            aligned = BISHOP_RAYS[from_sq] & to_bit
+        else:
+            aligned = (ROOK_RAYS[from_sq] | BISHOP_RAYS[from_sq]) & to_bit
+        return bool(aligned) and not BETWEEN[from_sq][to_sq] & self.occupied
+
+    def attackers(self, sq, colour, occupied=None):
+        # colour's pieces attacking sq, found by looking outwards from sq
+        # occupied overrides which squares block sliding pieces, e.g. to see through a king that is about to move
+        if occupied is None:
+            occupied = self.occupied
+        pieces = self.pieces
+        rooks = pieces[(colour, 'R')] | pieces[(colour, 'Q')]
+        bishops = pieces[(colour, 'B')] | pieces[(colour, 'Q')]
+        return (KNIGHT_ATTACKS[sq] & pieces[(colour, 'N')]
+                | KING_ATTACKS[sq] & pieces[(colour, 'K')]
+                | PAWN_ATTACKS[self.enemy(colour)][sq] & pieces[(colour, 'P')]
+                | (rook_attacks(sq, occupied) & rooks if ROOK_RAYS[sq] & rooks else 0)
+                | (bishop_attacks(sq, occupied) & bishops if BISHOP_RAYS[sq] & bishops else 0))
+
+    def is_attacked(self, sq, colour):
+        return bool(self.attackers(sq, colour))
+
+    def attacked_by(self, colour):
+        # every square colour attacks
+        return self.attack_maps.attacked(colour)
+
+    def king_square(self, colour):
+        king = self.pieces[(colour, 'K')]
+        return king.bit_length() - 1 if king else None
+
+    def king_in_check(self, colour):
+        king = self.pieces[(colour, 'K')]
+        return bool(king & self.attack_maps.attacked(self.enemy(colour)))
+
+    def pins(self, colour):
+        # colour's pinned pieces: square -> the squares it may still move to (along the line of the pin)
+        return self.attack_maps.pins(colour)
+
+    def legal_targets(self, colour, letter, sq, en_passant=None, castling=''):
+        # move_targets that don't leave colour's king in check, worked out from the attack maps and pins
+        targets = self.move_targets(colour, letter, sq)
+        king_sq = self.king_square(colour)
+        if king_sq is None:
+            return self.move_targets(colour, letter, sq, en_passant, castling)
+        enemy = self.enemy(colour)
+        if letter == 'K':
+            attacked = self.attack_maps.attacked(enemy)
+            if not attacked & (1 << sq):
+                return targets & ~attacked | (self.castling_targets(colour, sq, castling, legal=True) if castling else 0)
+            # in check: a slider's line carries on through where the king is standing now
+            without_king = self.occupied & ~(1 << sq)
+            safe = 0
+            for target in squares(targets & ~attacked):
+                if not self.attackers(target, enemy, without_king):
+                    safe |= 1 << target
+            return safe
+        checkers = self.attackers(king_sq, enemy)
+        if checkers:
+            if checkers & (checkers - 1):
+                targets = 0  # double check, only the king can move
+            else:
+                checker_sq = checkers.bit_length() - 1
+                targets &= checkers | BETWEEN[king_sq][checker_sq]
+        pinned_to = self.pins(colour).get(sq)
+        if pinned_to is not None:
+            targets &= pinned_to
+        if letter == 'P' and en_passant is not None and self.en_passant_capture(colour, sq, en_passant):
+            # taking en passant empties two squares on one rank, so check the king with both pawns gone
+            captured = en_passant - 8 * PAWN_DIRECTION[colour]
+            occupied = self.occupied & ~(1 << sq | 1 << captured) | 1 << en_passant
+            if not self.attackers(king_sq, enemy, occupied) & ~(1 << captured):
+                targets |= 1 << en_passant
+        return targets
+
+    def is_legal(self, colour, letter, from_sq, to_sq, en_passant=None, castling=''):
+        # legal_targets(...) >> to_sq & 1 for a move can_move already allows, by looking out from the king with the
+        # move made on the occupied squares, so the attack maps don't have to be brought up to date
+        king_sq = self.king_square(colour)
+        if king_sq is None:
+            return True
+        enemy = self.enemy(colour)
+        if letter == 'K':
+            if abs(to_sq - from_sq) == 2:
+                return bool(self.castling_targets(colour, from_sq, castling, legal=True) >> to_sq & 1)
+            return not self.attackers(to_sq, enemy, self.occupied & ~(1 << from_sq))
+        captured = to_sq
+        if letter == 'P' and to_sq == en_passant and not self.occupied >> to_sq & 1:
+            captured = en_passant - 8 * PAWN_DIRECTION[colour]
+        occupied = self.occupied & ~(1 << from_sq | 1 << captured) | 1 << to_sq
+        return not self.attackers(king_sq, enemy, occupied) & ~(1 << captured)
+
+
+class AttackMaps():
+    # squares attacked by each colour, kept per attacking piece
+    # after a change only the pieces on changed squares and the sliding pieces whose lines ran through them
+    # are worked out again, the first time someone asks
+    def __init__(self, bitboards: Bitboards) -> None:
+        self.bitboards = bitboards
+        self.by_square = {}  # square -> (colour, letter, squares attacked from there)
+        self.changed = 0  # squares changed since the last refresh
+        self._attacked = {'white': 0, 'black': 0}
+        self._pins = {}
+
+    def refresh(self):
+        changed = self.changed
+        if not changed:
+            return
+        self.changed = 0
+        self._pins = {}
+        bitboards = self.bitboards
+        by_square = self.by_square
+        for sq in squares(changed):
+            piece = bitboards.piece_on[sq]
+            if piece:
+                by_square[sq] = (piece[0], piece[1], bitboards.attacks(piece[0], piece[1], sq))
+            else:
+                by_square.pop(sq, None)
+        for sq, (colour, letter, attacks) in by_square.items():
+            if letter in 'RBQ' and attacks & changed and not (changed >> sq) & 1:
+                by_square[sq] = (colour, letter, bitboards.attacks(colour, letter, sq))
+        attacked = {'white': 0, 'black': 0}
+        for colour, letter, attacks in by_square.values():
+            attacked[colour] |= attacks
+        self._attacked = attacked
+
+    def attacked(self, colour):
+        if self.changed:
+            self.refresh()
+        return self._attacked[colour]
+
+    def attacks_from(self, sq):
+        if self.changed:
+            self.refresh()
+        entry = self.by_square.get(sq)
+        return entry[2] if entry else 0
+
+    def pins(self, colour):
+        if self.changed:
+            self.refresh()
+        if colour not in self._pins:
+            self._pins[colour] = self._find_pins(colour)
+        return self._pins[colour]
+
+    def _find_pins(self, colour):
+        bitboards = self.bitboards
+        king_sq = bitboards.king_square(colour)
+        if king_sq is None:
+            return {}
+        enemy = bitboards.enemy(colour)
+        pieces = bitboards.pieces
+        rooks = (pieces[(enemy, 'R')] | pieces[(enemy, 'Q')]) & ROOK_RAYS[king_sq]
+        bishops = (pieces[(enemy, 'B')] | pieces[(enemy, 'Q')]) & BISHOP_RAYS[king_sq]
+        pins = {}
+        for pinner in squares(rooks | bishops):
+            between = BETWEEN[king_sq][pinner] & bitboards.occupied
+            if between and not between & (between - 1) and between & bitboards.colours[colour]:
+                pins[between.bit_length() - 1] = BETWEEN[king_sq][pinner] | (1 << pinner)
+        return pins
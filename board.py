@@ -1,5 +1,109 @@
 from typing import List, Tuple
+from collections import OrderedDict
+from functools import lru_cache
 from items import Item
+from persistent import PersistentVector, BoardSnapshot, item_view
+
+BUCKET_SIZE = 16  # squares per side of each area in BoardGrid's spatial index
+MAX_CACHED_PAIRS = 1 << 16  # boards with more (from, to) pairs than this keep only the most recently used
+
+ORTHOGONAL_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+DIAGONAL_DIRECTIONS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+KNIGHT_JUMPS = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+
+
+class BoardGeometry():
+    # lookup tables of move shapes for one board size: directions, squares between aligned squares, knight and king targets
+    # shared by every board of that size, see geometry_for
+    # the tables fill in as squares are asked about; those keyed by a pair of squares hold every pair on boards
+    # with up to MAX_CACHED_PAIRS of them, and the MAX_CACHED_PAIRS most recently used on bigger ones
+    def __init__(self, x, y) -> None:
+        self.x = x
+        self.y = y
+        self.pair_limit = None if (x * y) ** 2 <= MAX_CACHED_PAIRS else MAX_CACHED_PAIRS
+        pair_table = dict if self.pair_limit is None else OrderedDict
+        self._directions = pair_table()
+        self._between = pair_table()
+        self._rays = {}
+        self._knight_targets = {}
+        self._king_targets = {}
+
+    def __deepcopy__(self, memo):
+        # tables never change, so hypothetical boards share them
+        return self
+
+    def _remember(self, table, key, value):
+        table[key] = value
+        if self.pair_limit is not None and len(table) > self.pair_limit:
+            table.popitem(last=False)
+        return value
+
+    def inbounds(self, location):
+        return 0 <= location[0] < self.x and 0 <= location[1] < self.y
+
+    def direction(self, from_location, to_location):
+        # unit step (dx, dy) from one square towards another in a straight or diagonal line, None if they aren't aligned
+        key = (from_location, to_location)
+        if key in self._directions:
+            if self.pair_limit is not None:
+                self._directions.move_to_end(key)
+            return self._directions[key]
+        dx = to_location[0] - from_location[0]
+        dy = to_location[1] - from_location[1]
+        if (dx or dy) and (dx == 0 or dy == 0 or abs(dx) == abs(dy)):
+            return self._remember(self._directions, key, ((dx > 0) - (dx < 0), (dy > 0) - (dy < 0)))
+        return self._remember(self._directions, key, None)
+
+    def between(self, from_location, to_location):
+        # squares strictly between two aligned squares, None if they aren't aligned
+        key = (from_location, to_location)
+        if key in self._between:
+            if self.pair_limit is not None:
+                self._between.move_to_end(key)
+            return self._between[key]
+        if from_location == to_location:
+            return self._remember(self._between, key, ())
+        direction = self.direction(from_location, to_location)
+        if direction is None:
+            return self._remember(self._between, key, None)
+        squares = []
+        x, y = from_location[0] + direction[0], from_location[1] + direction[1]
+        while (x, y) != to_location:
+            squares.append((x, y))
+            x, y = x + direction[0], y + direction[1]
+        return self._remember(self._between, key, tuple(squares))
+
+    def ray(self, from_location, direction):
+        # squares from (but not including) from_location to the edge of the board
+        key = (from_location, direction)
+        if key not in self._rays:
+            squares = []
+            x, y = from_location[0] + direction[0], from_location[1] + direction[1]
+            while self.inbounds((x, y)):
+                squares.append((x, y))
+                x, y = x + direction[0], y + direction[1]
+            self._rays[key] = tuple(squares)
+        return self._rays[key]
+
+    def _targets(self, from_location, steps):
+        return frozenset((from_location[0] + dx, from_location[1] + dy) for dx, dy in steps
+                         if self.inbounds((from_location[0] + dx, from_location[1] + dy)))
+
+    def knight_targets(self, from_location):
+        if from_location not in self._knight_targets:
+            self._knight_targets[from_location] = self._targets(from_location, KNIGHT_JUMPS)
+        return self._knight_targets[from_location]
+
+    def king_targets(self, from_location):
+        if from_location not in self._king_targets:
+            self._king_targets[from_location] = self._targets(from_location, ORTHOGONAL_DIRECTIONS + DIAGONAL_DIRECTIONS)
+        return self._king_targets[from_location]
+
+
+@lru_cache(maxsize=None)
+def geometry_for(x, y) -> BoardGeometry:
+    return BoardGeometry(x, y)
+
 
 class Board():
     def __init__(self) -> None:
@@ -24,45 +128,138 @@ class BoardGrid(Board):
         self.y = y
         self.items = []
         self.locations = [(a, b) for a in range(x) for b in range(y)]
-    
-    def add_item(self, item: Item, location):
+        self.occupancy = {}  # (x, y) -> the item covering that square, for every square of every item
+        # big boards also bucket items by BUCKET_SIZE x BUCKET_SIZE area, so large rectangle queries
+        # only look at the items in the areas they touch rather than at every square
+        self.buckets = {} if x > BUCKET_SIZE or y > BUCKET_SIZE else None
+        self.item_index = {}  # (owner id, item class) -> ordered set of items, for items_of
+        self.geometry = geometry_for(x, y)
+        # snapshot() keeps a persistent copy of the squares, brought up to date from the squares changed since the last one
+        self.snapshot_cells = None
+        self.changed_cells = set()
+        self.version = 0  # goes up with every item added, moved or removed, for caching results about the board
+
+    @staticmethod
+    def footprint(location, size=(1,1)):
+        # every square covered by something of this size with its top left corner at location
+        return [(a, b) for a in range(location[0], location[0] + size[0]) for b in range(location[1], location[1] + size[1])]
+
+    def fits(self, location, size=(1,1)):
         top_left_x, top_left_y = location
-        item.location = location
-        if top_left_x + item.size[0] <= self.x and top_left_y + item.size[1] <= self.y:
-            self.items.append(item)
-        else:
+        return top_left_x >= 0 and top_left_y >= 0 and top_left_x + size[0] <= self.x and top_left_y + size[1] <= self.y
+
+    def add_item(self, item: Item, location):
+        if not self.fits(location, item.size):
             raise Exception('Cannot play this piece here.')
+        occupied_by = self.get_items(location, item.size)
+        if occupied_by:
+            raise Exception('Cannot play this piece here, ' + str(location) + ' is already occupied: ' + str(occupied_by))
+        item.location = location
+        self.items.append(item)
+        self._index_item(item)
+
+    def move_item(self, item: Item, location):
+        # the destination must be clear of everything except the item itself
+        if not self.fits(location, item.size):
+            raise Exception('Cannot move this piece here.')
+        blocking = [other for other in self.get_items(location, item.size) if other is not item]
+        if blocking:
+            raise Exception('Cannot move this piece to ' + str(location) + ', already occupied: ' + str(blocking))
+        self._unindex_item(item)
+        item.location = location
+        self._index_item(item)
+
+    @staticmethod
+    def buckets_covering(location, size=(1,1)):
+        first_x, first_y = location[0] // BUCKET_SIZE, location[1] // BUCKET_SIZE
+        last_x, last_y = (location[0] + size[0] - 1) // BUCKET_SIZE, (location[1] + size[1] - 1) // BUCKET_SIZE
+        return [(a, b) for a in range(first_x, last_x + 1) for b in range(first_y, last_y + 1)]
+
+    @staticmethod
+    def _index_key(item: Item):
+        return (item.player.id if item.player else None, type(item))
+
+    def _index_item(self, item: Item):
+        self.version += 1
+        self.item_index.setdefault(self._index_key(item), {})[item] = None
+        if self.snapshot_cells is not None:
+            self.changed_cells.update(self.footprint(item.location, item.size))
+        for cell in self.footprint(item.location, item.size):
+            self.occupancy[cell] = item
+        if self.buckets is not None:
+            for bucket in self.buckets_covering(item.location, item.size):
+                self.buckets.setdefault(bucket, {})[item] = None
+
+    def _unindex_item(self, item: Item):
+        self.version += 1
+        key = self._index_key(item)
+        del self.item_index[key][item]
+        if not self.item_index[key]:
+            del self.item_index[key]
+        if self.snapshot_cells is not None:
+            self.changed_cells.update(self.footprint(item.location, item.size))
+        for cell in self.footprint(item.location, item.size):
+            del self.occupancy[cell]
+        if self.buckets is not None:
+            for bucket in self.buckets_covering(item.location, item.size):
+                del self.buckets[bucket][item]
+                if not self.buckets[bucket]:
+                    del self.buckets[bucket]
         
     def get_items(self, location: Tuple, size=(1,1)):
-        top_left_x, top_left_y = location
-        def overlap(box1_size, box1_location, box2_size, box2_location):
-            def overlap_1d(x1_start, x1_size, x2_start, x2_size):
-                if len(list(range(x1_start, x1_start + x1_size)) + list(range(x2_start,x2_start+ x2_size))) > len(set(list(range(x1_start, x1_start + x1_size)) + list(range(x2_start,x2_start+ x2_size)))):
-                    return True
-                else:
-                    return False
-            if overlap_1d(box1_location[0], box1_size[0], box2_location[0], box2_size[0]) and overlap_1d(box1_location[1], box1_size[1], box2_location[1], box2_size[1]):
-                return True
-            else:
-                return False
-
-        return [item for item in self.items if overlap(
-            box1_size=size, box1_location=(top_left_x, top_left_y),
-            box2_location=item.location, box2_size=item.size
-        )]
+        if size == (1,1):
+            item = self.occupancy.get(tuple(location))
+            return [item] if item else []
+        if self.buckets is not None and size[0] * size[1] > BUCKET_SIZE * BUCKET_SIZE // 4:
+            return self._get_items_from_buckets(location, size)
+        items = {}  # ordered set, an item covering several squares is only returned once
+        for cell in self.footprint(location, size):
+            item = self.occupancy.get(cell)
+            if item:
+                items[item] = None
+        return list(items)
     
+    def _get_items_from_buckets(self, location, size):
+        left, bottom = location
+        right, top = left + size[0], bottom + size[1]
+        items = {}
+        for bucket in self.buckets_covering(location, size):
+            for item in self.buckets.get(bucket, ()):
+                item_left, item_bottom = item.location
+                if item_left < right and left < item_left + item.size[0] and item_bottom < top and bottom < item_bottom + item.size[1]:
+                    items[item] = None
+        return list(items)
+
     def get_item(self, location):
-        x,y = location
-        # assumes exactly one item at this location
-        items = self.get_items(location=(x,y))
-        if len(items) > 1:
-            raise Exception('more than one item found in ' + str(location) + ': ' + str(items))
-        if len(items) == 0:
-            return None
-        return items[0]
+        # placements can't overlap, so there is at most one item here
+        return self.occupancy.get(tuple(location))
     
+    def items_of(self, player=None, item_type=None):
+        # e.g. items_of(white), items_of(black, King), items_of(item_type=Knight)
+        player_id = player.id if player else None
+        return [item for (owner_id, cls), items in self.item_index.items()
+                if (player is None or owner_id == player_id) and (item_type is None or issubclass(cls, item_type))
+                for item in items]
+
+    def snapshot(self) -> BoardSnapshot:
+        # read-only copy of the squares that later moves won't change
+        # costs O(squares changed since the last snapshot), and shares everything else with earlier snapshots
+        if self.snapshot_cells is None:
+            self.snapshot_cells = PersistentVector(self.x * self.y)
+            self.changed_cells = set(self.occupancy)
+        cells = self.snapshot_cells
+        for cell in self.changed_cells:
+            index = cell[0] * self.y + cell[1]
+            view = item_view(self.occupancy.get(cell))
+            if cells.get(index) != view:  # moves that were tried and taken back leave the square as it was
+                cells = cells.set(index, view)
+        self.changed_cells = set()
+        self.snapshot_cells = cells
+        return BoardSnapshot(self.x, self.y, cells)
+
     def remove_item(self, item):
         self.items.remove(item)
+        self._unindex_item(item)
 
     def remove_items_from_location(self, location):
         items = self.get_items(location)
@@ -112,25 +309,19 @@ class BoardGrid(Board):
 
     def items_on_path(self, from_location, to_location):
         # does not look at the end of the path.
-        diag = self.moving_diagonally_only(from_location, to_location)
-        horiz = self.moving_horizontally_only(from_location, to_location)
-        vert = self.moving_vertically_only(from_location, to_location)
-        if not (diag or horiz or vert):
+        between = self.geometry.between(tuple(from_location), tuple(to_location))
+        if between is None:
             raise Exception('not a straight line path')
-        items = []
-        if diag or vert:
-            spaces_moving = abs(from_location[1] - to_location[1])
-        if horiz:
-            spaces_moving = abs(from_location[0] - to_location[0])
-        
-        for i in range(spaces_moving-1):
-            distance = i + 1
-            x_sign = int((to_location[0] - from_location[0]) / spaces_moving)
-            y_sign = int((to_location[1] - from_location[1]) / spaces_moving)
-            x_move = x_sign * distance
-            y_move = y_sign * distance
-            items.extend(self.get_items((from_location[0] + x_move, from_location[1] + y_move)))
-        return items
+        occupancy = self.occupancy
+        return [occupancy[square] for square in between if square in occupancy]
+
+    def path_is_clear(self, from_location, to_location):
+        # True if from and to are aligned and nothing stands between them
+        between = self.geometry.between(tuple(from_location), tuple(to_location))
+        if between is None:
+            return False
+        occupancy = self.occupancy
+        return not any(square in occupancy for square in between)
 
 class BoardNetwork(Board):
     # for Power Grid, Ticket to Ride, ...
@@ -0,0 +1,104 @@
+import random
+import unittest
+from copy import deepcopy
+
+from board import BoardGrid, BoardGeometry, geometry_for, MAX_CACHED_PAIRS
+from items import Item
+
+class TestBoardGrid(unittest.TestCase):
+    def setUp(self) -> None:
+        self.board = BoardGrid(x=200, y=200)
+        random.seed(0)
+        for _ in range(2000):
+            size = (random.randint(1,5), random.randint(1,5))
+            location = (random.randint(0, 195), random.randint(0, 195))
+            if not self.board.get_items(location, size):
+                self.board.add_item(Item(size=size), location)
+
+    def brute_force_items(self, location, size):
+        def overlap_1d(start_1, size_1, start_2, size_2):
+            return start_1 < start_2 + size_2 and start_2 < start_1 + size_1
+        return [item for item in self.board.items if
+                overlap_1d(location[0], size[0], item.location[0], item.size[0]) and
+                overlap_1d(location[1], size[1], item.location[1], item.size[1])]
+
+    def test_region_queries_match_brute_force(self):
+        for size in [(1,1), (3,2), (20,20), (64,17)]:
+            for _ in range(20):
+                location = (random.randint(0, 199 - size[0]), random.randint(0, 199 - size[1]))
+                found = self.board.get_items(location, size)
+                assert sorted(map(id, found)) == sorted(map(id, self.brute_force_items(location, size)))
+
+    def test_multi_cell_item_covers_footprint(self):
+        board = BoardGrid(x=5, y=5)
+        tile = Item(size=(2,3))
+        board.add_item(tile, (1,1))
+        assert board.get_item((2,3)) is tile
+        assert board.get_items((0,0), (2,2)) == [tile]
+        with self.assertRaises(Exception):
+            board.add_item(Item(), (2,2))
+        board.remove_item(tile)
+        assert board.get_item((2,3)) is None
+
+    def test_removed_items_leave_spatial_index(self):
+        for item in list(self.board.items):
+            self.board.remove_item(item)
+        assert self.board.get_items((0,0), (200,200)) == []
+        assert self.board.buckets == {}
+
+class TestBoardGeometry(unittest.TestCase):
+    def setUp(self) -> None:
+        self.geometry = geometry_for(8, 8)
+
+    def test_between(self):
+        between = self.geometry.between
+        assert between((0,0), (3,3)) == ((1,1), (2,2))
+        assert between((3,3), (0,0)) == ((2,2), (1,1))
+        assert between((0,0), (0,3)) == ((0,1), (0,2))
+        assert between((7,0), (4,3)) == ((6,1), (5,2))
+        assert between((0,0), (1,1)) == () and between((2,5), (2,5)) == ()
+        assert between((0,0), (1,2)) is None and between((0,0), (7,6)) is None
+        assert self.geometry.direction((2,5), (2,5)) is None and self.geometry.direction((4,4), (1,7)) == (-1, 1)
+
+    def test_ray(self):
+        ray = self.geometry.ray
+        assert ray((0,0), (1,1)) == tuple((i, i) for i in range(1, 8))
+        assert ray((3,3), (0,-1)) == ((3,2), (3,1), (3,0))
+        assert ray((7,3), (1,0)) == () and ray((0,7), (-1,1)) == ()
+
+    def test_knight_and_king_targets(self):
+        knight, king = self.geometry.knight_targets, self.geometry.king_targets
+        assert knight((0,0)) == {(1,2), (2,1)} and knight((7,7)) == {(6,5), (5,6)}
+        assert knight((0,1)) == {(1,3), (2,2), (2,0)}
+        assert knight((3,3)) == {(4,5), (5,4), (5,2), (4,1), (2,1), (1,2), (1,4), (2,5)}
+        assert king((0,0)) == {(1,0), (0,1), (1,1)} and king((7,0)) == {(6,0), (6,1), (7,1)}
+        assert king((3,3)) == {(2,2), (2,3), (2,4), (3,2), (3,4), (4,2), (4,3), (4,4)}
+
+    def test_shared_between_boards(self):
+        board = BoardGrid(x=8, y=8)
+        assert board.geometry is BoardGrid(x=8, y=8).geometry is self.geometry
+        assert deepcopy(board).geometry is board.geometry
+        assert BoardGrid(x=9, y=8).geometry is not board.geometry
+
+    def test_tables_fill_in_lazily(self):
+        geometry = BoardGeometry(16, 16)
+        assert not geometry._between and not geometry._knight_targets and geometry.pair_limit is None
+        assert geometry.between((0,0), (15,15)) == tuple((i, i) for i in range(1, 15))
+        assert len(geometry._between) == 1
+
+    def test_big_boards_keep_recently_used_pairs(self):
+        geometry = BoardGeometry(40, 40)
+        assert geometry.pair_limit == MAX_CACHED_PAIRS
+        geometry.pair_limit = 100
+        for a in range(40):
+            for b in range(40):
+                geometry.between((5,5), (5,20))  # in use all along, so never evicted
+                geometry.between((a, 0), (b, 39))
+                assert len(geometry._between) <= 100 and len(geometry._directions) <= 100
+        assert ((5,5), (5,20)) in geometry._between
+        assert list(geometry._between)[-1] == ((39,0), (39,39))  # least recently used first
+        assert geometry.between((0,0), (39,39)) == tuple((i, i) for i in range(1, 39))
+        assert geometry.between((5,0), (5,3)) == ((5,1), (5,2))
+
+if __name__ == '__main__':
+    unittest.main()
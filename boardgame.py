@@ -4,7 +4,9 @@ from enum import Enum
 import random
 from board import Board
 from copy import deepcopy, copy
+from contextlib import contextmanager
 from actions import Turn
+from persistent import TurnHistory, StateSnapshot, player_view
 
 
 class Player():
@@ -32,6 +34,10 @@ class Player():
     
     def win_condition_met(self):
         return False
+
+    def choose_turn(self, board_game_state):
+        # computer players return the Turn they want to play; None means ask a human via BoardGame.play
+        return None
     
     def set_player_to_left(self, player):
         self.player_to_left = player
@@ -62,8 +68,11 @@ class BoardGameState():
         self.player_turn = self.players[0]  # whose go is it?
         self.turn_phase = TurnPhase.PASS_THE_LAPTOP  # which part of this person's go is it?  # TODO implement
         self.game_phase = GamePhase.SETUP  # which section of the game is it?  # TODO implement
-        self.turns = []
+        self.turns = TurnHistory()  # copies share the turns played so far
+        self.undo_records = []  # one per turn performed on this state, see Turn.undo
         self.hypothetical = False
+        self.version = 0  # goes up with every turn performed or undone
+        self.done_cache = None  # (version key, result) of the last done()
     
     def __repr__(self) -> str:
         hyp = str(self.hypothetical)
@@ -82,8 +91,40 @@ class BoardGameState():
     def win_condition_met(self):
         return False
 
+    def legal_turns(self):
+        # every Turn the player to move could make; games that list them can be played by generic AI such as mcts.py
+        raise Exception(type(self).__name__ + ' does not list its legal turns')
+
+    def winner(self):
+        # the winning player, or None if the game isn't over or was drawn
+        # by default whoever took the last turn, for games that end as soon as someone wins
+        if self.game_phase != GamePhase.COMPLETE or not self.turns or self.draw_condition_met():
+            return None
+        return self.turns[-1].player
+
+    def position_key(self):
+        # hashable summary of the position for games that track repeats, None if they don't
+        return None
+
+    def draw_condition_met(self):
+        # game over without a winner, e.g. stalemate
+        return False
+
+    def version_key(self):
+        # changes whenever the state might have, None if that can't be told (boards that don't count their changes)
+        board_version = getattr(self.board, 'version', None)
+        if board_version is None:
+            return None
+        return (self.version, id(self.board), board_version, self.player_turn.id, self.hypothetical)
+
     def done(self):
-        done = self.win_condition_met() or self.board.win_condition_met() or any([p.win_condition_met() for p in self.players])
+        # Turn.perform calls this after every turn, so asking again for the result costs nothing until the state changes
+        key = self.version_key()
+        if key is not None and self.done_cache is not None and self.done_cache[0] == key:
+            done = self.done_cache[1]
+        else:
+            done = self.win_condition_met() or self.board.win_condition_met() or any([p.win_condition_met() for p in self.players]) or self.draw_condition_met()
+            self.done_cache = (key, done)
         if done:
             self.game_phase = GamePhase.COMPLETE
         return done
@@ -101,18 +142,65 @@ class BoardGameState():
         self.turn_phase = TurnPhase.PASS_THE_LAPTOP
     
     def after(self, turn: Turn):
-        hypothetical_state = deepcopy(self)
+        # a separate copy of the state with turn performed; see hypothetically to look ahead without copying
+        # and snapshot_after for a read-only copy that only costs the squares the turn changes
+        # the copy shares the turn history, and can only undo turns performed on it
+        hypothetical_state = deepcopy(self, memo={id(self.undo_records): []})
         hypothetical_state.hypothetical = True
         turn.perform(hypothetical_state)
         return hypothetical_state
 
+    def snapshot(self) -> StateSnapshot:
+        # immutable copy of the state, safe to hand to other threads (spectators, AI workers, rendering)
+        # while this state carries on; take snapshots from the thread that is playing the game
+        return StateSnapshot(
+            board=self.board.snapshot(),
+            players=tuple(player_view(player) for player in self.players),
+            player_turn=self.player_turn.id,
+            turn_phase=self.turn_phase,
+            game_phase=self.game_phase,
+            hypothetical=self.hypothetical,
+            turns=self.turns.branch(),
+        )
+
+    def snapshot_after(self, turn: Turn) -> StateSnapshot:
+        # read-only hypothetical: perform turn in place, snapshot, and take the turn back
+        with self.hypothetically(turn):
+            return self.snapshot()
+
+    def undo(self):
+        # take back the last turn
+        self.turns[-1].undo(self)
+
+    @contextmanager
+    def hypothetically(self, turn: Turn):
+        # perform turn in place, marked as hypothetical, and take it back again when the block exits
+        # with state.hypothetically(turn):
+        #     score = evaluate(state)
+        was_hypothetical = self.hypothetical
+        self.hypothetical = True
+        try:
+            turn.perform(self)
+        except Exception:
+            self.hypothetical = was_hypothetical
+            raise
+        try:
+            yield self
+        finally:
+            turn.undo(self)
+            self.hypothetical = was_hypothetical
+
 class BoardGame():
     def __init__(self, state: BoardGameState) -> None:
         self.state = state
         self.action_list = []
 
     def play(self):
-        while self.state != GamePhase.COMPLETE:
+        while self.state.game_phase != GamePhase.COMPLETE:
+            turn = self.state.player_turn.choose_turn(self.state)
+            if turn is not None:
+                turn.perform(board_game_state=self.state)
+                continue
             actions = []
             while True:
                 print(self.state)
@@ -126,6 +214,7 @@ class BoardGame():
                 if action_ref == -1:
                     Turn(actions=actions, player=self.state.player_turn).perform(board_game_state=self.state)
                     actions = []
+                    break
                 else:
                     ActionClass = self.action_list[action_ref]
                     import inspect
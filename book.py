@@ -0,0 +1,155 @@
+import argparse
+import mmap
+import struct
+from collections import namedtuple
+import numpy as np
+from actions import Turn
+from chess import Chess, Move, encode_move, decode_move
+
+# an opening book: for positions seen in a collection of games, which moves were played and how those games ended
+# python book.py build games.pgn book.bin --max-plies 20      from a PGN file, replayed on a process pool
+# python book.py probe book.bin "<fen>"                      the book moves for a position
+# with OpeningBook('book.bin') as book: book.moves(state), book.choose_move(state)
+# ChessEngine(book=book) plays book moves without searching
+# the file is a header, then every entry's position key (zobrist_hash) in sorted order, then each entry's move and
+# statistics in the same order; the keys are binary searched straight from the mapped file, so opening a book
+# costs nothing however big it is and a lookup is O(log n)
+
+BOOK_MAGIC = b'BGBOOK01'
+BOOK_HEADER = struct.Struct('<8sQ')  # magic, number of entries
+STATS_DTYPE = np.dtype([('move', '<u2'), ('pad', '<u2'), ('count', '<u4'), ('white_wins', '<u4'), ('draws', '<u4'), ('black_wins', '<u4')])
+
+BookMove = namedtuple('BookMove', ['move', 'count', 'white_wins', 'draws', 'black_wins'])  # move as (from, to[, promotion])
+
+
+class BookBuilder():
+    # collects (position, move) statistics from games, then writes them as a book
+    # only the first max_plies moves of each game count, the opening rather than the whole game
+    def __init__(self, max_plies=20) -> None:
+        self.max_plies = max_plies
+        self.stats = {}  # (key, move code) -> [count, white wins, draws, black wins]
+        self.games = 0
+
+    def add_game(self, moves, result='*', start=None):
+        # moves as encode_move codes or (from, to[, promotion]) tuples, start as ChessState.to_packed bytes
+        state = (Chess(packed=start) if start else Chess()).state
+        state.hypothetical = True  # no end of game checks after each move, the game is known to be legal
+        outcome = {'1-0': 1, '1/2-1/2': 2, '0-1': 3}.get(result)
+        for move in list(moves)[:self.max_plies]:
+            move = decode_move(int(move)) if isinstance(move, (int, np.integer)) else tuple(move)
+            entry = self.stats.setdefault((state.zobrist_hash(), encode_move(*move)), [0, 0, 0, 0])
+            entry[0] += 1
+            if outcome:
+                entry[outcome] += 1
+            Turn([Move(*move)], player=state.player_turn).perform(board_game_state=state)
+        self.games += 1
+
+    def add_replays(self, results):
+        # pgn.validate_games results; games that didn't replay are left out
+        for result in results:
+            if result.error:
+                continue
+            fen = result.headers.get('FEN')
+            self.add_game(result.moves, result.headers.get('Result', '*'), Chess(fen=fen).state.to_packed() if fen else None)
+
+    def add_database(self, db):
+        # every game of a gamedb.GameDatabase
+        for number in range(len(db)):
+            record = db.game(number)
+            self.add_game(record.moves, record.result, record.start)
+
+    def write(self, path, min_count=1):
+        # moves played fewer than min_count times are left out; within a position the most played come first
+        entries = sorted(((key, -stats[0], code, stats) for (key, code), stats in self.stats.items() if stats[0] >= min_count))
+        keys = np.array([key for key, _, _, _ in entries], dtype='<u8')
+        stats = np.zeros(len(entries), dtype=STATS_DTYPE)
+        for i, (_, _, code, (count, white_wins, draws, black_wins)) in enumerate(entries):
+            stats[i] = (code, 0, count, white_wins, draws, black_wins)
+        with open(path, 'wb') as f:
+            f.write(BOOK_HEADER.pack(BOOK_MAGIC, len(entries)))
+            f.write(keys.tobytes())
+            f.write(stats.tobytes())
+        return len(entries)
+
+
+class OpeningBook():
+    def __init__(self, path) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, entries = BOOK_HEADER.unpack_from(self.map)
+        if magic != BOOK_MAGIC:
+            self.map.close()
+            raise Exception('not an opening book: ' + path)
+        self.keys = np.frombuffer(self.map, dtype='<u8', count=entries, offset=BOOK_HEADER.size)
+        self.stats = np.frombuffer(self.map, dtype=STATS_DTYPE, count=entries, offset=BOOK_HEADER.size + 8 * entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.keys = np.zeros(0, dtype='<u8')
+        self.stats = np.zeros(0, dtype=STATS_DTYPE)
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # views handed out still point into it; it goes when they do
+            self.map = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def moves(self, state):
+        # the book's moves for the player to move, most played first; moves that aren't legal here, from another
+        # position with the same key, are left out
+        key = np.uint64(state.zobrist_hash())
+        low = int(self.keys.searchsorted(key, 'left'))
+        high = int(self.keys.searchsorted(key, 'right'))
+        found = []
+        for stats in self.stats[low:high].tolist():
+            move = decode_move(stats[0])
+            piece = state.board.get_item(move[0])
+            if piece is None or piece.player.id != state.player_turn.id or not state.is_legal(piece, move[1]):
+                continue
+            found.append(BookMove(move, *stats[2:]))
+        return found
+
+    def choose_move(self, state, random=None, min_count=1):
+        # the most played book move, or one chosen at random in proportion to how often each was played;
+        # None when the position isn't in the book
+        moves = [book_move for book_move in self.moves(state) if book_move.count >= min_count]
+        if not moves:
+            return None
+        if random is None:
+            return moves[0].move
+        return random.choices(moves, weights=[book_move.count for book_move in moves])[0].move
+
+
+if __name__ == '__main__':
+    from pgn import read_games, validate_games, san_of
+    parser = argparse.ArgumentParser(description='build or look in an opening book')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build')
+    build.add_argument('pgn')
+    build.add_argument('book')
+    build.add_argument('--max-plies', type=int, default=20)
+    build.add_argument('--min-count', type=int, default=1)
+    build.add_argument('--workers', type=int, default=None)
+    probe = commands.add_parser('probe')
+    probe.add_argument('book')
+    probe.add_argument('fen', nargs='?')
+    args = parser.parse_args()
+    if args.command == 'build':
+        builder = BookBuilder(max_plies=args.max_plies)
+        with open(args.pgn, 'rb') as f:
+            builder.add_replays(validate_games(read_games(f), workers=args.workers))
+        print(builder.write(args.book, min_count=args.min_count), 'entries from', builder.games, 'games')
+    else:
+        state = (Chess(fen=args.fen) if args.fen else Chess()).state
+        with OpeningBook(args.book) as book:
+            for book_move in book.moves(state):
+                print('{:<8} {:>8} {:>8} {:>8} {:>8}'.format(san_of(state, book_move.move), *book_move[1:]))
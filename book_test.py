@@ -0,0 +1,97 @@
+import copy
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from chess import Chess, Turn, Move, moves_from_notation
+from chess_search import ChessEngine
+from book import BookBuilder, OpeningBook
+from gamedb import GameDatabase
+from pgn import read_games, validate_games
+from pgn_test import OPERA, SPECIAL
+
+ITALIAN = '''[Result "1/2-1/2"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 1/2-1/2
+'''
+
+QUEENS_PAWN = '''[Result "0-1"]
+
+1. d4 d5 2. c4 e6 0-1
+'''
+
+class TestOpeningBook(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'book.bin')
+        builder = BookBuilder(max_plies=6)
+        text = '\n'.join([OPERA, ITALIAN, ITALIAN, QUEENS_PAWN, SPECIAL])
+        builder.add_replays(validate_games(read_games(text.splitlines()), workers=0))
+        self.entries = builder.write(self.path)
+        self.book = OpeningBook(self.path)
+
+    def tearDown(self):
+        self.book.close()
+        shutil.rmtree(self.directory)
+
+    def test_close(self):
+        with OpeningBook(self.path) as book:
+            assert len(book) == self.entries
+            mapped = book.map
+        assert mapped.closed and len(book) == 0 and book.moves(Chess().state) == []
+        book.close()  # twice is fine
+
+    def test_players_are_matched_by_id(self):
+        # a state whose player to move is an equal Player, not the very object its pieces hold
+        state = Chess().state
+        state.player_turn = copy.copy(state.player_turn)
+        assert [book_move.move for book_move in self.book.moves(state)] == [((4,1), (4,3)), ((3,1), (3,3))]
+
+    def test_moves(self):
+        assert len(self.book) == self.entries
+        state = Chess().state
+        moves = self.book.moves(state)
+        assert [(book_move.move, book_move.count) for book_move in moves] == [(((4,1), (4,3)), 3), (((3,1), (3,3)), 1)]
+        assert moves[0][2:] == (1, 2, 0) and moves[1][2:] == (0, 0, 1)
+        for turn in moves_from_notation(state, 'e4 e5'):
+            turn.perform(board_game_state=state)
+        assert [book_move.move for book_move in self.book.moves(state)] == [((6,0), (5,2))]
+        assert self.book.moves(Chess(fen='4k3/8/8/8/8/8/8/4K3 w - - 0 1').state) == []
+        # a game from its own starting position, en passant included
+        special = Chess(fen='4k3/1P6/8/3pP3/8/8/8/4K3 w - d6 0 1').state
+        assert self.book.choose_move(special) == ((4,4), (3,5))
+
+    def test_choose_move(self):
+        state = Chess().state
+        assert self.book.choose_move(state) == ((4,1), (4,3))
+        assert self.book.choose_move(state, min_count=4) is None
+        chosen = {self.book.choose_move(state, random.Random(seed)) for seed in range(20)}
+        assert chosen == {((4,1), (4,3)), ((3,1), (3,3))}
+
+    def test_engine_skips_search(self):
+        state = Chess().state
+        engine = ChessEngine(time_limit=5, book=self.book)
+        result = engine.search(state)
+        assert result.move == ((4,1), (4,3)) and result.nodes == 0 and result.depth == 0
+        for turn in moves_from_notation(state, 'a3 a6'):
+            turn.perform(board_game_state=state)
+        result = ChessEngine(max_depth=1, book=self.book).search(state)
+        assert result.nodes > 0  # out of the book
+
+    def test_from_database(self):
+        path = os.path.join(self.directory, 'games.bgdb')
+        with GameDatabase(path, writable=True) as db:
+            db.append([((4,1), (4,3)), ((2,6), (2,4))], '1-0')
+            builder = BookBuilder()
+            builder.add_database(db)
+        book_path = os.path.join(self.directory, 'database_book.bin')
+        builder.write(book_path)
+        state = Chess().state
+        Turn([Move((4,1), (4,3))], player=state.player_turn).perform(board_game_state=state)
+        with OpeningBook(book_path) as book:
+            assert book.moves(state)[0][:3] == (((2,6), (2,4)), 1, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,26 +1,71 @@
 from typing import List, Tuple
 from boardgame import BoardGame, BoardGameState, Player, GamePhase
-from board import Board, BoardGrid
+from board import Board, BoardGrid, ORTHOGONAL_DIRECTIONS, DIAGONAL_DIRECTIONS
 from items import Item
 from actions import Action, Turn
+from bitboard import Bitboards, square, location, squares, PAWN_DIRECTION, PAWN_START_RANK, CASTLING
 from string import ascii_lowercase
+from functools import lru_cache
+import random
+import struct
+from transposition import TranspositionTable, PositionCache
+from evaluation import PIECE_SCORES
+
+def sliding_squares(board, from_location, directions):
+    # squares along each direction up to and including the first item in the way
+    found = []
+    for direction in directions:
+        for to_location in board.geometry.ray(from_location, direction):
+            found.append(to_location)
+            if to_location in board.occupancy:
+                break
+    return found
 
 class ChessPiece(Item):
     def __init__(self, letter, player) -> None:
         super().__init__(letter, color=player.id, player=player)
 
     def validate_move(self, board, to_location):
+        bitboards = getattr(board, 'bitboards', None)
+        if bitboards is not None:
+            to_x, to_y = to_location
+            if not (0 <= to_x < 8 and 0 <= to_y < 8):
+                return False
+            from_x, from_y = self.location
+            return bitboards.can_move(self.color, self.letter, from_y * 8 + from_x, to_y * 8 + to_x, *board.special_moves())
         piece_in_to_location = board.get_item(to_location)
         if piece_in_to_location:
             if piece_in_to_location.color == self.player.id:
                 # raise Exception(str(board) + '\n can\'t take your own piece, from ' + str(self.location) + ' to ' + str(to_location))
                 return False
+        return self.validate_movement(board, to_location)
+
+    def validate_movement(self, board, to_location):
+        # whether this piece's movement rules allow it to go to to_location, walking the board's items
+        # validate_move has already checked to_location doesn't hold one of our own pieces
         return True
+
+    def candidate_squares(self, board):
+        # every square this piece's movement pattern could take it to, before validate_move filters them
+        return board.locations
+
+    def generate_moves(self, board):
+        # pseudo-legal destinations: obey the piece's movement rules, but may leave the king in check
+        bitboards = getattr(board, 'bitboards', None)
+        if bitboards is not None:
+            return [location(sq) for sq in squares(bitboards.move_targets(self.color, self.letter, square(self.location), *board.special_moves()))]
+        return [to_location for to_location in self.candidate_squares(board) if self.validate_move(board, to_location)]
     
+    def captured_by(self, board, to_location):
+        # the piece that moving to to_location takes, if any
+        return board.get_item(to_location)
+
     def move(self, board, to_location, player):
+        # returns (where we moved from, the piece we took or None), which unmove needs to take the move back
         if not self.validate_move(board, to_location):
             raise Exception('invalid move from ' + str(self.location) + ' ' + str(to_location))
-        piece_in_to_location = board.get_item(to_location)
+        from_location = self.location
+        piece_in_to_location = self.captured_by(board, to_location)
         if piece_in_to_location:
             if piece_in_to_location.player == player:
                 raise Exception(str(board) + '\n can\'t take your own piece, from ' + str(self.location) + ' to ' + str(to_location))
@@ -28,179 +73,478 @@ class ChessPiece(Item):
         moving_inbounds = board.moving_inbounds(to_location)
         if not moving_inbounds:
             raise Exception('out of bounds')
-        self.location = to_location
-        board.get_item(to_location)  # designed to fail if there is more than one item
+        board.move_item(self, to_location)  # designed to fail if the square is still occupied
+        return (from_location, piece_in_to_location)
+
+    def unmove(self, board, record):
+        from_location, captured = record[:2]
+        board.move_item(self, from_location)
+        if captured:
+            board.add_item(captured, captured.location)  # taken pieces remember where they were
 
 class Knight(ChessPiece):
     def __init__(self, player) -> None:
         super().__init__(letter='N', player=player)
 
-    def validate_move(self, board, to_location):
-        if not super().validate_move(board, to_location):
-            return False
-        from_location = self.location
-        moving_horizontally = board.moving_horizontally_only(from_location, to_location)
-        moving_vertically = board.moving_vertically_only(from_location, to_location)
-        spaces_moving = board.spaces_moving_manhattan(from_location, to_location)
-        valid = spaces_moving == 3 and not (moving_horizontally or moving_vertically)
-        return valid
+    def validate_movement(self, board, to_location):
+        return to_location in board.geometry.knight_targets(self.location)
+
+    def candidate_squares(self, board):
+        return board.geometry.knight_targets(self.location)
 
 class Queen(ChessPiece):
     def __init__(self, player) -> None:
         super().__init__(letter='Q', player=player)
 
-    def validate_move(self, board, to_location):
-        if not super().validate_move(board, to_location):
-            return False
-        from_location = self.location
-        moving_diagonally = board.moving_diagonally_only(from_location, to_location)
-        moving_horizontally = board.moving_horizontally_only(from_location, to_location)
-        moving_vertically = board.moving_vertically_only(from_location, to_location)
-        if not moving_horizontally and not moving_diagonally and not moving_vertically:
-            return False
-        items_on_path = board.items_on_path(from_location, to_location)
-        valid = (moving_diagonally or moving_horizontally or moving_vertically) and not items_on_path
-        return valid
+    def validate_movement(self, board, to_location):
+        return board.path_is_clear(self.location, to_location)
+
+    def candidate_squares(self, board):
+        return sliding_squares(board, self.location, ORTHOGONAL_DIRECTIONS + DIAGONAL_DIRECTIONS)
 
 class King(ChessPiece):
     def __init__(self, player) -> None:
         super().__init__(letter='K', player=player)
 
-    def validate_move(self, board, to_location):
-        if not super().validate_move(board, to_location):
-            return False
-        # TODO: castling
-        from_location = self.location
-        if board.spaces_moving_manhattan(from_location, to_location) > 2:
-            return False
-        spaces_moving = board.spaces_moving_linear(from_location, to_location)
-        valid = spaces_moving == 1
-        return valid
+    def validate_movement(self, board, to_location):
+        return to_location in board.geometry.king_targets(self.location) or self.castling_right(board, to_location) is not None
+
+    def castling_right(self, board, to_location):
+        # the castling right ('K', 'Q', 'k' or 'q') that moving to to_location uses, if it's allowed by the rights
+        # still held and the rook is at home with nothing in the way; whether the king passes through check is
+        # left to ChessState, as with any move into check
+        for right in getattr(board, 'castling', ''):
+            colour, king_from, king_to, rook_from, rook_to = CASTLING[right]
+            if colour != self.color or location(king_from) != tuple(self.location) or location(king_to) != tuple(to_location):
+                continue
+            rook = board.get_item(location(rook_from))
+            if isinstance(rook, Rook) and rook.color == self.color and board.path_is_clear(self.location, location(rook_from)):
+                return right
+        return None
+
+    def candidate_squares(self, board):
+        x, y = self.location
+        castling = [(x + dx, y) for dx in (2, -2) if board.moving_inbounds((x + dx, y))]
+        return list(board.geometry.king_targets(self.location)) + castling
+
+    def move(self, board, to_location, player):
+        # castling moves the rook too: the record gets (rook, where it came from)
+        castling = abs(to_location[0] - self.location[0]) == 2
+        record = super().move(board, to_location, player)
+        if not castling:
+            return record
+        rook_from = (7 if to_location[0] > record[0][0] else 0, to_location[1])
+        rook = board.get_item(rook_from)
+        board.move_item(rook, ((record[0][0] + to_location[0]) // 2, to_location[1]))
+        return record + ((rook, rook_from),)
+
+    def unmove(self, board, record):
+        if len(record) > 2:
+            rook, rook_from = record[2]
+            board.move_item(rook, rook_from)
+        super().unmove(board, record)
 
 class Rook(ChessPiece):
     def __init__(self, player) -> None:
         super().__init__(letter='R', player=player)
 
-    def validate_move(self, board, to_location):
-        if not super().validate_move(board, to_location):
-            return False
-        from_location = self.location
-        moving_horizontally = board.moving_horizontally_only(from_location, to_location)
-        moving_vertically = board.moving_vertically_only(from_location, to_location)
-        if not moving_horizontally and not moving_vertically:
-            return False
-        items_on_path = board.items_on_path(from_location, to_location)
-        valid = (moving_horizontally or moving_vertically) and not items_on_path
-        return valid
+    def validate_movement(self, board, to_location):
+        direction = board.geometry.direction(self.location, to_location)
+        return direction in ORTHOGONAL_DIRECTIONS and board.path_is_clear(self.location, to_location)
+
+    def candidate_squares(self, board):
+        return sliding_squares(board, self.location, ORTHOGONAL_DIRECTIONS)
 
 class Bishop(ChessPiece):
     def __init__(self, player) -> None:
         super().__init__(letter='B', player=player)
 
-    def validate_move(self, board, to_location):
-        if not super().validate_move(board, to_location):
-            return False
-        from_location = self.location
-        moving_diagonally = board.moving_diagonally_only(from_location, to_location)
-        if not moving_diagonally:
-            return False
-        items_on_path = board.items_on_path(from_location, to_location)
-        valid = moving_diagonally and not items_on_path
-        return valid
+    def validate_movement(self, board, to_location):
+        direction = board.geometry.direction(self.location, to_location)
+        return direction in DIAGONAL_DIRECTIONS and board.path_is_clear(self.location, to_location)
+
+    def candidate_squares(self, board):
+        return sliding_squares(board, self.location, DIAGONAL_DIRECTIONS)
 
 class Pawn(ChessPiece):
     def __init__(self, player) -> None:
         super().__init__(letter='P', player=player)
 
-    def validate_move(self, board, to_location):
-        if not super().validate_move(board, to_location):
-            return False
+    def validate_movement(self, board, to_location):
         from_location = self.location
-        moving_diagonally = board.moving_diagonally_only(from_location, to_location)
-        moving_vertically = board.moving_vertically_only(from_location, to_location)
-        if not moving_diagonally and not moving_vertically:
-            return False
-        items_on_path = board.items_on_path(from_location, to_location)
-        spaces_moving = board.spaces_moving_linear(from_location, to_location)
+        forward = PAWN_DIRECTION[self.color]
+        x_moving = to_location[0] - from_location[0]
+        y_moving = to_location[1] - from_location[1]
         piece_in_to_location = board.get_item(to_location)
         enemy_piece_in_to_location = piece_in_to_location and piece_in_to_location.color != self.color
-        not_moved_yet = self.color == 'black' and from_location[1] == 6 or self.color == 'white' and from_location[1] == 1
+        not_moved_yet = from_location[1] == PAWN_START_RANK[self.color]
 
-        taking_piece = moving_diagonally and enemy_piece_in_to_location and spaces_moving == 1
-        normal_move = moving_vertically and spaces_moving == 1
-        double_first_move = moving_vertically and spaces_moving == 2 and not_moved_yet
-        en_passant = False  # TODO
-        promotion = False  # TODO
+        taking_piece = abs(x_moving) == 1 and y_moving == forward and enemy_piece_in_to_location
+        normal_move = x_moving == 0 and y_moving == forward and not piece_in_to_location
+        double_first_move = x_moving == 0 and y_moving == 2 * forward and not_moved_yet and not piece_in_to_location and board.path_is_clear(from_location, to_location)
+        en_passant = abs(x_moving) == 1 and y_moving == forward and self.en_passant_victim(board, to_location) is not None
+        # promotion happens as the pawn reaches the far rank, see move()
 
-        valid = (taking_piece or normal_move or double_first_move or en_passant) and not items_on_path
+        valid = taking_piece or normal_move or double_first_move or en_passant
         return valid
 
+    def en_passant_victim(self, board, to_location):
+        # the enemy pawn taken by moving diagonally to to_location, if that square is the board's en passant square
+        if getattr(board, 'en_passant', None) != tuple(to_location) or board.get_item(to_location):
+            return None
+        victim = board.get_item((to_location[0], self.location[1]))
+        if isinstance(victim, Pawn) and victim.color != self.color:
+            return victim
+        return None
+
+    def captured_by(self, board, to_location):
+        if to_location[0] != self.location[0] and not board.get_item(to_location):
+            return self.en_passant_victim(board, to_location)
+        return board.get_item(to_location)
+
+    def candidate_squares(self, board):
+        x, y = self.location
+        forward = PAWN_DIRECTION[self.color]
+        return [(x + dx, y + dy) for dx, dy in ((0, forward), (0, 2 * forward), (1, forward), (-1, forward)) if board.moving_inbounds((x + dx, y + dy))]
+
+# random 64 bit keys for Zobrist hashing, from a fixed seed so every process hashes a position the same way
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST_PIECES = {(colour, letter): [_zobrist_random.getrandbits(64) for _ in range(64)] for colour in ('white', 'black') for letter in 'KQRBNP'}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+
+PROMOTIONS = 'QRBN'
+
 class ChessBoard(BoardGrid):
-    def __init__(self) -> None:
+    # bitboards=True also mirrors the pieces in 64 bit occupancy boards (see bitboard.py),
+    # which validate_move and in_check use instead of walking the items
+    # zobrist is the XOR of a key per piece on its square, updated as pieces are added, moved and taken,
+    # and of keys for the castling rights and en passant file
+    # castling holds the rights still to be used, as in FEN ('KQkq', '' for none), and en_passant the square a pawn
+    # that has just moved two squares passed over
+    # halfmove_clock counts moves since the last capture or pawn move, fullmove_number goes up after each black move;
+    # neither is part of the hash, they're only carried for FEN
+    # evaluation is material plus piece-square score for white (see evaluation.py), kept up to date like the hash
+    def __init__(self, bitboards=True) -> None:
+        self.bitboards = Bitboards() if bitboards else None
+        self.zobrist = 0
+        self.evaluation = 0
+        self.castling = ''
+        self.en_passant = None
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
         super().__init__(x=8, y=8)
 
-    # def in_check(self, owner):
-    #     king = [item for item in self.items if item.player == owner and isinstance(item, King)][0]
-    #     enemy_pieces = [item for item in self.items if item.player != owner]
-    #     can_take = [item.validate_move(self, king.location) for item in enemy_pieces]
-    #     check = any(can_take)
-    #     return check
-
+    def special_moves(self):
+        # (en passant square, castling rights) in the form Bitboards takes them
+        return (square(self.en_passant) if self.en_passant is not None else None, self.castling)
+
+    def set_rights(self, castling, en_passant=None):
+        for right in set(self.castling) ^ set(castling):
+            self.zobrist ^= ZOBRIST_CASTLING[right]
+        if self.en_passant is not None:
+            self.zobrist ^= ZOBRIST_EN_PASSANT[self.en_passant[0]]
+        if en_passant is not None:
+            self.zobrist ^= ZOBRIST_EN_PASSANT[en_passant[0]]
+        self.castling = ''.join(right for right in 'KQkq' if right in castling)
+        self.en_passant = tuple(en_passant) if en_passant is not None else None
+        self.version += 1
+
+    def rights_after(self, piece, from_location, to_location):
+        # (castling, en_passant) once piece has moved: kings and rooks that move, and rooks that are taken, lose
+        # their castling rights, and a pawn moving two squares can be taken en passant
+        castling = self.castling
+        if castling:
+            for right, (colour, king_from, king_to, rook_from, rook_to) in CASTLING.items():
+                if (piece.letter == 'K' and piece.color == colour) or location(rook_from) in (tuple(from_location), tuple(to_location)):
+                    castling = castling.replace(right, '')
+        en_passant = None
+        if piece.letter == 'P' and abs(to_location[1] - from_location[1]) == 2:
+            en_passant = (from_location[0], (from_location[1] + to_location[1]) // 2)
+        return castling, en_passant
+
+    def _index_item(self, item):
+        super()._index_item(item)
+        sq = square(item.location)
+        self.zobrist ^= ZOBRIST_PIECES[(item.color, item.letter)][sq]
+        self.evaluation += PIECE_SCORES[(item.color, item.letter)][sq]
+        if self.bitboards is not None:
+            self.bitboards.add(item.color, item.letter, sq)
+
+    def _unindex_item(self, item):
+        super()._unindex_item(item)
+        sq = square(item.location)
+        self.zobrist ^= ZOBRIST_PIECES[(item.color, item.letter)][sq]
+        self.evaluation -= PIECE_SCORES[(item.color, item.letter)][sq]
+        if self.bitboards is not None:
+            self.bitboards.remove(item.color, item.letter, sq)
+
+
+FIFTY_MOVE_PLIES = 100  # plies without a capture or a pawn move that draw the game
+NOT_CACHED = object()  # what end_of_game_results gives for positions it doesn't hold, None meaning not over
+ZOBRIST_CASTLING = {right: _zobrist_random.getrandbits(64) for right in 'KQkq'}
+ZOBRIST_EN_PASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]
 
 class ChessState(BoardGameState):
-    def __init__(self, board: Board, players: List[Player]) -> None:
+    # table is the TranspositionTable searches of this state use; pass one in to share it between states
+    # legal_moves and end_of_game keep their answers in PositionCaches of their own, so move generation never
+    # pushes search results out of the table; hypothetical copies keep using the same table and caches
+    # tablebases (tablebase.Tablebases) end the game early in positions they prove drawn, and searches probe them
+    def __init__(self, board: Board, players: List[Player], table: TranspositionTable = None) -> None:
         super().__init__(board, players)
+        self.table = table if table is not None else TranspositionTable()
+        self.legal_moves_cache = PositionCache()
+        self.end_of_game_results = PositionCache()
+        self.end_of_game_cache = None
+        self.tablebases = None
+
+    def zobrist_hash(self):
+        # the same for any two states with the same pieces on the same squares and the same player to move
+        if self.player_turn.id == 'black':
+            return self.board.zobrist ^ ZOBRIST_BLACK_TO_MOVE
+        return self.board.zobrist
+
+    def position_key(self):
+        return self.zobrist_hash()
+
+    def repetitions(self):
+        # how many times the current position has come up in the turns performed on this state, including now
+        key = self.zobrist_hash()
+        return 1 + sum(1 for record in self.undo_records if record.position_key == key)
     
+    def enemy_pieces(self, owner):
+        return [item for player in self.players if player.id != owner.id for item in self.board.items_of(player)]
+
     def in_check(self, owner):
-        king = [item for item in self.board.items if item.player == owner and isinstance(item, King)][0]
-        enemy_pieces = [item for item in self.board.items if item.player != owner]
+        if self.board.bitboards is not None:
+            return self.board.bitboards.king_in_check(owner.id)
+        king = self.board.items_of(owner, King)[0]
+        enemy_pieces = self.enemy_pieces(owner)
         can_take = [item.validate_move(self.board, king.location) for item in enemy_pieces]
         check = any(can_take)
         return check
     
+    def leaves_king_in_check(self, piece, to_location):
+        # try the move on the board, look at our king, then put everything back
+        # castling also can't start from check or pass through an attacked square
+        board = self.board
+        if isinstance(piece, King) and abs(to_location[0] - piece.location[0]) == 2:
+            passing = ((piece.location[0] + to_location[0]) // 2, to_location[1])
+            if self.in_check(piece.player) or self.leaves_king_in_check(piece, passing):
+                return True
+        record = piece.move(board, to_location, piece.player)
+        check = self.in_check(piece.player)
+        piece.unmove(board, record)
+        return check
+
+    def is_legal(self, piece, to_location):
+        if not piece.validate_move(self.board, to_location):
+            return False
+        bitboards = self.board.bitboards
+        if bitboards is not None:
+            return bitboards.is_legal(piece.color, piece.letter, square(piece.location), square(to_location), *self.board.special_moves())
+        return to_location in self.legal_targets(piece)
+
+    def legal_targets(self, piece):
+        # squares piece can legally move to; with bitboards this comes from the attack maps and pins, without
+        # them each pseudo-legal move is tried on the board
+        bitboards = self.board.bitboards
+        if bitboards is not None:
+            return [location(sq) for sq in squares(bitboards.legal_targets(piece.color, piece.letter, square(piece.location), *self.board.special_moves()))]
+        return [to_location for to_location in piece.generate_moves(self.board) if not self.leaves_king_in_check(piece, to_location)]
+
+    def attacked_squares(self, player):
+        # locations player's pieces attack, from the attack maps
+        bitboards = self.board.bitboards
+        if bitboards is None:
+            raise Exception('attacked_squares needs a ChessBoard with bitboards')
+        return [location(sq) for sq in squares(bitboards.attacked_by(player.id))]
+
+    def pinned_pieces(self, owner):
+        # owner's pieces that can't leave the line between their king and an enemy rook, bishop or queen
+        bitboards = self.board.bitboards
+        if bitboards is None:
+            raise Exception('pinned_pieces needs a ChessBoard with bitboards')
+        return [self.board.get_item(location(sq)) for sq in bitboards.pins(owner.id)]
+
+    def escape_squares(self, owner):
+        # squares owner's king can move to without being in check
+        king = self.board.items_of(owner, King)[0]
+        return self.legal_targets(king)
+
+    def legal_moves(self, player=None, pseudo_legal=False):
+        # every Move the player (by default, whoever's turn it is) can make
+        # pseudo_legal=True skips the check that the move doesn't leave their own king in check
+        player = player or self.player_turn
+        cacheable = not pseudo_legal and player == self.player_turn
+        if cacheable:
+            key = self.zobrist_hash()
+            cached = self.legal_moves_cache.probe(key)
+            if cached is not None:
+                return [Move(*found) for found in cached]
+        found = []
+        for piece in self.board.items_of(player):
+            targets = piece.generate_moves(self.board) if pseudo_legal else self.legal_targets(piece)
+            for to_location in targets:
+                if piece.letter == 'P' and to_location[1] in (0, 7):
+                    found.extend((piece.location, to_location, promotion) for promotion in PROMOTIONS)
+                else:
+                    found.append((piece.location, to_location))
+        if cacheable:
+            self.legal_moves_cache.store(key, tuple(found))
+        return [Move(*found) for found in found]
+
+    def legal_turns(self):
+        return [Turn([move], player=self.player_turn) for move in self.legal_moves()]
+
+    def has_legal_move(self, player=None):
+        player = player or self.player_turn
+        for piece in self.board.items_of(player):
+            if self.legal_targets(piece):
+                return True
+        return False
+
+    def end_of_game(self):
+        # 'checkmate', 'stalemate', 'threefold repetition', 'fifty-move rule' or 'tablebase draw' if the game is over,
+        # otherwise None; done() asks twice, through win_condition_met and draw_condition_met, so the answer is kept until the next change
+        version = (self.version, id(self.board), self.board.version, self.player_turn.id)
+        if self.end_of_game_cache is not None and self.end_of_game_cache[0] == version:
+            return self.end_of_game_cache[1]
+        result = self._end_of_game()
+        if result is None and self.board.halfmove_clock >= FIFTY_MOVE_PLIES:
+            result = 'fifty-move rule'  # after mate is ruled out, a mate on the hundredth ply still counts
+        if result is None and self.tablebases is not None:
+            found = self.tablebases.probe(self)
+            if found is not None and found.outcome == 'draw':
+                result = 'tablebase draw'
+        self.end_of_game_cache = (version, result)
+        return result
+
+    def _end_of_game(self):
+        if self.repetitions() >= 3:
+            return 'threefold repetition'
+        key = self.zobrist_hash()
+        result = self.end_of_game_results.probe(key, NOT_CACHED)
+        if result is not NOT_CACHED:
+            return result
+        if self.has_legal_move(self.player_turn):
+            result = None
+        else:
+            result = 'checkmate' if self.in_check(self.player_turn) else 'stalemate'
+        self.end_of_game_results.store(key, result)
+        return result
+
     def win_condition_met(self):
-        kings = [item for item in self.board.items if isinstance(item, King)]
         if self.hypothetical:
-            # print('WE ARE IN THE MATRIX')
             return False
-        for king in kings:
-            owner = king.player
-
-            check = self.in_check(owner)
-            if check:
-                # print('#######################\ncheck detected')
-                # print(self)
-                # if the person who has just moved is in check, this is an illegal state and we're in a hypothetical loop
-                if owner != self.player_turn:
-                    return False
-                if self.hypothetical and owner==self.player_turn:
-                    input()
-                can_save = False
-                own_pieces = [item for item in self.board.items if item.player == owner]
-                # for each of your own pieces, try every move, and find if you can stop being in check
-                for item in own_pieces:
-                    for location in self.board.locations:
-                        if item.validate_move(self.board, location):
-                            # print('!!!!!!!!!!!!!!!!!!!!!!!!!\nbefore:', self)
-                            new_state = self.after(Turn([Move(item.location, location)], player=item.player))
-                            # print('?????????????????????????\nhypothetical:', new_state)
-                            # print('_________________________\nafter:', self)
-                            if not new_state.in_check(owner):
-                                can_save = True
-                            # import time
-                            # time.sleep(1)
-            
-                if not can_save:
-                    # print('checkmate')
-                    return True
-                # print('check but not mate')
-        return False
+        return self.end_of_game() == 'checkmate'
+
+    def draw_condition_met(self):
+        if self.hypothetical:
+            return False
+        return self.end_of_game() in ('stalemate', 'threefold repetition', 'fifty-move rule', 'tablebase draw')
+
+    def tablebase_result(self):
+        # tablebase.TablebaseResult for the player to move, None without tablebases or for positions they don't cover
+        return self.tablebases.probe(self) if self.tablebases is not None else None
+
+    def load_fen(self, fen):
+        # set up an empty board from Forsyth-Edwards Notation: piece placement, side to move, castling, en passant
+        # and the move counters; fields left off the end take their values at the start of a game
+        fields = fen.split()
+        if not fields:
+            raise Exception('empty FEN')
+        pieces = fen_placement(fields[0])
+        for king in 'Kk':
+            kings = sum(1 for letter, x, y in pieces if letter == king)
+            if kings != 1:
+                raise ValueError('FEN needs one ' + ('white' if king == 'K' else 'black') + ' king, not ' + str(kings))
+        self.place_pieces(pieces)
+        white, black = self.players[0], self.players[1]
+        if len(fields) > 1:
+            if fields[1] not in ('w', 'b'):
+                raise Exception('FEN side to move must be w or b, not ' + fields[1])
+            self.player_turn = white if fields[1] == 'w' else black
+        castling = fields[2] if len(fields) > 2 and fields[2] != '-' else ''
+        if any(right not in 'KQkq' for right in castling) or len(set(castling)) != len(castling):
+            raise ValueError('FEN castling rights must be - or some of KQkq, not ' + fields[2])
+        en_passant = None
+        if len(fields) > 3 and fields[3] != '-':
+            en_passant = (ascii_lowercase.index(fields[3][0]), int(fields[3][1]) - 1)
+        self.board.set_rights(castling, en_passant)
+        self.board.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        self.board.fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+
+    def place_pieces(self, pieces):
+        # pieces is [(letter, x, y), ...] with white's letters in upper case and black's in lower case
+        white, black = self.players[0], self.players[1]
+        add_item = self.board.add_item
+        for letter, x, y in pieces:
+            if letter.isupper():
+                add_item(FEN_PIECES[letter](white), (x, y))
+            else:
+                add_item(FEN_PIECES[letter.upper()](black), (x, y))
+
+    def to_fen(self):
+        rows = []
+        for y in reversed(range(8)):
+            row, empty = '', 0
+            for x in range(8):
+                item = self.board.get_item((x, y))
+                if item is None:
+                    empty += 1
+                    continue
+                if empty:
+                    row, empty = row + str(empty), 0
+                row += item.letter if item.color == 'white' else item.letter.lower()
+            rows.append(row + (str(empty) if empty else ''))
+        side = 'w' if self.player_turn.id == 'white' else 'b'
+        en_passant = self.board.en_passant
+        en_passant = ascii_lowercase[en_passant[0]] + str(en_passant[1] + 1) if en_passant is not None else '-'
+        return ' '.join(['/'.join(rows), side, self.board.castling or '-', en_passant,
+                         str(self.board.halfmove_clock), str(self.board.fullmove_number)])
+
+    def to_packed(self):
+        # the position in at most 30 bytes, for storing or sending between processes: a bit per occupied square, the
+        # side to move, castling rights and en passant file, the two move counters, then a nibble per piece
+        board = self.board
+        pieces = sorted((square(item.location), PACKED_PIECES.index(item.letter if item.color == 'white' else item.letter.lower()))
+                        for item in board.items)
+        occupied = 0
+        for sq, _ in pieces:
+            occupied |= 1 << sq
+        flags = (1 if self.player_turn.id == 'black' else 0) | sum(1 << (1 + 'KQkq'.index(right)) for right in board.castling)
+        if board.en_passant is not None:
+            flags |= (board.en_passant[0] + 1) << 5
+        codes = [code for _, code in pieces] + [0]
+        nibbles = bytes(codes[i] | codes[i + 1] << 4 for i in range(0, len(pieces), 2))
+        return PACKED_HEADER.pack(occupied, flags, board.halfmove_clock, board.fullmove_number) + nibbles
+
+    def load_packed(self, data):
+        # set up an empty board from to_packed's bytes
+        occupied, flags, halfmove_clock, fullmove_number = PACKED_HEADER.unpack_from(data)
+        nibbles = data[PACKED_HEADER.size:]
+        pieces = []
+        for index, sq in enumerate(squares(occupied)):
+            x, y = location(sq)
+            pieces.append((PACKED_PIECES[nibbles[index >> 1] >> (index & 1) * 4 & 15], x, y))
+        self.place_pieces(pieces)
+        self.player_turn = self.players[flags & 1]
+        castling = ''.join(right for index, right in enumerate('KQkq') if flags >> (1 + index) & 1)
+        en_passant_file = flags >> 5 & 15
+        en_passant = None
+        if en_passant_file:
+            en_passant = (en_passant_file - 1, 5 if flags & 1 == 0 else 2)
+        self.board.set_rights(castling, en_passant)
+        self.board.halfmove_clock = halfmove_clock
+        self.board.fullmove_number = fullmove_number
 
 class Chess(BoardGame):
-    def __init__(self) -> None:
+    # pass in players to choose who plays, e.g. Chess(black=ComputerPlayer('Computer', 'black')) from chess_search
+    # and a FEN string, or ChessState.to_packed's bytes, to start from a position other than the usual one
+    def __init__(self, white: Player = None, black: Player = None, fen=None, packed=None) -> None:
 
-        black = Player(name='Alice', id='black')
-        white = Player(name='Bob', id='white')
+        black = black or Player(name='Alice', id='black')
+        white = white or Player(name='Bob', id='white')
 
         self.white = white
         self.black = black
@@ -212,26 +556,10 @@ class Chess(BoardGame):
 
         self.action_list = [Move]
 
-        board.add_item(item=Rook(player=white), location=(0,0))
-        board.add_item(item=Knight(player=white), location=(1,0))
-        board.add_item(item=Bishop(player=white), location=(2,0))
-        board.add_item(item=Queen(player=white), location=(3,0))
-        board.add_item(item=King(player=white), location=(4,0))
-        board.add_item(item=Bishop(player=white), location=(5,0))
-        board.add_item(item=Knight(player=white), location=(6,0))
-        board.add_item(item=Rook(player=white), location=(7,0))
-
-        board.add_item(item=Rook(player=black), location=(0,7))
-        board.add_item(item=Knight(player=black), location=(1,7))
-        board.add_item(item=Bishop(player=black), location=(2,7))
-        board.add_item(item=Queen(player=black), location=(3,7))
-        board.add_item(item=King(player=black), location=(4,7))
-        board.add_item(item=Bishop(player=black), location=(5,7))
-        board.add_item(item=Knight(player=black), location=(6,7))
-        board.add_item(item=Rook(player=black), location=(7,7))
-        for i in range(8):
-            board.add_item(item=Pawn(player=white), location=(i,1))
-            board.add_item(item=Pawn(player=black), location=(i,6))
+        if packed is not None:
+            state.load_packed(packed)
+        else:
+            state.load_fen(fen or START_FEN)
     
     def play_demo_game(self):
         [move.perform(board_game_state=self.state) for move in moves_from_notation(notation='e4 e5', state=self.state)]
@@ -252,22 +580,93 @@ class Chess(BoardGame):
         assert self.state.game_phase == GamePhase.COMPLETE
 
 
-def move(board_game_state, player, move_from: Tuple[int], move_to: Tuple[int]):
+FEN_PIECES = {'K': King, 'Q': Queen, 'R': Rook, 'B': Bishop, 'N': Knight, 'P': Pawn}
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+PACKED_PIECES = 'PNBRQKpnbrqk'  # a piece's nibble in ChessState.to_packed is its index here
+PACKED_HEADER = struct.Struct('<QHHH')  # occupied squares, flags, halfmove clock, fullmove number
+
+@lru_cache(maxsize=4096)
+def fen_placement(placement):
+    # FEN's first field as ((letter, x, y), ...); cached, as analysis jobs tend to load the same positions repeatedly
+    rows = placement.split('/')
+    if len(rows) != 8:
+        raise Exception('FEN placement needs 8 ranks: ' + placement)
+    pieces = []
+    for rank, row in enumerate(rows):
+        x = 0
+        for letter in row:
+            if letter.isdigit():
+                x += int(letter)
+                continue
+            if letter.upper() not in FEN_PIECES:
+                raise Exception('not a FEN piece: ' + letter)
+            pieces.append((letter, x, 7 - rank))
+            x += 1
+        if x != 8:
+            raise Exception('FEN rank ' + str(8 - rank) + ' doesn\'t have 8 squares: ' + row)
+    return tuple(pieces)
+
+def encode_move(move_from, move_to, promotion=None):
+    # 16 bits: from square in the low 6, to square in the next 6, then 1 + the promotion's index in PROMOTIONS
+    return square(move_from) | square(move_to) << 6 | (PROMOTIONS.index(promotion) + 1 if promotion else 0) << 12
+
+def decode_move(code):
+    promotion = (code >> 12) & 7
+    if promotion:
+        return (location(code & 63), location((code >> 6) & 63), PROMOTIONS[promotion - 1])
+    return (location(code & 63), location((code >> 6) & 63))
+
+def move(board_game_state, player, move_from: Tuple[int], move_to: Tuple[int], promotion=None):
+    # promotion is the letter of the piece a pawn reaching the far rank becomes, a queen if not given
     board = board_game_state.board
+    move_from, move_to = tuple(move_from), tuple(move_to)
     piece = board.get_item(move_from)
     if not piece:
         raise Exception('nothing found at location ', move_from)
     current_player = board_game_state.player_turn
-    if current_player == piece.player:
-        piece.move(board, move_to, current_player)
-    else:
+    if current_player != piece.player:
         raise Exception('don\'t move your opponent\'s piece!')
+    if promotion is not None and (piece.letter != 'P' or move_to[1] not in (0, 7) or promotion not in PROMOTIONS):
+        raise Exception('can\'t promote to ' + str(promotion) + ' moving from ' + str(move_from) + ' to ' + str(move_to))
+    rights = (board.castling, board.en_passant)
+    counters = (board.halfmove_clock, board.fullmove_number)
+    new_rights = board.rights_after(piece, move_from, move_to)
+    piece_record = piece.move(board, move_to, current_player)
+    promoted = None
+    if piece.letter == 'P' and move_to[1] in (0, 7):
+        promoted = FEN_PIECES[promotion or 'Q'](piece.player)
+        board.remove_item(piece)
+        board.add_item(promoted, move_to)
+    board.set_rights(*new_rights)
+    board.halfmove_clock = 0 if piece.letter == 'P' or piece_record[1] else board.halfmove_clock + 1
+    if piece.color == 'black':
+        board.fullmove_number += 1
+    return (piece, piece_record, promoted, rights, counters)
+
+def unmove(board_game_state, player, record, move_from, move_to, promotion=None):
+    piece, piece_record, promoted, rights, counters = record
+    board = board_game_state.board
+    if promoted:
+        board.remove_item(promoted)
+        board.add_item(piece, promoted.location)
+    piece.unmove(board, piece_record)
+    board.set_rights(*rights)
+    board.halfmove_clock, board.fullmove_number = counters
 
 class Move(Action):
-    def __init__(self, move_from, move_to) -> None:
+    def __init__(self, move_from, move_to, promotion=None) -> None:
         fn = move
         params = {'move_from': move_from, 'move_to': move_to}
-        super().__init__(fn, params)
+        if promotion is not None:
+            params['promotion'] = promotion
+        super().__init__(fn, params, undo_fn=unmove)
+
+    def as_tuple(self):
+        # (from, to), or (from, to, promotion) for promotions; Move(*move.as_tuple()) makes the same move
+        params = self.params
+        if 'promotion' in params:
+            return (tuple(params['move_from']), tuple(params['move_to']), params['promotion'])
+        return (tuple(params['move_from']), tuple(params['move_to']))
 
 def moves_from_notation(state, notation='e3 e5'):
     # does not support full range of PGN or chess notation
@@ -306,14 +705,12 @@ def moves_from_notation(state, notation='e3 e5'):
 
     white_location = get_location(white_move[-2:])
 
-    piece_to_move = [item for item in board.items if item.player.id=='white' and isinstance(item, white_piece) and item.validate_move(board, white_location)]
+    piece_to_move = [item for item in board.items_of(white, white_piece) if state.is_legal(item, white_location)]
     assert len(piece_to_move) == 1
     current_white_location = piece_to_move[0].location
 
     white_turn = Turn([Move(current_white_location, white_location)], player=white)
 
-    bgs = state.after(white_turn)
-    board = bgs.board
     if len(black_move) == 0:
         return ([white_turn])
     
@@ -322,30 +719,16 @@ def moves_from_notation(state, notation='e3 e5'):
     else:
         black_piece = get_piece(black_move[0])
     black_location = get_location(black_move[-2:])
-    piece_to_move = [item for item in board.items if item.player.id=='black' and isinstance(item, black_piece) and item.validate_move(board, black_location)]
-    assert len(piece_to_move) == 1
-    current_black_location = piece_to_move[0].location
+    with state.hypothetically(white_turn):
+        piece_to_move = [item for item in board.items_of(black, black_piece) if state.is_legal(item, black_location)]
+        assert len(piece_to_move) == 1
+        current_black_location = piece_to_move[0].location
 
     black_turn = Turn([Move(current_black_location, black_location)], player=black)
     return (white_turn, black_turn)
 
 
-# def game_from_pgn(pgn):
-#     """
-#     [Event ""]
-#     [Site ""]
-#     [Date "????.??.??"]
-#     [Round ""]
-#     [White "White"]
-#     [Black "Black"]
-#     [TimeControl "-"]
-#     [Result "1-0"]
-
-#     1.e4 e5 2.Nf3 f6 3.Nxe5 fxe5 4.Qh5+ Ke7 5.Qxe5+ Kf7 6.Bc4+ d5 7.Bxd5+ 
-#     Kg6 8.h4 h5 9.Bxb7 Bxb7 10.Qf5+ Kh6 11.d4+ g5 12.Qf7 Qe7 13.hxg5+ Qxg5 
-#     14.Rxh5# 1-0
-#     """
-#     pass
+# games in PGN: see pgn.py (read_games, game_from_pgn, validate_games)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,376 @@
+import os
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from boardgame import Player
+from actions import Turn
+from chess import Chess, ChessState, Move, encode_move, decode_move, FIFTY_MOVE_PLIES
+from bitboard import square
+from transposition import EXACT, LOWER_BOUND, UPPER_BOUND, SharedTranspositionTable
+from evaluation import PIECE_VALUES, piece_square
+
+MATE = 100000
+MATE_BOUND = MATE - 1000  # scores beyond this are mates, stored in the table relative to the node they're found at
+INFINITY = MATE + 1
+TIME_CHECK_NODES = 256  # look at the clock this often
+
+SearchResult = namedtuple('SearchResult', ['move', 'score', 'depth', 'nodes', 'seconds', 'nodes_per_second', 'principal_variation'])
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def material(state: ChessState):
+    # material balance from the point of view of the player to move; piece_square, the default, adds where the pieces stand
+    pieces = state.board.bitboards.pieces
+    score = 0
+    for (colour, letter), bitboard in pieces.items():
+        value = PIECE_VALUES[letter] * bin(bitboard).count('1')
+        score += value if colour == 'white' else -value
+    return score if state.player_turn.id == 'white' else -score
+
+
+def book_search_result(book, state, rng=None):
+    # a SearchResult for a book move, depth 0 and no nodes searched, or None when there's no book or no book move
+    if book is None:
+        return None
+    started = time.perf_counter()
+    move = book.choose_move(state, rng)
+    if move is None:
+        return None
+    return SearchResult(move, 0, 0, 0, time.perf_counter() - started, 0, [move])
+
+
+def tablebase_score(found, ply):
+    # a TablebaseResult as a search score at ply, on the same scale as the mates the search finds itself
+    if found.outcome == 'draw':
+        return 0
+    score = MATE - ply - found.plies
+    return score if found.outcome == 'win' else -score
+
+
+def tablebase_search_result(tablebases, state):
+    # a SearchResult for the tablebases' best move, or None when they don't cover the position
+    if tablebases is None:
+        return None
+    started = time.perf_counter()
+    found = tablebases.probe(state)
+    if found is None:
+        return None
+    move = tablebases.best_move(state)
+    if move is None:
+        return None
+    return SearchResult(move, tablebase_score(found, 0), 0, 0, time.perf_counter() - started, 0, [move])
+
+
+class ChessEngine():
+    # negamax alpha-beta search with iterative deepening, a transposition table, quiescence search on captures
+    # and move ordering by table move, captures (most valuable victim, least valuable attacker), killers and history
+    # works in place on a ChessState with bitboards, playing and taking back moves
+    # seed shuffles the order of quiet moves that are otherwise tied, so parallel searchers explore differently
+    # book is an OpeningBook whose moves are played without searching while the game is in it; with a seed they're
+    # picked at random weighted by how often they were played, otherwise the most played
+    # tablebases (tablebase.Tablebases, or the state's own) give perfect moves at the root and exact scores in the tree
+    def __init__(self, time_limit=1.0, max_depth=64, evaluate=piece_square, table=None, seed=None, book=None, tablebases=None) -> None:
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.evaluate = evaluate
+        self.table = table  # None to use the state's own table
+        self.random = random.Random(seed) if seed else None
+        self.book = book
+        self.tablebases = tablebases
+        self.probing = None  # the tablebases of the search under way
+        self.nodes = 0
+        self.deadline = None
+        self.killers = {}
+        self.history = {}
+
+    def search(self, state: ChessState, time_limit=None, max_depth=None, new_search=True) -> SearchResult:
+        # new_search=False when the table's generation is managed elsewhere, e.g. by ParallelChessEngine
+        time_limit = self.time_limit if time_limit is None else time_limit
+        max_depth = self.max_depth if max_depth is None else max_depth
+        book_result = book_search_result(self.book, state, self.random)
+        if book_result is not None:
+            return book_result
+        self.probing = self.tablebases if self.tablebases is not None else state.tablebases
+        tablebase_result = tablebase_search_result(self.probing, state)
+        if tablebase_result is not None:
+            return tablebase_result
+        table = self.table if self.table is not None else state.table
+        if new_search:
+            table.new_search()
+        self.nodes = 0
+        self.killers = {}
+        self.history = {}
+        started = time.perf_counter()
+        self.deadline = started + time_limit if time_limit else None
+
+        result = None
+        was_hypothetical = state.hypothetical
+        state.hypothetical = True  # skips end of game checks in the states we pass through
+        try:
+            for depth in range(1, max_depth + 1):
+                try:
+                    score = self.negamax(state, table, depth, -INFINITY, INFINITY, ply=0)
+                except SearchTimeout:
+                    break
+                seconds = time.perf_counter() - started
+                pv = self.principal_variation(state, table, depth)
+                result = SearchResult(pv[0] if pv else None, score, depth, self.nodes, seconds, self.nodes / seconds if seconds else 0, pv)
+                if abs(score) > MATE_BOUND:
+                    break  # found a forced mate, deeper won't change it
+        finally:
+            state.hypothetical = was_hypothetical
+
+        if result is None:
+            # out of time before depth 1 finished: any legal move beats none
+            moves = self.ordered_moves(state, table, 0)
+            result = SearchResult(moves[0] if moves else None, 0, 0, 0, 0, 0, moves[:1])
+        # report the work done in total, including any unfinished last iteration
+        seconds = time.perf_counter() - started
+        return result._replace(nodes=self.nodes, seconds=seconds, nodes_per_second=self.nodes / seconds if seconds else 0)
+
+    def check_clock(self):
+        if self.deadline is not None and self.nodes % TIME_CHECK_NODES == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+    @staticmethod
+    def play(state, move):
+        turn = Turn([Move(*move)], player=state.player_turn)
+        return state.hypothetically(turn)
+
+    def negamax(self, state, table, depth, alpha, beta, ply):
+        self.nodes += 1
+        self.check_clock()
+        if ply and state.repetitions() >= 2:
+            return 0  # heading for a repetition, call it a draw
+        if ply and state.board.halfmove_clock >= FIFTY_MOVE_PLIES:
+            return -MATE + ply if state.in_check(state.player_turn) and not state.has_legal_move() else 0
+        if ply and self.probing is not None and len(state.board.items) <= self.probing.max_pieces:
+            found = self.probing.probe(state)
+            if found is not None:
+                return tablebase_score(found, ply)
+        if depth <= 0:
+            return self.quiescence(state, alpha, beta, ply)
+
+        key = state.zobrist_hash()
+        entry = table.probe(key)
+        table_move = None
+        if entry is not None:
+            table_move = entry.move
+            if ply and entry.depth >= depth:
+                score = self.score_from_table(entry.value, ply)
+                if entry.flag == EXACT or entry.flag == LOWER_BOUND and score >= beta or entry.flag == UPPER_BOUND and score <= alpha:
+                    return score
+
+        moves = self.ordered_moves(state, table, ply, table_move)
+        if not moves:
+            return -MATE + ply if state.in_check(state.player_turn) else 0
+
+        original_alpha = alpha
+        best_score, best_move = -INFINITY, None
+        for move in moves:
+            with self.play(state, move):
+                score = -self.negamax(state, table, depth - 1, -beta, -alpha, ply + 1)
+            if score > best_score:
+                best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if self.capture_value(state, move) is None:
+                    killers = self.killers.setdefault(ply, [])
+                    if move not in killers:
+                        killers.insert(0, move)
+                        del killers[2:]
+                    self.history[move] = self.history.get(move, 0) + depth * depth
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        table.store(key, depth, self.score_to_table(best_score, ply), flag, best_move)
+        return best_score
+
+    def quiescence(self, state, alpha, beta, ply):
+        # only captures and promotions, until the position is quiet, standing pat on the static evaluation; in check
+        # there's no standing pat, every way out is searched, and none is mate
+        self.nodes += 1
+        self.check_clock()
+        if state.in_check(state.player_turn):
+            moves = self.ordered_moves(state, None, ply)
+            if not moves:
+                return -MATE + ply
+        else:
+            stand_pat = self.evaluate(state)
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+            moves = self.ordered_captures(state)
+        for move in moves:
+            with self.play(state, move):
+                score = -self.quiescence(state, -beta, -alpha, ply + 1)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    @staticmethod
+    def capture_value(state, move):
+        # for captures and promotions, the moves quiescence searches: most valuable victim (or promotion) first,
+        # then least valuable attacker; None for quiet moves
+        bitboards = state.board.bitboards
+        victim = bitboards.piece_on[square(move[1])]
+        attacker = bitboards.piece_on[square(move[0])]
+        value = PIECE_VALUES[victim[1]] if victim else 0
+        if not victim and attacker[1] == 'P' and tuple(move[1]) == state.board.en_passant:
+            value = PIECE_VALUES['P']
+        if len(move) > 2:
+            value += PIECE_VALUES[move[2]] - PIECE_VALUES['P']
+        return value * 10 - PIECE_VALUES[attacker[1]] if value else None
+
+    def legal_moves(self, state):
+        return [move.as_tuple() for move in state.legal_moves()]
+
+    def ordered_moves(self, state, table, ply, table_move=None):
+        killers = self.killers.get(ply, [])
+        history = self.history
+
+        def order(move):
+            if move == table_move:
+                return (0, 0)
+            value = self.capture_value(state, move)
+            if value is not None:
+                return (1, -value)
+            if move in killers:
+                return (2, killers.index(move))
+            return (3, -history.get(move, 0), self.random.random() if self.random else 0)
+
+        return sorted(self.legal_moves(state), key=order)
+
+    def ordered_captures(self, state):
+        captures = [(value, move) for move in self.legal_moves(state) for value in [self.capture_value(state, move)] if value is not None]
+        captures.sort(key=lambda capture: -capture[0])
+        return [move for value, move in captures]
+
+    @staticmethod
+    def score_to_table(score, ply):
+        if score > MATE_BOUND:
+            return score + ply
+        if score < -MATE_BOUND:
+            return score - ply
+        return score
+
+    @staticmethod
+    def score_from_table(score, ply):
+        if score > MATE_BOUND:
+            return score - ply
+        if score < -MATE_BOUND:
+            return score + ply
+        return score
+
+    def principal_variation(self, state, table, depth):
+        # follow the table's best moves from the root, checking each one is still legal
+        pv = []
+        turns = []
+        try:
+            for _ in range(depth):
+                entry = table.probe(state.zobrist_hash())
+                if entry is None or entry.move is None or entry.move not in self.legal_moves(state):
+                    break
+                pv.append(entry.move)
+                turn = Turn([Move(*entry.move)], player=state.player_turn)
+                turn.perform(state)
+                turns.append(turn)
+        finally:
+            for turn in reversed(turns):
+                turn.undo(state)
+        return pv
+
+
+def _shared_table(size, name):
+    return SharedTranspositionTable(size, name=name,
+                                    encode_move=lambda move: encode_move(*move) if move else 0,
+                                    decode_move=lambda code: decode_move(code) if code else None)
+
+
+_attached_tables = {}  # shared memory name -> this process's handle on it
+
+
+def _lazy_smp_worker(packed, table_name, table_size, time_limit, max_depth, seed):
+    # runs in a worker process: search the position from its packed bytes, sharing results through the table
+    if table_name not in _attached_tables:
+        _attached_tables[table_name] = _shared_table(table_size, table_name)
+    state = Chess(packed=packed).state
+    engine = ChessEngine(time_limit=time_limit, max_depth=max_depth, table=_attached_tables[table_name], seed=seed)
+    result = engine.search(state, new_search=False)
+    return (encode_move(*result.move) if result.move else 0, result.score, result.depth, result.nodes)
+
+
+class ParallelChessEngine():
+    # lazy SMP: every worker process runs the same iterative deepening search from the root with slightly different
+    # move ordering, and they share a transposition table in shared memory, so each one's results cut the others'
+    # searches short; positions go to the workers as ChessState.to_packed bytes rather than pickled states
+    # the workers only see the position, not how it was reached, so they don't spot repetitions of earlier positions
+    # with ParallelChessEngine(workers=8) as engine:
+    #     result = engine.search(state)
+    def __init__(self, workers=None, time_limit=1.0, max_depth=64, table_size=1 << 20, book=None, tablebases=None) -> None:
+        self.workers = workers or os.cpu_count()
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.book = book  # book and tablebase moves are played without starting the workers
+        self.tablebases = tablebases
+        self.table = _shared_table(table_size, None)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown()
+        self.table.close()
+
+    def search(self, state: ChessState, time_limit=None, max_depth=None) -> SearchResult:
+        time_limit = self.time_limit if time_limit is None else time_limit
+        max_depth = self.max_depth if max_depth is None else max_depth
+        book_result = book_search_result(self.book, state)
+        if book_result is not None:
+            return book_result
+        tablebase_result = tablebase_search_result(self.tablebases if self.tablebases is not None else state.tablebases, state)
+        if tablebase_result is not None:
+            return tablebase_result
+        started = time.perf_counter()
+        self.table.new_search()
+        packed = state.to_packed()
+        futures = [self.pool.submit(_lazy_smp_worker, packed, self.table.name, self.table.size, time_limit, max_depth, seed)
+                   for seed in range(self.workers)]
+        results = [future.result() for future in futures]
+        seconds = time.perf_counter() - started
+        nodes = sum(result[3] for result in results)
+        # the deepest finished search wins; ties go to the earliest worker, whose move ordering isn't shuffled
+        code, score, depth, _ = max(results, key=lambda result: result[2])
+        move = decode_move(code) if code else None
+        return SearchResult(move, score, depth, nodes, seconds, nodes / seconds if seconds else 0, [move] if move else [])
+
+
+class ComputerPlayer(Player):
+    # a Player whose turns are chosen by a ChessEngine, see BoardGame.play
+    def __init__(self, name: str, id: str, engine: ChessEngine = None) -> None:
+        super().__init__(name, id)
+        self.engine = engine or ChessEngine()
+        self.last_result = None
+
+    def choose_turn(self, state):
+        self.last_result = self.engine.search(state)
+        if self.last_result.move is None:
+            return None
+        return Turn([Move(*self.last_result.move)], player=self)
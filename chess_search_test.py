@@ -0,0 +1,102 @@
+import unittest
+
+from chess import Chess, moves_from_notation
+from chess_search import ChessEngine, ComputerPlayer, ParallelChessEngine, MATE_BOUND, INFINITY
+from transposition import SharedTranspositionTable
+from boardgame import GamePhase
+
+class TestChessSearch(unittest.TestCase):
+    def setUp(self) -> None:
+        self.chess = Chess()
+        self.state = self.chess.state
+
+    def play(self, *notations):
+        for notation in notations:
+            for turn in moves_from_notation(self.state, notation):
+                turn.perform(board_game_state=self.state)
+
+    def test_finds_mate_in_one(self):
+        self.play('e4 e5', 'Bc4 Nc6', 'Qh5 Nf6')
+        before = repr(self.state.board)
+        result = ChessEngine(time_limit=10, max_depth=3).search(self.state)
+        assert result.move == ((7,4), (5,6))
+        assert result.score > MATE_BOUND
+        assert result.nodes > 0 and result.depth >= 1 and result.nodes_per_second > 0
+        assert repr(self.state.board) == before and not self.state.hypothetical
+
+    def test_wins_material(self):
+        self.play('e4 e5', 'Nf3 Qg5')
+        result = ChessEngine(time_limit=10, max_depth=2).search(self.state)
+        assert result.move == ((5,2), (6,4))
+
+    def test_table_holds_only_search_results(self):
+        # legal move generation and end of game checks keep to their own caches
+        self.play('e4 e5', 'Nf3 Nc6')
+        ChessEngine(time_limit=10, max_depth=3).search(self.state)
+        table = self.state.table
+        stores = table.stores
+        self.state.legal_moves()
+        self.state.end_of_game()
+        assert table.stores == stores and len(self.state.legal_moves_cache) > 0
+        assert all(isinstance(entry.value, int) for entry in table.deepest + table.newest if entry is not None)
+
+    def test_en_passant_and_promotions_are_tactical(self):
+        state = Chess(fen='4k3/1P6/8/3pP3/8/8/8/4K3 w - d6 0 1').state
+        engine = ChessEngine()
+        assert engine.capture_value(state, ((4,4), (3,5))) is not None  # exd6 takes the pawn on d5
+        assert engine.capture_value(state, ((1,6), (1,7), 'Q')) > engine.capture_value(state, ((1,6), (1,7), 'N'))
+        assert engine.capture_value(state, ((4,4), (4,5))) is None
+        captures = engine.ordered_captures(state)
+        assert captures[0] == ((1,6), (1,7), 'Q') and ((4,4), (3,5)) in captures
+
+    def test_quiescence_does_not_stand_pat_in_check(self):
+        # fool's mate: white is a pawn up on material but mated
+        self.play('f3 e5', 'g4 Qh4')
+        score = ChessEngine().quiescence(self.state, -INFINITY, INFINITY, 0)
+        assert score < -MATE_BOUND
+
+    def test_fifty_move_rule(self):
+        # a rook up, but every white move except a capture or pawn move reaches the hundredth ply
+        state = Chess(fen='k7/8/8/8/8/8/8/KR6 w - - 99 80').state
+        result = ChessEngine(time_limit=10, max_depth=3).search(state)
+        assert result.score == 0
+        state = Chess(fen='k7/8/8/8/8/8/8/KR6 w - - 100 80').state
+        assert state.end_of_game() == 'fifty-move rule' and state.done() and state.winner() is None
+        # mate on the hundredth ply still counts
+        state = Chess(fen='k7/2K5/8/8/8/8/8/R7 b - - 100 80').state
+        assert state.end_of_game() == 'checkmate'
+
+    def test_stops_on_time(self):
+        result = ChessEngine(time_limit=0.05).search(self.state)
+        assert result.move is not None
+        assert result.seconds < 1
+
+    def test_computer_player_plays(self):
+        chess = Chess(black=ComputerPlayer(name='Computer', id='black', engine=ChessEngine(time_limit=10, max_depth=1)))
+        for turn in moves_from_notation(chess.state, 'f3 '):
+            turn.perform(board_game_state=chess.state)
+        turn = chess.state.player_turn.choose_turn(chess.state)
+        turn.perform(board_game_state=chess.state)
+        assert len(chess.state.turns) == 2 and chess.state.game_phase != GamePhase.COMPLETE
+
+    def test_parallel_search_finds_mate(self):
+        self.play('e4 e5', 'Bc4 Nc6', 'Qh5 Nf6')
+        with ParallelChessEngine(workers=2, time_limit=10, max_depth=3, table_size=1 << 12) as engine:
+            result = engine.search(self.state)
+            assert len(engine.table) > 0
+        assert result.move == ((7,4), (5,6))
+        assert result.score > MATE_BOUND and result.nodes > 0
+
+    def test_shared_table_attaches_by_name(self):
+        table = SharedTranspositionTable(size=1 << 4)
+        try:
+            table.store(12345, depth=3, value=-250, move=7)
+            other = SharedTranspositionTable(size=1 << 4, name=table.name)
+            entry = other.probe(12345)
+            assert (entry.depth, entry.value, entry.move) == (3, -250, 7)
+            other.close()
+        finally:
+            table.close()
+
+if __name__ == '__main__':
+    unittest.main()
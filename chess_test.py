@@ -1,6 +1,10 @@
+import random
 import unittest
 
-from chess import Chess, ChessBoard, ChessPiece, King, Knight, Queen, Pawn, Turn, Move
+from boardgame import Player, GamePhase
+from transposition import TranspositionTable
+from persistent import TurnHistory
+from chess import Chess, ChessBoard, ChessState, ChessPiece, King, Knight, Queen, Rook, Bishop, Pawn, Turn, Move, moves_from_notation, START_FEN
 
 class TestChess(unittest.TestCase):
     def setUp(self) -> None:
@@ -32,5 +36,236 @@ class TestChess(unittest.TestCase):
         Turn(actions=[Move((0,6), (0,5))], player=self.chess.black).perform(board_game_state=self.chess.state)
         assert isinstance(self.board.get_item(location=(0,3)), Pawn)
 
+    def test_cannot_place_on_occupied_square(self):
+        with self.assertRaises(Exception):
+            self.board.add_item(item=Knight(player=self.chess.white), location=(4,1))
+
+    def test_occupancy_follows_moves(self):
+        Turn(actions=[Move((6,0), (5,2))], player=self.chess.white).perform(board_game_state=self.chess.state)
+        assert self.board.get_item(location=(6,0)) is None
+        assert isinstance(self.board.get_item(location=(5,2)), Knight)
+        assert len(self.board.occupancy) == len(self.board.items)
+
+    def test_piece_indices_follow_captures(self):
+        assert len(self.board.items_of(self.chess.white)) == 16
+        assert len(self.board.items_of(self.chess.black, Knight)) == 2
+        self.chess.play_demo_game()
+        assert len(self.board.items_of(item_type=King)) == 2
+        assert self.board.items_of(self.chess.black, Queen)[0].location == (6,4)
+        assert sorted(map(id, self.board.items_of())) == sorted(map(id, self.board.items))
+
+    def test_bitboards_agree_with_items(self):
+        random.seed(0)
+        white, black = Player(name='Bob', id='white'), Player(name='Alice', id='black')
+        for _ in range(30):
+            boards = [ChessBoard(bitboards=True), ChessBoard(bitboards=False)]
+            locations = random.sample([(x, y) for x in range(8) for y in range(8)], 16)
+            pieces = [(King, white), (King, black)] + [(random.choice([Queen, Rook, Bishop, Knight, Pawn]), random.choice([white, black])) for _ in range(14)]
+            for board in boards:
+                for (piece, player), location in zip(pieces, locations):
+                    if piece is Pawn and location[1] in (0, 7):
+                        piece = Knight
+                    board.add_item(piece(player), location)
+            with_bitboards, without_bitboards = boards
+            for item, other in zip(with_bitboards.items, without_bitboards.items):
+                for location in with_bitboards.locations:
+                    assert item.validate_move(with_bitboards, location) == other.validate_move(without_bitboards, location), (with_bitboards, item, location)
+            for player in (white, black):
+                states = [ChessState(board, [white, black]) for board in boards]
+                assert states[0].in_check(player) == states[1].in_check(player)
+
+    def test_legal_moves_from_start(self):
+        assert len(self.chess.state.legal_moves()) == 20
+        assert len(ChessState(ChessBoard(bitboards=False), self.chess.state.players).legal_moves(self.chess.white)) == 0
+
+    def test_pinned_piece_cannot_move(self):
+        white, black = Player(name='Bob', id='white'), Player(name='Alice', id='black')
+        for bitboards in (True, False):
+            board = ChessBoard(bitboards=bitboards)
+            board.add_item(King(white), (4,0))
+            board.add_item(Bishop(white), (4,1))
+            board.add_item(Rook(black), (4,7))
+            board.add_item(King(black), (0,7))
+            state = ChessState(board, [white, black])
+            assert len(state.legal_moves(pseudo_legal=True)) == 4 + 9
+            assert len(state.legal_moves()) == 4
+            assert all(move.params['move_from'] == (4,0) for move in state.legal_moves())
+
+    def test_stalemate(self):
+        white, black = Player(name='Bob', id='white'), Player(name='Alice', id='black')
+        board = ChessBoard()
+        board.add_item(King(white), (5,6))
+        board.add_item(Queen(white), (6,5))
+        board.add_item(King(black), (7,7))
+        state = ChessState(board, [black, white])
+        assert state.end_of_game() == 'stalemate'
+        assert state.done() and not state.win_condition_met()
+
+    def test_undo_restores_state(self):
+        state = self.chess.state
+        before = (repr(self.board), dict(self.board.bitboards.pieces), state.player_turn, state.game_phase, len(state.turns))
+        for turn in moves_from_notation(state, 'e4 d5'):
+            turn.perform(board_game_state=state)
+        capture = Turn([Move((4,3), (3,4))], player=self.chess.white)
+        with state.hypothetically(capture):
+            assert state.hypothetical
+            assert len(self.board.items_of(self.chess.black, Pawn)) == 7
+        assert len(self.board.items_of(self.chess.black, Pawn)) == 8
+        assert not state.hypothetical
+        state.undo()
+        state.undo()
+        assert (repr(self.board), dict(self.board.bitboards.pieces), state.player_turn, state.game_phase, len(state.turns)) == before
+
+    def test_snapshots_do_not_change(self):
+        state = self.chess.state
+        start = state.snapshot()
+        peek = state.snapshot_after(Turn([Move((4,1), (4,3))], player=self.chess.white))
+        assert isinstance(peek.board.get_item((4,3)).kind(self.chess.white), Pawn)
+        assert self.board.get_item((4,3)) is None and len(state.turns) == 0
+        for turn in moves_from_notation(state, 'e4 e5'):
+            turn.perform(board_game_state=state)
+        later = state.snapshot()
+        assert start.board.get_item((4,1)).letter == 'P' and start.board.get_item((4,3)) is None
+        assert later.board.get_item((4,3)).letter == 'P' and later.player_turn == 'white' and len(later.turns) == 2
+        assert repr(later.board) == repr(self.board)
+        # only the changed squares' part of the board was copied
+        assert later.board.cells.root[0] is start.board.cells.root[0]
+
+    def test_after_shares_turn_history(self):
+        state = self.chess.state
+        for turn in moves_from_notation(state, 'e4 e5'):
+            turn.perform(board_game_state=state)
+        hypothetical = state.after(Turn([Move((6,0), (5,2))], player=self.chess.white))
+        assert len(hypothetical.turns) == 3 and len(state.turns) == 2
+        assert hypothetical.turns[0] is state.turns[0]
+        hypothetical.undo()
+        assert hypothetical.board.get_item((6,0)) is not None
+
+    def test_turn_history_indexing(self):
+        history = TurnHistory(range(5))
+        branch = history.branch()
+        assert history[0] == 0 and history[-2] == 3 and history[1:3] == [1, 2] and history[-1] == 4
+        history.append(5)
+        branch.append(50)
+        assert history[-2] == 4 and history[5] == 5 and list(history) == [0, 1, 2, 3, 4, 5]
+        assert branch[-2] == 4 and branch[5] == 50 and list(branch) == [0, 1, 2, 3, 4, 50]
+        assert history.pop() == 5 and history[-1] == 4 and len(history.indexed) == 5
+        with self.assertRaises(IndexError):
+            history[5]
+
+    def test_zobrist_hash_and_repetition(self):
+        state = self.chess.state
+        start = state.zobrist_hash()
+        for turn in moves_from_notation(state, 'Nf3 Nf6'):
+            turn.perform(board_game_state=state)
+        assert state.zobrist_hash() != start
+        for turn in moves_from_notation(state, 'Ng1 Ng8'):
+            turn.perform(board_game_state=state)
+        assert state.zobrist_hash() == start and state.repetitions() == 2
+        with state.hypothetically(Turn([Move((4,1), (4,3))], player=self.chess.white)):
+            after_e4 = state.zobrist_hash()
+        assert after_e4 != start and state.zobrist_hash() == start
+        for notation in ['Nf3 Nf6', 'Ng1 Ng8']:
+            for turn in moves_from_notation(state, notation):
+                turn.perform(board_game_state=state)
+        assert state.end_of_game() == 'threefold repetition'
+        assert state.game_phase == GamePhase.COMPLETE
+
+    def test_transposition_table_keeps_deep_results(self):
+        table = TranspositionTable(size=4)
+        table.store(1, depth=5, value=10)
+        table.store(5, depth=1, value=20)  # same bucket, shallower: goes in the other slot
+        table.store(9, depth=2, value=30)  # replaces the shallow one, not the deep one
+        assert table.probe(1).value == 10 and table.probe(9).value == 30 and table.probe(5) is None
+        table.new_search()
+        table.store(13, depth=1, value=40)  # the deep result is from an old search now
+        assert table.probe(13).value == 40 and table.probe(1).value == 10
+
+    def test_attack_maps_follow_random_games(self):
+        random.seed(1)
+        for _ in range(5):
+            games = [Chess(), Chess()]
+            games[1].state.board = board = ChessBoard(bitboards=False)
+            for item in list(games[0].state.board.items):
+                board.add_item(type(item)(item.player), item.location)
+            board.set_rights(games[0].state.board.castling)
+            for _ in range(60):
+                with_bitboards, without_bitboards = [game.state for game in games]
+                moves = sorted((move.params['move_from'], move.params['move_to']) for move in with_bitboards.legal_moves())
+                assert moves == sorted((move.params['move_from'], move.params['move_to']) for move in without_bitboards.legal_moves())
+                bitboards = with_bitboards.board.bitboards
+                for colour in ('white', 'black'):
+                    fresh = 0
+                    for sq, piece in enumerate(bitboards.piece_on):
+                        if piece and piece[0] == colour:
+                            fresh |= bitboards.attacks(colour, piece[1], sq)
+                    assert bitboards.attacked_by(colour) == fresh
+                if not moves or with_bitboards.game_phase == GamePhase.COMPLETE:
+                    break
+                move_from, move_to = random.choice(moves)
+                for state in (with_bitboards, without_bitboards):
+                    Turn([Move(move_from, move_to)], player=state.player_turn).perform(board_game_state=state)
+
+    def test_pins_and_escape_squares(self):
+        white, black = Player(name='Bob', id='white'), Player(name='Alice', id='black')
+        board = ChessBoard()
+        board.add_item(King(white), (4,0))
+        board.add_item(Knight(white), (4,1))
+        board.add_item(Rook(black), (4,7))
+        board.add_item(Rook(black), (0,1))
+        board.add_item(King(black), (7,7))
+        state = ChessState(board, [white, black])
+        assert state.pinned_pieces(white) == [board.get_item((4,1))]
+        assert sorted(state.escape_squares(white)) == [(3,0), (5,0), (5,1)]
+        assert not state.in_check(white)
+
+    def test_end_of_game_is_cached(self):
+        state = self.chess.state
+        for turn in moves_from_notation(state, 'f3 e5'):
+            turn.perform(board_game_state=state)
+        probes = state.end_of_game_results.probes
+        assert not state.done() and not state.win_condition_met() and not state.draw_condition_met()
+        assert state.end_of_game_results.probes == probes
+        for turn in moves_from_notation(state, 'g4 Qh4'):
+            turn.perform(board_game_state=state)
+        assert state.done() and state.end_of_game() == 'checkmate'
+        assert state.winner() == self.chess.black
+        state.undo()
+        assert not state.done() and state.winner() is None
+
+    def test_fen_round_trip(self):
+        for fen in [START_FEN, 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+                    'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', '4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 37']:
+            state = Chess(fen=fen).state
+            assert state.to_fen() == fen
+            again = Chess(packed=state.to_packed()).state
+            assert again.to_fen() == fen and again.zobrist_hash() == state.zobrist_hash()
+        assert len(Chess().state.to_packed()) == 30
+        assert Chess(fen='8/8/8/8/8/8/8/K6k').state.to_fen() == '8/8/8/8/8/8/8/K6k w - - 0 1'
+        for bad in ['8/8/8/8/8/8/8/K6k x', '8/8/8/8/8/8/K6k w', '8/8/8/8/8/8/8/K5k w', '8/8/8/8/8/8/8/K6x w']:
+            with self.assertRaises(Exception):
+                Chess(fen=bad)
+        for bad, message in [('4k3/8/8/8/8/8/8/4K2R w KX - 0 1', 'FEN castling rights must be - or some of KQkq, not KX'),
+                             ('4k3/8/8/8/8/8/8/4K2R w KK - 0 1', 'FEN castling rights must be - or some of KQkq, not KK'),
+                             ('4k3/8/8/8/8/8/8/7R w - - 0 1', 'FEN needs one white king, not 0'),
+                             ('4k3/8/8/8/8/8/8/K3K3 w - - 0 1', 'FEN needs one white king, not 2'),
+                             ('8/8/8/8/8/8/8/4K3 w - - 0 1', 'FEN needs one black king, not 0')]:
+            with self.assertRaises(ValueError) as raised:
+                Chess(fen=bad)
+            assert str(raised.exception) == message
+
+    def test_move_counters(self):
+        state = self.chess.state
+        for notation in ['Nf3 Nc6', 'Ng1 e5']:
+            for turn in moves_from_notation(state, notation):
+                turn.perform(board_game_state=state)
+        assert state.to_fen().endswith(' w KQkq e6 0 3')
+        state.undo()
+        assert state.to_fen().endswith(' b KQkq - 3 2')
+        # a capture resets the clock too
+        state = Chess(fen='4k3/8/8/8/8/8/3r4/3RK3 w - - 12 40').state
+        Turn([Move((3,0), (3,1))], player=state.player_turn).perform(board_game_state=state)
+        assert state.to_fen() == '4k3/8/8/8/8/8/3R4/4K3 b - - 0 40'
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,131 @@
+import numpy as np
+from bitboard import square
+
+# static evaluation of chess positions: material plus piece-square tables, in centipawns, positive when white is ahead
+# ChessBoard.evaluation keeps the score up to date as pieces are added, moved and taken, so reading it costs nothing;
+# evaluate_batch scores many positions at once from encode_board's arrays, e.g. search leaves or a whole database
+# the tables are Tomasz Michniewski's "simplified evaluation function"
+
+PIECE_VALUES = {'P': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+
+# from white's side, rank 8 first as the board is usually drawn; black uses them mirrored
+PIECE_SQUARE_TABLES = {
+    'P': [0,  0,  0,  0,  0,  0,  0,  0,
+          50, 50, 50, 50, 50, 50, 50, 50,
+          10, 10, 20, 30, 30, 20, 10, 10,
+          5,  5, 10, 25, 25, 10,  5,  5,
+          0,  0,  0, 20, 20,  0,  0,  0,
+          5, -5,-10,  0,  0,-10, -5,  5,
+          5, 10, 10,-20,-20, 10, 10,  5,
+          0,  0,  0,  0,  0,  0,  0,  0],
+    'N': [-50,-40,-30,-30,-30,-30,-40,-50,
+          -40,-20,  0,  0,  0,  0,-20,-40,
+          -30,  0, 10, 15, 15, 10,  0,-30,
+          -30,  5, 15, 20, 20, 15,  5,-30,
+          -30,  0, 15, 20, 20, 15,  0,-30,
+          -30,  5, 10, 15, 15, 10,  5,-30,
+          -40,-20,  0,  5,  5,  0,-20,-40,
+          -50,-40,-30,-30,-30,-30,-40,-50],
+    'B': [-20,-10,-10,-10,-10,-10,-10,-20,
+          -10,  0,  0,  0,  0,  0,  0,-10,
+          -10,  0,  5, 10, 10,  5,  0,-10,
+          -10,  5,  5, 10, 10,  5,  5,-10,
+          -10,  0, 10, 10, 10, 10,  0,-10,
+          -10, 10, 10, 10, 10, 10, 10,-10,
+          -10,  5,  0,  0,  0,  0,  5,-10,
+          -20,-10,-10,-10,-10,-10,-10,-20],
+    'R': [0,  0,  0,  0,  0,  0,  0,  0,
+          5, 10, 10, 10, 10, 10, 10,  5,
+          -5,  0,  0,  0,  0,  0,  0, -5,
+          -5,  0,  0,  0,  0,  0,  0, -5,
+          -5,  0,  0,  0,  0,  0,  0, -5,
+          -5,  0,  0,  0,  0,  0,  0, -5,
+          -5,  0,  0,  0,  0,  0,  0, -5,
+          0,  0,  0,  5,  5,  0,  0,  0],
+    'Q': [-20,-10,-10, -5, -5,-10,-10,-20,
+          -10,  0,  0,  0,  0,  0,  0,-10,
+          -10,  0,  5,  5,  5,  5,  0,-10,
+          -5,  0,  5,  5,  5,  5,  0, -5,
+          0,  0,  5,  5,  5,  5,  0, -5,
+          -10,  5,  5,  5,  5,  5,  0,-10,
+          -10,  0,  5,  0,  0,  0,  0,-10,
+          -20,-10,-10, -5, -5,-10,-10,-20],
+    'K': [-30,-40,-40,-50,-50,-40,-40,-30,
+          -30,-40,-40,-50,-50,-40,-40,-30,
+          -30,-40,-40,-50,-50,-40,-40,-30,
+          -30,-40,-40,-50,-50,-40,-40,-30,
+          -20,-30,-30,-40,-40,-30,-30,-20,
+          -10,-20,-20,-20,-20,-20,-20,-10,
+          20, 20,  0,  0,  0,  0, 20, 20,
+          20, 30, 10,  0,  0, 10, 30, 20],
+}
+
+# PIECE_SCORES[(colour, letter)][square]: what a piece on a square adds to white's score
+PIECE_SCORES = {}
+for _letter, _table in PIECE_SQUARE_TABLES.items():
+    PIECE_SCORES[('white', _letter)] = [0] * 64
+    PIECE_SCORES[('black', _letter)] = [0] * 64
+    for _row in range(8):
+        for _x in range(8):
+            _value = PIECE_VALUES[_letter] + _table[_row * 8 + _x]
+            PIECE_SCORES[('white', _letter)][square((_x, 7 - _row))] = _value
+            PIECE_SCORES[('black', _letter)][square((_x, _row))] = -_value
+
+# encode_board's code for each piece, 0 for an empty square, and SCORE_TABLE[code, square] the piece's score there
+PIECE_CODES = {piece: code for code, piece in enumerate([(colour, letter) for colour in ('white', 'black') for letter in 'PNBRQK'], 1)}
+SCORE_TABLE = np.zeros((len(PIECE_CODES) + 1, 64), dtype=np.int32)
+for _piece, _code in PIECE_CODES.items():
+    SCORE_TABLE[_code] = PIECE_SCORES[_piece]
+FEN_CODES = {(letter if colour == 'white' else letter.lower()): code for (colour, letter), code in PIECE_CODES.items()}
+
+
+def piece_square(state):
+    # material and piece-square score from the point of view of the player to move, read from the board's running total
+    score = state.board.evaluation
+    return score if state.player_turn.id == 'white' else -score
+
+
+def encode_board(state):
+    # the board as 64 piece codes, square order, as an int8 array; black_to_move alongside for the side
+    codes = np.zeros(64, dtype=np.int8)
+    for item in state.board.items:
+        codes[square(item.location)] = PIECE_CODES[(item.color, item.letter)]
+    return codes
+
+
+def encode_states(states):
+    # (boards, black_to_move) for many states: an (n, 64) int8 array and an (n,) bool array
+    boards = np.zeros((len(states), 64), dtype=np.int8)
+    black_to_move = np.zeros(len(states), dtype=bool)
+    for i, state in enumerate(states):
+        boards[i] = encode_board(state)
+        black_to_move[i] = state.player_turn.id == 'black'
+    return boards, black_to_move
+
+
+def encode_fens(fens):
+    # encode_states for FEN strings, without setting up a board for each
+    boards = np.zeros((len(fens), 64), dtype=np.int8)
+    black_to_move = np.zeros(len(fens), dtype=bool)
+    for i, fen in enumerate(fens):
+        fields = fen.split()
+        for rank, row in enumerate(fields[0].split('/')):
+            x = 0
+            for letter in row:
+                if letter.isdigit():
+                    x += int(letter)
+                else:
+                    boards[i, (7 - rank) * 8 + x] = FEN_CODES[letter]
+                    x += 1
+        black_to_move[i] = len(fields) > 1 and fields[1] == 'b'
+    return boards, black_to_move
+
+
+def evaluate_batch(boards, black_to_move=None):
+    # scores for an (n, 64) array of piece codes, from white's point of view, or from the player to move's if
+    # black_to_move is given
+    boards = np.asarray(boards)
+    scores = SCORE_TABLE[boards, np.arange(64)].sum(axis=1)
+    if black_to_move is not None:
+        scores = np.where(black_to_move, -scores, scores)
+    return scores
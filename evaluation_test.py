@@ -0,0 +1,50 @@
+import random
+import unittest
+
+import numpy as np
+from chess import Chess, ChessBoard, ChessState, Player, Turn, Move
+from evaluation import piece_square, encode_board, encode_states, encode_fens, evaluate_batch, PIECE_SCORES
+
+class TestEvaluation(unittest.TestCase):
+    def test_start_position_is_level(self):
+        state = Chess().state
+        assert state.board.evaluation == 0 and piece_square(state) == 0
+        # a knight out to the middle is worth more than on the rim
+        Turn([Move((6,0), (5,2))], player=state.player_turn).perform(board_game_state=state)
+        assert state.board.evaluation == 50 and piece_square(state) == -50
+
+    def test_running_total_follows_random_games(self):
+        # captures, promotions, castling and en passant, and taking them all back, keep the total equal to a recount
+        rng = random.Random(3)
+        for fen in [None, 'r3k2r/1P6/8/3pP3/8/8/6p1/R3K2R w KQkq d6 0 1']:
+            state = Chess(fen=fen).state
+            start = state.board.evaluation
+            played = 0
+            for _ in range(80):
+                moves = state.legal_moves()
+                if not moves:
+                    break
+                Turn([rng.choice(moves)], player=state.player_turn).perform(board_game_state=state)
+                played += 1
+                recount = sum(PIECE_SCORES[(item.color, item.letter)][item.location[1] * 8 + item.location[0]] for item in state.board.items)
+                assert state.board.evaluation == recount == int(evaluate_batch([encode_board(state)])[0])
+            for _ in range(played):
+                state.undo()
+            assert state.board.evaluation == start
+
+    def test_batch(self):
+        fens = ['rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1',
+                'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+                '4k3/8/8/8/8/8/8/4K2R w K - 0 1']
+        states = [Chess(fen=fen).state for fen in fens]
+        boards, black_to_move = encode_states(states)
+        from_fens = encode_fens(fens)
+        assert np.array_equal(boards, from_fens[0]) and np.array_equal(black_to_move, from_fens[1])
+        assert list(evaluate_batch(boards)) == [state.board.evaluation for state in states]
+        assert list(evaluate_batch(boards, black_to_move)) == [piece_square(state) for state in states]
+        # the same with the colours swapped is the same score for the other side
+        mirrored = np.where(boards > 6, boards - 6, np.where(boards > 0, boards + 6, 0)).reshape(-1, 8, 8)[:, ::-1].reshape(-1, 64)
+        assert list(evaluate_batch(mirrored)) == [-state.board.evaluation for state in states]
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,279 @@
+import json
+import mmap
+import os
+import struct
+from collections import namedtuple
+import numpy as np
+from actions import Turn
+from chess import Chess, Move, encode_move, decode_move
+
+# an append-only file of chess games, 16 bits per move, read through mmap
+# with GameDatabase('games.bgdb', writable=True) as db:
+#     db.append(moves, result='1-0', tags={'White': 'Morphy'})
+#     db.move(12, 3)                                  the 4th move of the 13th game, without reading anything else
+#     for number, moves in db.iter_moves():           numpy views straight onto the file, nothing copied
+# games.bgdb holds the records one after another, each a RECORD_HEADER, then the starting position (to_packed, empty
+# for the usual start), then the tags as JSON, then the moves as encode_move codes
+# games.bgdb.idx holds an INDEX_DTYPE entry per game, so game N is found without scanning; index entries are held
+# back until flush has written and fsynced the records they point to, so a crash at any point leaves the database
+# as it was at some earlier flush, less at most the games appended since; a missing or empty .idx is rebuilt from
+# the records when the database is opened writable
+
+RESULTS = ('*', '1-0', '0-1', '1/2-1/2')
+RECORD_HEADER = struct.Struct('<IHHB')  # move count, start position bytes, tag bytes, index in RESULTS
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('moves', '<u8'), ('count', '<u4'), ('result', 'u1'), ('custom_start', 'u1'), ('pad', 'u1', 2)])
+MAX_TAG_BYTES = 0xFFFF  # what RECORD_HEADER's tag bytes field holds
+PENDING_LIMIT = 4096  # index entries held back before append flushes by itself
+
+GameRecord = namedtuple('GameRecord', ['number', 'result', 'start', 'tags', 'moves'])  # moves as a numpy uint16 view
+
+
+def encode_turns(turns):
+    # the moves of chess Turns (e.g. BoardGameState.turns) as 16 bit codes
+    return np.array([encode_move(*turn.actions[0].as_tuple()) for turn in turns], dtype='<u2')
+
+
+def decode_turns(codes, state):
+    # Turns for codes, played in order from state, which is left as it was
+    turns = []
+    player = state.player_turn
+    for code in codes:
+        turns.append(Turn([Move(*decode_move(int(code)))], player=player))
+        player = player.player_to_left
+    return turns
+
+
+class GameDatabase():
+    def __init__(self, path, writable=False) -> None:
+        self.path = path
+        self.index_path = path + '.idx'
+        self.writable = writable
+        self.data_file = None
+        self.index_file = None
+        self.pending = []  # index entries of appended games whose records may not be on disk yet
+        if writable:
+            self.data_file = open(path, 'ab')
+            self.index_file = open(self.index_path, 'ab')
+            self._truncate_unindexed()
+        elif not os.path.exists(path):
+            raise Exception('no game database at ' + path)
+        self.data_map = None
+        self.index_map = None
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self.stale = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.writable:
+            self.flush()
+            self.data_file.close()
+            self.index_file.close()
+        self._unmap()
+
+    def _unmap(self):
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        for mapped in (self.data_map, self.index_map):
+            if mapped is not None:
+                try:
+                    mapped.close()
+                except BufferError:
+                    pass  # views handed out still point into it; it goes when they do
+        self.data_map = self.index_map = None
+
+    def _truncate_unindexed(self):
+        # drop what a crash part way through an append can leave behind: the tail of a record that has no index
+        # entry, and index entries (from before entries were held back) pointing past the end of the records
+        # records with no index at all, because the .idx is missing or empty, are indexed again rather than dropped
+        self.index_file.flush()
+        size = os.path.getsize(self.path)
+        entries = os.path.getsize(self.index_path) // INDEX_DTYPE.itemsize
+        end = 0
+        with open(self.index_path, 'rb') as f:
+            while entries:
+                f.seek((entries - 1) * INDEX_DTYPE.itemsize)
+                last = np.frombuffer(f.read(INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)[0]
+                end = int(last['moves']) + 2 * int(last['count'])
+                if end <= size:
+                    break
+                entries -= 1
+                end = 0
+        if not entries and size:
+            entries, end = self._rebuild_index(size)
+        if size != end:
+            self.data_file.truncate(end)
+        if os.path.getsize(self.index_path) != entries * INDEX_DTYPE.itemsize:
+            self.index_file.truncate(entries * INDEX_DTYPE.itemsize)
+        self.end = end
+        self.appended = entries  # games in the database, counting those not yet flushed
+
+    def _rebuild_index(self, size):
+        # index entries for the whole records at the start of the data file, read one after another; returns
+        # (entries, where the last whole record ends)
+        rebuilt, end = [], 0
+        with open(self.path, 'rb') as f:
+            data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            while end + RECORD_HEADER.size <= size:
+                count, start_length, tag_length, result = RECORD_HEADER.unpack_from(data_map, end)
+                moves_offset = end + RECORD_HEADER.size + start_length + tag_length
+                if result >= len(RESULTS) or moves_offset + 2 * count > size:
+                    break
+                rebuilt.append((end, moves_offset, count, result, 1 if start_length else 0, (0, 0)))
+                end = moves_offset + 2 * count
+        finally:
+            data_map.close()
+        if rebuilt:
+            self.index_file.truncate(0)
+            self.index_file.write(np.array(rebuilt, dtype=INDEX_DTYPE).tobytes())
+            self.index_file.flush()
+            os.fsync(self.index_file.fileno())
+        return len(rebuilt), end
+
+    def append(self, moves, result='*', start=None, tags=None):
+        # moves as encode_move codes or (from, to[, promotion]) tuples, start as ChessState.to_packed bytes for games
+        # that don't begin at the usual start; returns the new game's number
+        if not self.writable:
+            raise Exception('game database opened read only: ' + self.path)
+        if result not in RESULTS:
+            raise Exception('result must be one of ' + str(RESULTS) + ', not ' + str(result))
+        codes = np.array([move if isinstance(move, (int, np.integer)) else encode_move(*move) for move in moves], dtype='<u2')
+        start = start or b''
+        tag_bytes = json.dumps(tags, separators=(',', ':')).encode() if tags else b''
+        if len(tag_bytes) > MAX_TAG_BYTES:
+            raise ValueError('tags take ' + str(len(tag_bytes)) + ' bytes as JSON, more than the ' + str(MAX_TAG_BYTES) + ' a record has room for')
+        header = RECORD_HEADER.pack(len(codes), len(start), len(tag_bytes), RESULTS.index(result))
+        offset = self.end
+        moves_offset = offset + len(header) + len(start) + len(tag_bytes)
+        self.data_file.write(header + start + tag_bytes + codes.tobytes())
+        self.pending.append((offset, moves_offset, len(codes), RESULTS.index(result), 1 if start else 0, (0, 0)))
+        self.end = moves_offset + 2 * len(codes)
+        self.appended += 1
+        self.stale = True
+        if len(self.pending) >= PENDING_LIMIT:
+            self.flush()
+        return self.appended - 1
+
+    def append_state(self, state, start=None, result=None, tags=None):
+        # the turns played on a ChessState; start is the packed position they began from, if not the usual start
+        if result is None:
+            winner = state.winner()
+            result = '*' if not state.done() else '1/2-1/2' if winner is None else '1-0' if winner.id == 'white' else '0-1'
+        return self.append(encode_turns(state.turns), result, start, tags)
+
+    def flush(self):
+        # the records reach the disk before the index entries that point to them are written
+        self.data_file.flush()
+        if not self.pending:
+            return
+        os.fsync(self.data_file.fileno())
+        self.index_file.write(np.array(self.pending, dtype=INDEX_DTYPE).tobytes())
+        self.index_file.flush()
+        self.pending = []
+
+    def reload(self):
+        # pick up games another process has appended since
+        self.stale = True
+
+    def _refresh(self):
+        # map the files again if games were appended since they were last mapped
+        if not self.stale:
+            return
+        if self.writable:
+            self.flush()
+        entries = os.path.getsize(self.index_path) // INDEX_DTYPE.itemsize if os.path.exists(self.index_path) else 0
+        self._unmap()  # views already handed out keep the old maps alive until they go
+        if entries:
+            with open(self.index_path, 'rb') as f:
+                self.index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            with open(self.path, 'rb') as f:
+                self.data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.index = np.frombuffer(self.index_map, dtype=INDEX_DTYPE, count=entries)
+        self.stale = False
+
+    def __len__(self):
+        self._refresh()
+        return len(self.index)
+
+    def _entry(self, number):
+        self._refresh()
+        if not -len(self.index) <= number < len(self.index):
+            raise IndexError('no game ' + str(number) + ' in a database of ' + str(len(self.index)))
+        return self.index[number]
+
+    def moves(self, number):
+        # the codes of game number's moves, a view onto the file
+        entry = self._entry(number)
+        return np.frombuffer(self.data_map, dtype='<u2', count=int(entry['count']), offset=int(entry['moves']))
+
+    def move(self, number, ply):
+        # (from, to[, promotion]) of one move
+        entry = self._entry(number)
+        if not 0 <= ply < entry['count']:
+            raise IndexError('game ' + str(number) + ' has ' + str(entry['count']) + ' moves, no move ' + str(ply))
+        offset = int(entry['moves']) + 2 * ply
+        return decode_move(self.data_map[offset] | self.data_map[offset + 1] << 8)
+
+    def game(self, number):
+        entry = self._entry(number)
+        offset = int(entry['offset'])
+        count, start_length, tag_length, result = RECORD_HEADER.unpack_from(self.data_map, offset)
+        offset += RECORD_HEADER.size
+        start = bytes(self.data_map[offset:offset + start_length]) or None
+        offset += start_length
+        tags = json.loads(self.data_map[offset:offset + tag_length]) if tag_length else {}
+        return GameRecord(number if number >= 0 else len(self.index) + number, RESULTS[result], start, tags, self.moves(number))
+
+    def __getitem__(self, number):
+        return self.game(number)
+
+    def __iter__(self):
+        for number in range(len(self)):
+            yield self.game(number)
+
+    def iter_moves(self):
+        # (number, moves view) for every game, skipping the headers and tags, for scans over the whole database
+        self._refresh()
+        data_map = self.data_map
+        for number, (moves_offset, count) in enumerate(zip(self.index['moves'].tolist(), self.index['count'].tolist())):
+            yield number, np.frombuffer(data_map, dtype='<u2', count=count, offset=moves_offset)
+
+    def results(self):
+        # index in RESULTS of every game's result, as one numpy array
+        self._refresh()
+        return self.index['result']
+
+    def lengths(self):
+        # every game's number of moves, as one numpy array
+        self._refresh()
+        return self.index['count']
+
+    def replay(self, number, plies=None):
+        # the Chess game number with its first plies moves played (all of them if None)
+        record = self.game(number)
+        chess = Chess(packed=record.start) if record.start else Chess()
+        state = chess.state
+        moves = record.moves if plies is None else record.moves[:plies]
+        for turn in decode_turns(moves, state):
+            turn.perform(board_game_state=state)
+        return chess
+
+
+def import_pgn(db, results, tags=('Event', 'White', 'Black', 'Date')):
+    # append the games pgn.validate_games replayed without error; returns (games added, games skipped)
+    added = skipped = 0
+    for result in results:
+        if result.error:
+            skipped += 1
+            continue
+        fen = result.headers.get('FEN')
+        start = Chess(fen=fen).state.to_packed() if fen else None
+        kept = {name: result.headers[name] for name in tags if name in result.headers}
+        outcome = result.headers.get('Result', '*')
+        db.append(result.moves, outcome if outcome in RESULTS else '*', start, kept)
+        added += 1
+    return added, skipped
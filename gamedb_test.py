@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from chess import Chess, moves_from_notation
+from boardgame import GamePhase
+from gamedb import GameDatabase, INDEX_DTYPE, encode_turns, import_pgn
+from pgn import read_games, validate_games
+from pgn_test import OPERA, SPECIAL, ILLEGAL
+
+class TestGameDatabase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'games.bgdb')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_and_read(self):
+        chess = Chess()
+        state = chess.state
+        for notation in ['f3 e5', 'g4 Qh4']:
+            for turn in moves_from_notation(state, notation):
+                turn.perform(board_game_state=state)
+        start = Chess(fen='4k3/8/8/8/8/8/8/4K2R w K - 0 1').state.to_packed()
+        with GameDatabase(self.path, writable=True) as db:
+            assert db.append_state(state, tags={'Event': 'fool\'s mate'}) == 0
+            assert db.append([((4,0), (6,0)), ((4,7), (3,7))], start=start) == 1
+            assert len(db) == 2 and db.move(0, 3) == ((3,7), (7,3))  # readable before the file is closed
+        db = GameDatabase(self.path)
+        game = db.game(0)
+        assert game.result == '0-1' and game.tags == {'Event': 'fool\'s mate'} and game.start is None
+        assert list(game.moves) == list(encode_turns(state.turns)) and not game.moves.flags.owndata
+        assert db[1].start == start and db[1].result == '*' and db[-1].number == 1
+        assert db.replay(0).state.game_phase == GamePhase.COMPLETE
+        assert db.replay(1).state.to_fen() == '3k4/8/8/8/8/8/8/5RK1 w - - 2 2'
+        assert db.replay(0, plies=2).state.to_fen() == Chess(fen='rnbqkbnr/pppp1ppp/8/4p3/8/5P2/PPPPP1PP/RNBQKBNR w KQkq e6 0 2').state.to_fen()
+        assert list(db.lengths()) == [4, 2] and list(db.results()) == [2, 0]
+        assert [(number, len(moves)) for number, moves in db.iter_moves()] == [(0, 4), (1, 2)]
+        with self.assertRaises(IndexError):
+            db.move(1, 2)
+        with self.assertRaises(Exception):
+            db.append([])
+        db.close()
+
+    def test_import_pgn(self):
+        text = '\n'.join([OPERA, ILLEGAL, SPECIAL])
+        with GameDatabase(self.path, writable=True) as db:
+            assert import_pgn(db, validate_games(read_games(text.splitlines()), workers=0)) == (2, 1)
+            assert db[0].tags['White'] == 'Paul Morphy' and db[0].result == '1-0'
+            assert db.move(1, 2) == ((1,6), (1,7), 'Q')
+            assert db.replay(0).state.winner().id == 'white'
+
+    def test_torn_append_is_dropped(self):
+        with GameDatabase(self.path, writable=True) as db:
+            db.append([((4,1), (4,3))], '1-0')
+        size = os.path.getsize(self.path)
+        with open(self.path, 'ab') as f:
+            f.write(b'\x05\x00\x00')  # a record cut off before its index entry
+        with GameDatabase(self.path, writable=True) as db:
+            assert os.path.getsize(self.path) == size
+            assert db.append([((6,0), (5,2))]) == 1
+            assert db.move(1, 0) == ((6,0), (5,2)) and db.move(0, 0) == ((4,1), (4,3))
+
+    def test_index_ahead_of_data_is_dropped(self):
+        with GameDatabase(self.path, writable=True) as db:
+            db.append([((4,1), (4,3))], '1-0')
+            db.append([((3,1), (3,3)), ((3,6), (3,4))])
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 1)  # the second record never fully reached the disk
+        with GameDatabase(self.path, writable=True) as db:
+            assert len(db) == 1 and db.move(0, 0) == ((4,1), (4,3))
+            assert db.append([((6,0), (5,2))]) == 1
+            assert db.move(1, 0) == ((6,0), (5,2))
+
+    def test_missing_or_empty_index_is_rebuilt(self):
+        # the records are read back one by one rather than dropped as a torn append
+        with GameDatabase(self.path, writable=True) as db:
+            db.append([((4,1), (4,3))], '1-0', tags={'White': 'Morphy'})
+            db.append([((3,1), (3,3)), ((3,6), (3,4))], start=Chess().state.to_packed())
+        size = os.path.getsize(self.path)
+        with open(self.path, 'ab') as f:
+            f.write(b'\x05\x00\x00')  # and a torn record after them
+        for emptied in (os.remove, lambda path: open(path, 'wb').close()):
+            emptied(self.path + '.idx')
+            with GameDatabase(self.path, writable=True) as db:
+                assert os.path.getsize(self.path) == size and len(db) == 2
+                assert db.game(0).tags == {'White': 'Morphy'} and db.game(0).result == '1-0'
+                assert db.game(1).start is not None and db.move(1, 1) == ((3,6), (3,4))
+
+    def test_oversized_tags_are_refused(self):
+        with GameDatabase(self.path, writable=True) as db:
+            with self.assertRaises(ValueError):
+                db.append([((4,1), (4,3))], tags={'Annotator': 'x' * 70000})
+            assert db.append([((4,1), (4,3))]) == 0
+        assert len(GameDatabase(self.path)) == 1
+
+    def test_remapping_closes_the_old_maps(self):
+        with GameDatabase(self.path, writable=True) as db:
+            db.append([((4,1), (4,3))])
+            assert len(db) == 1
+            index_map, data_map = db.index_map, db.data_map
+            db.append([((3,1), (3,3))])
+            assert len(db) == 2 and index_map.closed and data_map.closed
+
+    def test_index_never_ahead_of_data_on_disk(self):
+        # after every append, what's on disk is a database that opens
+        db = GameDatabase(self.path, writable=True)
+        for number in range(1000):
+            db.append([((4,1), (4,3)), ((4,6), (4,4))] * (number % 7), tags={'Round': str(number)})
+            with open(self.path + '.idx', 'rb') as f:
+                index = np.frombuffer(f.read(), dtype=INDEX_DTYPE)
+            if len(index):
+                assert int(index[-1]['moves']) + 2 * int(index[-1]['count']) <= os.path.getsize(self.path)
+        db.close()
+        assert len(GameDatabase(self.path)) == 1000
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from actions import Action, Turn
+from boardgame import BoardGameState
+from chess import ChessPiece
+
+# opt-in timing of the hot paths of a turn
+# with instrumented() as stats:
+#     game.play()
+# print(stats.summary_table())
+# stats.export_chrome_trace('turns.json')  # open in chrome://tracing or ui.perfetto.dev
+# enabling wraps the methods below in place; disabling puts the originals back, so nothing is paid while it's off
+
+HOT_PATHS = [
+    (Turn, 'perform'),
+    (Turn, 'validate'),
+    (Action, '_perform'),
+    (BoardGameState, 'after'),
+    (BoardGameState, 'done'),
+    (ChessPiece, 'validate_move'),
+]
+
+SummaryRow = namedtuple('SummaryRow', ['name', 'count', 'total_seconds', 'mean_seconds', 'p50_seconds', 'p95_seconds', 'p99_seconds'])
+
+
+def percentile(ordered, fraction):
+    # nearest rank on an already sorted list
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Timings():
+    # how often one method was called and for how long in all, exactly, and a uniform random sample of at most
+    # max_samples of the calls' durations (reservoir sampling) for the percentiles, so memory stays bounded however
+    # long the process runs
+    def __init__(self, max_samples) -> None:
+        self.max_samples = max_samples
+        self.random = random.Random(0)
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = []
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if len(self.samples) < self.max_samples:
+            self.samples.append(duration)
+        else:
+            index = int(self.random.random() * self.count)
+            if index < self.max_samples:
+                self.samples[index] = duration
+
+
+class Instrumentation():
+    # per wrapped method: how often it was called and how long the calls took, and optionally a trace event per call
+    # the percentiles come from a sample of at most max_samples calls per method, trace events stop at max_events
+    # hypothetical_copies counts states copied by after(), the allocations that in-place hypotheticals avoid
+    def __init__(self, hot_paths=HOT_PATHS, trace=True, max_events=1000000, max_samples=10000) -> None:
+        self.hot_paths = hot_paths
+        self.trace = trace
+        self.max_events = max_events
+        self.max_samples = max_samples
+        self.originals = {}
+        self.timings = {}  # name -> Timings
+        self.events = []  # (name, start, duration, thread id)
+        self.dropped_events = 0
+        self.hypothetical_copies = 0
+        self.started = time.perf_counter()
+
+    def reset(self):
+        # forget what has been recorded so far; the wrappers hold on to the Timings, so they're emptied in place
+        for timings in self.timings.values():
+            timings.clear()
+        self.events.clear()
+        self.dropped_events = 0
+        self.hypothetical_copies = 0
+        self.started = time.perf_counter()
+
+    @property
+    def enabled(self):
+        return bool(self.originals)
+
+    def enable(self):
+        if self.enabled:
+            return
+        for cls, attribute in self.hot_paths:
+            original = cls.__dict__[attribute]
+            self.originals[(cls, attribute)] = original
+            setattr(cls, attribute, self._wrap(cls.__name__ + '.' + attribute, original))
+
+    def disable(self):
+        for (cls, attribute), original in self.originals.items():
+            setattr(cls, attribute, original)
+        self.originals = {}
+
+    def _wrap(self, name, original):
+        timings = self.timings.setdefault(name, Timings(self.max_samples))
+        events = self.events
+        counting_copies = name == 'BoardGameState.after'
+        clock = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                duration = clock() - start
+                timings.add(duration)
+                if counting_copies:
+                    self.hypothetical_copies += 1
+                if self.trace:
+                    if len(events) < self.max_events:
+                        events.append((name, start, duration, threading.get_ident()))
+                    else:
+                        self.dropped_events += 1
+        wrapper.__wrapped__ = original
+        wrapper.__name__ = original.__name__
+        return wrapper
+
+    def summary(self):
+        rows = []
+        for name, timings in self.timings.items():
+            if not timings.count:
+                continue
+            ordered = sorted(timings.samples)
+            rows.append(SummaryRow(name, timings.count, timings.total, timings.total / timings.count,
+                                   percentile(ordered, 0.5), percentile(ordered, 0.95), percentile(ordered, 0.99)))
+        rows.sort(key=lambda row: -row.total_seconds)
+        return rows
+
+    def summary_table(self):
+        lines = ['{:<28} {:>9} {:>11} {:>9} {:>9} {:>9} {:>9}'.format('', 'calls', 'total ms', 'mean us', 'p50 us', 'p95 us', 'p99 us')]
+        for row in self.summary():
+            lines.append('{:<28} {:>9} {:>11.2f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+                row.name, row.count, row.total_seconds * 1e3, row.mean_seconds * 1e6,
+                row.p50_seconds * 1e6, row.p95_seconds * 1e6, row.p99_seconds * 1e6))
+        lines.append('hypothetical state copies (after): ' + str(self.hypothetical_copies))
+        if self.dropped_events:
+            lines.append('trace events dropped past max_events: ' + str(self.dropped_events))
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        # the Trace Event Format's complete ('X') events, in microseconds since instrumentation started
+        pid = os.getpid()
+        return {
+            'traceEvents': [{'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'ts': (start - self.started) * 1e6,
+                             'dur': duration * 1e6, 'pid': pid, 'tid': tid} for name, start, duration, tid in self.events],
+            'displayTimeUnit': 'ms',
+            'otherData': {'hypothetical_copies': self.hypothetical_copies},
+        }
+
+    def export_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+@contextmanager
+def instrumented(**kwargs):
+    stats = Instrumentation(**kwargs)
+    stats.enable()
+    try:
+        yield stats
+    finally:
+        stats.disable()
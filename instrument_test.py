@@ -0,0 +1,71 @@
+import json
+import os
+import tempfile
+import unittest
+
+from instrument import Instrumentation, Timings, instrumented, percentile
+from actions import Turn
+from chess import Chess, moves_from_notation
+
+class TestInstrument(unittest.TestCase):
+    def test_counts_and_restores(self):
+        original = Turn.perform
+        chess = Chess()
+        with instrumented() as stats:
+            assert Turn.perform is not original
+            chess.play_demo_game()
+        assert Turn.perform is original
+        rows = {row.name: row for row in stats.summary()}
+        # 27 moves, and moves_from_notation tries each of white's 13 in place to read black's reply
+        assert rows['Turn.perform'].count == 40
+        assert rows['Action._perform'].count == 40 and rows['Turn.validate'].count == 40
+        assert rows['ChessPiece.validate_move'].count > 27
+        assert rows['Turn.perform'].p50_seconds <= rows['Turn.perform'].p99_seconds
+        assert 'Turn.perform' in stats.summary_table()
+
+    def test_chrome_trace_and_copies(self):
+        stats = Instrumentation()
+        state = Chess().state
+        [turn] = moves_from_notation(state, 'e4 ')
+        stats.enable()
+        try:
+            state.after(turn)
+        finally:
+            stats.disable()
+        assert stats.hypothetical_copies == 1
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.json')
+            stats.export_chrome_trace(path)
+            with open(path) as f:
+                events = json.load(f)['traceEvents']
+        names = [event['name'] for event in events]
+        assert 'BoardGameState.after' in names and 'Turn.perform' in names
+        after = events[names.index('BoardGameState.after')]
+        perform = events[names.index('Turn.perform')]
+        # perform ran inside after, so its event nests inside after's
+        assert after['ts'] <= perform['ts'] and perform['ts'] + perform['dur'] <= after['ts'] + after['dur'] + 1
+        stats.reset()
+        assert stats.summary() == [] and stats.events == []
+
+    def test_capped_instance_stays_bounded(self):
+        chess = Chess()
+        with instrumented(max_samples=5, max_events=10) as stats:
+            chess.play_demo_game()
+        rows = {row.name: row for row in stats.summary()}
+        assert rows['Turn.perform'].count == 40  # counts and totals stay exact
+        assert all(len(timings.samples) <= 5 for timings in stats.timings.values())
+        assert len(stats.events) == 10 and stats.dropped_events > 0
+        # the sample stays a fair one: durations 0..9999, the median of the sample is near the middle
+        timings = Timings(max_samples=500)
+        for duration in range(10000):
+            timings.add(duration)
+        assert len(timings.samples) == 500 and timings.count == 10000 and timings.total == sum(range(10000))
+        assert 4000 < percentile(sorted(timings.samples), 0.5) < 6000
+
+    def test_percentile(self):
+        ordered = list(range(1, 101))
+        assert percentile(ordered, 0.5) == 50 and percentile(ordered, 0.95) == 95 and percentile(ordered, 0.99) == 99
+        assert percentile([], 0.5) == 0
+
+if __name__ == '__main__':
+    unittest.main()
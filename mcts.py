@@ -0,0 +1,205 @@
+import math
+import random
+import time
+from collections import namedtuple
+from boardgame import BoardGameState, GamePhase, Player
+
+# Monte Carlo tree search (UCT) for any game whose state lists its legal_turns() and whose done() / winner()
+# say how it ended; no evaluation function needed
+# playouts perform and undo turns in place on the state rather than copying it with after()
+
+MCTSResult = namedtuple('MCTSResult', ['turn', 'value', 'visits', 'iterations', 'nodes', 'seconds'])
+
+
+def turn_key(turn):
+    # hashable identity of a turn, the same for equal turns built separately, e.g. by two calls to legal_turns()
+    return tuple((action.fn.__name__, tuple(sorted((name, _frozen(value)) for name, value in action.params.items())))
+                 for action in turn.actions)
+
+
+def _frozen(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen(v) for v in value)
+    return value
+
+
+def random_playout_policy(state, turns, rng):
+    # picks the next turn in a playout; swap in something smarter with MCTS(playout_policy=...)
+    return rng.choice(turns)
+
+
+class Node():
+    __slots__ = ('turn', 'parent', 'player_id', 'children', 'untried', 'visits', 'value', 'won')
+
+    def __init__(self, turn=None, parent=None, player_id=None) -> None:
+        self.turn = turn
+        self.parent = parent
+        self.player_id = player_id  # who made turn; value is from their point of view
+        self.children = {}  # turn_key -> Node
+        self.untried = None  # turns not expanded yet, listed on the first visit
+        self.visits = 0
+        self.value = 0.0  # total result: 1 a win, 0.5 a draw, 0 a loss
+        self.won = False  # turn ended the game with player_id winning
+
+    def size(self):
+        return 1 + sum(child.size() for child in self.children.values())
+
+
+class MCTS():
+    # search(state) grows the tree for a while and picks the most visited turn
+    # the tree is kept between calls: if the state has moved on by turns already in the tree, search carries on from
+    # that subtree rather than starting again
+    # max_nodes caps the tree's size; once full, search keeps sampling from the leaves it has without growing
+    # playouts longer than max_playout_turns count as draws
+    def __init__(self, exploration=math.sqrt(2), playout_policy=random_playout_policy, max_nodes=100000,
+                 max_playout_turns=200, time_limit=1.0, seed=None) -> None:
+        self.exploration = exploration
+        self.playout_policy = playout_policy
+        self.max_nodes = max_nodes
+        self.max_playout_turns = max_playout_turns
+        self.time_limit = time_limit
+        self.random = random.Random(seed)
+        self.root = None
+        self.root_turns = 0  # len(state.turns) where the root is
+        self.root_history = None  # the last turn played then, to check later states are the same game
+        self.nodes = 0
+
+    def reuse_tree(self, state: BoardGameState):
+        # move the root down to the node for state, or start a new tree if it isn't in this one
+        node = self.root
+        history = state.turns
+        if node is None or len(history) < self.root_turns or (self.root_turns and history[self.root_turns - 1] is not self.root_history):
+            node = None
+        else:
+            for turn in history[self.root_turns:]:
+                node = node.children.get(turn_key(turn))
+                if node is None:
+                    break
+        if node is None:
+            node = Node()
+            self.nodes = 1
+        elif node is not self.root:
+            node.parent = None
+            node.turn = None
+            self.nodes = node.size()
+        self.root = node
+        self.root_turns = len(state.turns)
+        self.root_history = state.turns[-1] if state.turns else None
+
+    def search(self, state: BoardGameState, time_limit=None, iterations=None) -> MCTSResult:
+        # anytime: stops after time_limit seconds (or the given number of iterations) with the best turn so far
+        time_limit = self.time_limit if time_limit is None else time_limit
+        started = time.perf_counter()
+        deadline = started + time_limit if time_limit and iterations is None else None
+        self.reuse_tree(state)
+        was_hypothetical = state.hypothetical
+        state.hypothetical = False  # some games skip end of game checks on hypothetical states, playouts need them
+        done = 0
+        try:
+            while iterations is None or done < iterations:
+                self.iterate(state)
+                done += 1
+                if deadline is not None and time.perf_counter() > deadline:
+                    break
+        finally:
+            state.hypothetical = was_hypothetical
+        best = self.best_child()
+        seconds = time.perf_counter() - started
+        if best is None:
+            return MCTSResult(None, 0, self.root.visits, done, self.nodes, seconds)
+        return MCTSResult(best.turn, best.value / best.visits, best.visits, done, self.nodes, seconds)
+
+    def best_turn(self, state: BoardGameState, time_limit=None):
+        return self.search(state, time_limit).turn
+
+    def best_child(self):
+        if not self.root.children:
+            return None
+        return max(self.root.children.values(), key=lambda child: (child.won, child.visits, child.value))
+
+    def iterate(self, state):
+        performed = []
+        try:
+            node = self.root
+            # selection: follow the best UCT score through fully expanded nodes
+            while not self.finished(state):
+                if node.untried is None:
+                    node.untried = state.legal_turns()
+                    self.random.shuffle(node.untried)
+                if node.untried and self.nodes < self.max_nodes:
+                    # expansion
+                    turn = node.untried.pop()
+                    player_id = state.player_turn.id
+                    turn.perform(state)
+                    performed.append(turn)
+                    child = Node(turn, node, player_id)
+                    if self.finished(state):
+                        winner = state.winner()
+                        child.won = winner is not None and winner.id == player_id
+                    node.children[turn_key(turn)] = child
+                    self.nodes += 1
+                    node = child
+                    break
+                if not node.children:
+                    break
+                node = self.select(node)
+                node.turn.perform(state)
+                performed.append(node.turn)
+            winner = self.playout(state, performed)
+        finally:
+            for turn in reversed(performed):
+                turn.undo(state)
+        # backpropagation
+        while node is not None:
+            node.visits += 1
+            if winner is None:
+                node.value += 0.5
+            elif winner.id == node.player_id:
+                node.value += 1
+            node = node.parent
+
+    def select(self, node):
+        # a turn that wins on the spot is always the one to play
+        log_visits = math.log(node.visits or 1)
+        exploration = self.exploration
+        for child in node.children.values():
+            if child.won:
+                return child
+        return max(node.children.values(), key=lambda child: child.value / child.visits + exploration * math.sqrt(log_visits / child.visits))
+
+    @staticmethod
+    def finished(state):
+        return state.game_phase == GamePhase.COMPLETE
+
+    def playout(self, state, performed):
+        # play on from here with the playout policy until the game ends; the turns go on performed to be undone
+        for _ in range(self.max_playout_turns):
+            if self.finished(state):
+                return state.winner()
+            turns = state.legal_turns()
+            if not turns:
+                return None
+            turn = self.playout_policy(state, turns, self.random)
+            turn.perform(state)
+            performed.append(turn)
+        return state.winner() if self.finished(state) else None
+
+
+class MCTSPlayer(Player):
+    # a Player whose turns are chosen by MCTS, see BoardGame.play; the turn comes from a fresh legal_turns() list so
+    # the search tree keeps its own Turn objects
+    def __init__(self, name: str, id: str, mcts: MCTS = None) -> None:
+        super().__init__(name, id)
+        self.mcts = mcts or MCTS()
+        self.last_result = None
+
+    def choose_turn(self, state):
+        self.last_result = self.mcts.search(state)
+        if self.last_result.turn is None:
+            return None
+        key = turn_key(self.last_result.turn)
+        for turn in state.legal_turns():
+            if turn_key(turn) == key:
+                turn.player = self
+                return turn
+        return None
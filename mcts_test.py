@@ -0,0 +1,78 @@
+import unittest
+
+from mcts import MCTS, MCTSPlayer, turn_key
+from tictactoe import TicTacToe, Place_X, Place_O
+from chess import Chess, moves_from_notation
+from actions import Turn
+from boardgame import GamePhase
+
+class TestMCTS(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tictactoe = TicTacToe()
+        self.state = self.tictactoe.state
+
+    def place(self, *locations):
+        for location in locations:
+            place = Place_X if self.state.player_turn.id == 'X' else Place_O
+            Turn(actions=[place(location)], player=self.state.player_turn).perform(board_game_state=self.state)
+
+    def test_blocks_a_line(self):
+        self.place((0,0), (1,1), (0,1))
+        before = repr(self.state.board)
+        result = MCTS(seed=1).search(self.state, iterations=2000)
+        assert result.turn.actions[0].params['location'] == (0,2)
+        assert repr(self.state.board) == before and len(self.state.turns) == 3
+
+    def test_takes_a_win(self):
+        self.place((0,0), (1,1), (0,1), (2,2))
+        result = MCTS(seed=1).search(self.state, iterations=200)
+        assert result.turn.actions[0].params['location'] == (0,2)
+        assert result.value == 1
+
+    def test_reuses_tree(self):
+        mcts = MCTS(seed=1)
+        mcts.search(self.state, iterations=500)
+        first = mcts.best_child()
+        self.place(first.turn.actions[0].params['location'])
+        reply = max(first.children.values(), key=lambda child: child.visits)
+        self.place(reply.turn.actions[0].params['location'])
+        mcts.reuse_tree(self.state)
+        assert mcts.root is reply and mcts.root.visits > 0
+        assert mcts.nodes == reply.size()
+
+    def test_node_cap(self):
+        mcts = MCTS(max_nodes=50, seed=1)
+        result = mcts.search(self.state, iterations=1000)
+        assert mcts.nodes == 50 and result.iterations == 1000
+
+    def test_self_play_draws(self):
+        state = self.state
+        mcts = {'X': MCTS(seed=2), 'O': MCTS(seed=3)}
+        while state.game_phase != GamePhase.COMPLETE:
+            turn = mcts[state.player_turn.id].search(state, iterations=1000).turn
+            key = turn_key(turn)
+            [turn] = [turn for turn in state.legal_turns() if turn_key(turn) == key]
+            turn.perform(board_game_state=state)
+        assert state.winner() is None and state.draw_condition_met()
+
+    def test_chess_mate_in_one(self):
+        state = Chess().state
+        for notation in ['e4 e5', 'Bc4 Nc6', 'Qh5 Nf6']:
+            for turn in moves_from_notation(state, notation):
+                turn.perform(board_game_state=state)
+        result = MCTS(max_playout_turns=10, seed=1).search(state, iterations=200)
+        assert (result.turn.actions[0].params['move_from'], result.turn.actions[0].params['move_to']) == ((7,4), (5,6))
+        assert not state.hypothetical and len(state.turns) == 6
+
+    def test_anytime(self):
+        player = MCTSPlayer('Computer', 'black', MCTS(time_limit=0.05, max_playout_turns=20))
+        chess = Chess(black=player)
+        for turn in moves_from_notation(chess.state, 'e4 '):
+            turn.perform(board_game_state=chess.state)
+        turn = player.choose_turn(chess.state)
+        assert player.last_result.seconds < 1
+        turn.perform(board_game_state=chess.state)
+        assert chess.state.player_turn.id == 'white'
+
+if __name__ == '__main__':
+    unittest.main()
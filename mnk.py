@@ -0,0 +1,160 @@
+from collections import namedtuple
+import numpy as np
+
+# batched m,n,k-games (k in a row on an m by n board; TicTacToe is 3,3,3), played on many boards at once with numpy
+# a batch is an int8 array of shape (boards, m * n): 0 empty, 1 the first player (X), 2 the second (O)
+# cell (x, y) is index y * m + x, as in bitboard.py
+
+EMPTY, FIRST, SECOND = 0, 1, 2
+DRAW = 0
+
+PlayoutResults = namedtuple('PlayoutResults', ['winners', 'lengths', 'boards'])  # winners: 0 draw, 1 or 2
+
+
+def uniform_policy(boards, player):
+    # weight for each cell, higher is likelier; illegal cells are masked out by the caller
+    return np.ones(boards.shape, dtype=np.float64)
+
+
+class MNKGame():
+    # lines: every run of k cells in a row, column or diagonal, shape (lines, k)
+    # lines_through[cell]: indices of the lines through cell, padded with a line that can never be complete
+    # so a win is spotted by checking only the lines through the last move
+    def __init__(self, m=3, n=3, k=3) -> None:
+        if k > max(m, n):
+            raise Exception('no room for ' + str(k) + ' in a row on a ' + str(m) + 'x' + str(n) + ' board')
+        self.m, self.n, self.k = m, n, k
+        self.cells = m * n
+        lines = []
+        for y in range(n):
+            for x in range(m):
+                for dx, dy in ((1, 0), (0, 1), (1, 1), (1, -1)):
+                    end_x, end_y = x + dx * (k - 1), y + dy * (k - 1)
+                    if 0 <= end_x < m and 0 <= end_y < n:
+                        lines.append([(y + dy * i) * m + x + dx * i for i in range(k)])
+        # the padding line is k copies of an extra cell that is always empty
+        self.lines = np.array(lines + [[self.cells] * k], dtype=np.intp)
+        through = [[i for i, line in enumerate(lines) if cell in line] for cell in range(self.cells)]
+        width = max(len(t) for t in through)
+        self.lines_through = np.array([t + [len(lines)] * (width - len(t)) for t in through], dtype=np.intp)
+
+    def new_boards(self, count):
+        return np.zeros((count, self.cells), dtype=np.int8)
+
+    def winners(self, boards):
+        # who has k in a row on each board, 0 for nobody; checks every line
+        padded = np.concatenate([boards, np.zeros((len(boards), 1), dtype=boards.dtype)], axis=1)
+        cells = padded[:, self.lines[:-1]]  # (boards, lines, k)
+        first = (cells == FIRST).all(axis=2).any(axis=1)
+        second = (cells == SECOND).all(axis=2).any(axis=1)
+        return np.where(first, FIRST, np.where(second, SECOND, EMPTY)).astype(np.int8)
+
+    def won_by_move(self, boards, moves, player):
+        # whether each board's move (a cell index, one per board) completed a line of player's
+        padded = np.concatenate([boards, np.zeros((len(boards), 1), dtype=boards.dtype)], axis=1)
+        cells = self.lines[self.lines_through[moves]]  # (boards, lines through the move, k)
+        rows = np.arange(len(boards))[:, None, None]
+        return (padded[rows, cells] == player).all(axis=2).any(axis=1)
+
+    def choose_moves(self, boards, player, rng, policy=None):
+        # one empty cell per board, drawn in proportion to the policy's weights
+        # (largest u ** (1 / weight) for u uniform in (0, 1), computed in logs)
+        if policy is None:
+            keys = rng.random(boards.shape, dtype=np.float32)
+            keys[boards != EMPTY] = -1
+            return keys.argmax(axis=1)
+        weights = policy(boards, player)
+        with np.errstate(divide='ignore'):
+            keys = np.log(rng.random(boards.shape)) / weights
+        keys[(boards != EMPTY) | (weights <= 0)] = -np.inf
+        return keys.argmax(axis=1)
+
+    def playouts(self, count=None, boards=None, player=FIRST, policy=None, seed=None) -> PlayoutResults:
+        # play every board to the end; starts from boards (copied) with player to move, or count empty boards
+        # policy(boards, player) gives each cell a weight, e.g. to favour the centre; uniform by default
+        rng = np.random.default_rng(seed)
+        boards = self.new_boards(count) if boards is None else np.array(boards, dtype=np.int8)
+        if policy is None:
+            return self.random_playouts(boards, player, rng)
+        return self.policy_playouts(boards, player, rng, policy)
+
+    def random_playouts(self, boards, player, rng) -> PlayoutResults:
+        # a uniformly random playout just fills the empty cells in a random order, so all the moves are drawn at once:
+        # each line's owner and the move it is completed on give the first line completed, and so the winner
+        count = len(boards)
+        winners = self.winners(boards)
+        empty = boards == EMPTY
+        keys = rng.random(boards.shape, dtype=np.float32)
+        keys[~empty] = 2  # filled cells sort last
+        order = keys.argsort(axis=1)
+        times = np.empty_like(order)  # which move of the playout fills each cell
+        np.put_along_axis(times, order, np.broadcast_to(np.arange(self.cells), order.shape), axis=1)
+        times[~empty] = -1
+        other = SECOND if player == FIRST else FIRST
+        owners = np.where(empty, np.where(times % 2 == 0, player, other), boards).astype(np.int8)
+
+        lines = self.lines[:-1]
+        line_owners = owners[:, lines]  # (boards, lines, k)
+        completed = np.where((line_owners == line_owners[:, :, :1]).all(axis=2), times[:, lines].max(axis=2), self.cells)
+        first = completed.min(axis=1)
+        first_line = completed.argmin(axis=1)
+        rows = np.arange(count)
+        won = (first < self.cells) & (winners == EMPTY)
+        winners = np.where(won, line_owners[rows, first_line, 0], winners).astype(np.int8)
+        played = empty.sum(axis=1)
+        lengths = np.where(won, first + 1, np.where(winners == EMPTY, played, 0)).astype(np.int32)
+        # the boards as they were when each game ended
+        boards = np.where(empty & (times < lengths[:, None]), owners, boards).astype(np.int8)
+        return PlayoutResults(winners, lengths, boards)
+
+    def policy_playouts(self, boards, player, rng, policy) -> PlayoutResults:
+        # one move at a time on every unfinished board
+        winners = self.winners(boards)
+        lengths = np.zeros(len(boards), dtype=np.int32)
+        active = np.flatnonzero((winners == EMPTY) & (boards == EMPTY).any(axis=1))
+        # boards of under 64 cells also keep each player's cells as bits, and check lines as masks
+        masks = self.line_masks() if self.cells < 64 else None
+        if masks is not None:
+            bits = {side: self.to_bits(boards[active] == side) for side in (FIRST, SECOND)}
+        while len(active):
+            playing = boards[active]
+            moves = self.choose_moves(playing, player, rng, policy)
+            rows = np.arange(len(active))
+            playing[rows, moves] = player
+            boards[active] = playing
+            lengths[active] += 1
+            if masks is None:
+                won = self.won_by_move(playing, moves, player)
+            else:
+                bits[player] |= np.left_shift(np.uint64(1), moves.astype(np.uint64))
+                through = masks[self.lines_through[moves]]  # (boards, lines through the move)
+                won = ((bits[player][:, None] & through) == through).any(axis=1)
+            winners[active[won]] = player
+            over = won | ~(playing == EMPTY).any(axis=1)
+            active = active[~over]
+            if masks is not None:
+                bits = {side: b[~over] for side, b in bits.items()}
+            player = SECOND if player == FIRST else FIRST
+        return PlayoutResults(winners, lengths, boards)
+
+    def line_masks(self):
+        # each line as a bitmask of its cells; the padding line gets a bit no board has
+        masks = [sum(1 << int(cell) for cell in set(line)) for line in self.lines[:-1]]
+        return np.array(masks + [1 << 63], dtype=np.uint64)
+
+    @staticmethod
+    def to_bits(occupied):
+        # (boards, cells) booleans as one uint64 per board
+        weights = np.left_shift(np.uint64(1), np.arange(occupied.shape[1], dtype=np.uint64))
+        return (occupied.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64) if occupied.size else np.zeros(len(occupied), dtype=np.uint64)
+
+
+def encode_board(board, m=None, n=None):
+    # a BoardGrid of X and O items (e.g. TicTacToeBoard) as one row of a batch
+    m = board.x if m is None else m
+    n = board.y if n is None else n
+    row = np.zeros(m * n, dtype=np.int8)
+    for item in board.items:
+        x, y = item.location
+        row[y * m + x] = FIRST if item.letter == 'X' else SECOND
+    return row
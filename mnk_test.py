@@ -0,0 +1,67 @@
+import unittest
+import numpy as np
+
+from mnk import MNKGame, encode_board, uniform_policy, FIRST, SECOND, DRAW
+from tictactoe import TicTacToe
+
+class TestMNK(unittest.TestCase):
+    def setUp(self) -> None:
+        self.game = MNKGame(3, 3, 3)
+
+    def test_lines(self):
+        assert len(self.game.lines) - 1 == 8
+        assert MNKGame(4, 4, 3).lines.shape == (4 * 2 * 2 + 2 * 2 * 2 + 1, 3)
+
+    def test_winners_match_tictactoe(self):
+        tictactoe = TicTacToe()
+        tictactoe.play_demo_game()
+        board = encode_board(tictactoe.state.board)
+        assert self.game.winners(board[None])[0] == SECOND
+
+    def check_results(self, game, results, start=None):
+        # the final boards agree with the reported winners and lengths
+        filled = 0 if start is None else (start != 0).sum(axis=1)
+        assert (game.winners(results.boards) == results.winners).all()
+        assert ((results.boards != 0).sum(axis=1) == results.lengths + filled).all()
+
+    def test_random_playouts(self):
+        results = self.game.playouts(100000, seed=1)
+        self.check_results(self.game, results)
+        # random TicTacToe: X wins 58.5%, O 28.8%, draws 12.7%
+        shares = np.bincount(results.winners, minlength=3) / 100000
+        assert np.allclose(shares, [0.127, 0.585, 0.288], atol=0.01)
+
+    def test_policy_playouts(self):
+        results = self.game.playouts(100000, policy=uniform_policy, seed=1)
+        self.check_results(self.game, results)
+        shares = np.bincount(results.winners, minlength=3) / 100000
+        assert np.allclose(shares, [0.127, 0.585, 0.288], atol=0.01)
+
+        def centre_first(boards, player):
+            weights = np.ones(boards.shape)
+            weights[:, 4] = 1e9
+            return weights
+        results = self.game.playouts(100, policy=centre_first, seed=1)
+        assert (results.boards[:, 4] == FIRST).all()
+
+    def test_from_position(self):
+        # X to move wins on the spot with 1 of the 5 empty cells
+        boards = np.array([[1, 1, 0, 2, 2, 0, 0, 0, 0]] * 1000, dtype=np.int8)
+        for policy in (None, uniform_policy):
+            results = self.game.playouts(boards=boards, player=FIRST, policy=policy, seed=2)
+            self.check_results(self.game, results, boards)
+            assert (results.winners[results.lengths == 1] == FIRST).all()
+            assert abs((results.lengths == 1).mean() - 0.2) < 0.05
+            assert (results.boards[boards != 0] == boards[boards != 0]).all()
+        finished = np.array([[1, 1, 1, 2, 2, 0, 0, 0, 0], [1, 2, 1, 1, 2, 2, 2, 1, 1]], dtype=np.int8)
+        results = self.game.playouts(boards=finished, player=SECOND, seed=1)
+        assert list(results.winners) == [FIRST, DRAW] and list(results.lengths) == [0, 0]
+
+    def test_large_board(self):
+        game = MNKGame(15, 15, 5)
+        for policy in (None, uniform_policy):
+            results = game.playouts(200, policy=policy, seed=1)
+            self.check_results(game, results)
+
+if __name__ == '__main__':
+    unittest.main()
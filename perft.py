@@ -0,0 +1,94 @@
+import argparse
+import time
+from collections import namedtuple
+from string import ascii_lowercase
+from actions import Turn
+from chess import Chess
+
+# perft: count the move sequences of each length from a position, to check move generation against known totals
+# and to time it; divide splits the count by first move, to find which branch goes wrong
+# python perft.py                          the suite, up to 200000 nodes per position
+# python perft.py --max-nodes 5000000      deeper
+# python perft.py --divide "<fen>" 3       one position, by first move
+
+# (name, FEN, nodes at depth 1, 2, 3, ...) from the Chess Programming Wiki's perft results
+PERFT_POSITIONS = [
+    ('start', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1', [20, 400, 8902, 197281, 4865609]),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', [48, 2039, 97862, 4085603]),
+    ('position 3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', [14, 191, 2812, 43238, 674624]),
+    ('position 4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', [6, 264, 9467, 422333]),
+    ('position 5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', [44, 1486, 62379, 2103487]),
+    ('position 6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10', [46, 2079, 89890, 3894594]),
+]
+
+PerftResult = namedtuple('PerftResult', ['name', 'depth', 'nodes', 'expected', 'seconds', 'nodes_per_second'])
+
+
+def perft(state, depth):
+    # the number of legal move sequences depth moves long, playing them in place on state
+    if depth == 0:
+        return 1
+    moves = state.legal_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        with state.hypothetically(Turn([move], player=state.player_turn)):
+            nodes += perft(state, depth - 1)
+    return nodes
+
+
+def divide(state, depth):
+    # perft for each first move, in long algebraic notation: {'e2e4': 600, ...}
+    counts = {}
+    for move in state.legal_moves():
+        with state.hypothetically(Turn([move], player=state.player_turn)):
+            counts[long_algebraic(move.as_tuple())] = perft(state, depth - 1)
+    return counts
+
+
+def long_algebraic(move):
+    # ((4, 1), (4, 3)) -> 'e2e4', promotions get the piece's letter: 'e7e8q'
+    text = ''.join(ascii_lowercase[x] + str(y + 1) for x, y in move[:2])
+    return text + move[2].lower() if len(move) > 2 else text
+
+
+def run_suite(positions=PERFT_POSITIONS, max_nodes=200000, report=print):
+    # every position at each depth whose known total is at most max_nodes
+    results = []
+    for name, fen, expected in positions:
+        for depth, count in enumerate(expected, 1):
+            if count > max_nodes:
+                break
+            state = Chess(fen=fen).state
+            started = time.perf_counter()
+            nodes = perft(state, depth)
+            seconds = time.perf_counter() - started
+            result = PerftResult(name, depth, nodes, count, seconds, nodes / seconds if seconds else 0)
+            results.append(result)
+            if report:
+                report(format_result(result))
+    return results
+
+
+def format_result(result):
+    status = 'ok' if result.nodes == result.expected else 'WRONG, expected ' + str(result.expected)
+    return '{:<12} depth {:>2} {:>10} nodes {:>8.2f}s {:>10.0f} nodes/s  {}'.format(
+        result.name, result.depth, result.nodes, result.seconds, result.nodes_per_second, status)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='chess move generation: perft node counts and speed')
+    parser.add_argument('--max-nodes', type=int, default=200000)
+    parser.add_argument('--divide', nargs=2, metavar=('FEN', 'DEPTH'))
+    args = parser.parse_args()
+    if args.divide:
+        fen, depth = args.divide[0], int(args.divide[1])
+        counts = divide(Chess(fen=fen).state, depth)
+        for move_text in sorted(counts):
+            print(move_text + ':', counts[move_text])
+        print('total:', sum(counts.values()))
+    else:
+        results = run_suite(max_nodes=args.max_nodes)
+        if any(result.nodes != result.expected for result in results):
+            raise SystemExit(1)
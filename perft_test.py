@@ -0,0 +1,51 @@
+import unittest
+
+from chess import Chess, ChessBoard, ChessState, Player, Turn, Move
+from perft import perft, divide, run_suite, long_algebraic, PERFT_POSITIONS
+
+class TestPerft(unittest.TestCase):
+    def test_positions(self):
+        # every position to the depths that stay quick; python perft.py --max-nodes N goes further
+        for result in run_suite(max_nodes=10000, report=None):
+            assert result.nodes == result.expected, result
+
+    def test_without_bitboards(self):
+        # walking the items gives the same counts as the bitboards
+        for name, fen, expected in PERFT_POSITIONS[1:3]:
+            state = ChessState(ChessBoard(bitboards=False), [Player(name='Bob', id='white'), Player(name='Alice', id='black')])
+            state.load_fen(fen)
+            assert perft(state, 2) == expected[1], name
+
+    def test_divide(self):
+        state = Chess().state
+        counts = divide(state, 2)
+        assert len(counts) == 20 and counts['e2e4'] == 20 and sum(counts.values()) == 400
+        assert long_algebraic(((4,6), (4,7), 'Q')) == 'e7e8q'
+
+    def test_special_moves_undo(self):
+        # castling, en passant and promotion are all taken back exactly, rights and hash included
+        state = Chess(fen='r3k2r/1P6/8/3pP3/8/8/8/R3K2R w KQkq d6 0 1').state
+        fen, key = state.to_fen(), state.zobrist_hash()
+        assert fen == 'r3k2r/1P6/8/3pP3/8/8/8/R3K2R w KQkq d6 0 1'
+        for move, after in [(((4,0), (6,0)), 'r3k2r/1P6/8/3pP3/8/8/8/R4RK1 b kq - 1 1'),
+                            (((4,4), (3,5)), 'r3k2r/1P6/3P4/8/8/8/8/R3K2R b KQkq - 0 1'),
+                            (((1,6), (0,7), 'N'), 'N3k2r/8/8/3pP3/8/8/8/R3K2R b KQk - 0 1')]:
+            with state.hypothetically(Turn([Move(*move)], player=state.player_turn)):
+                assert state.to_fen() == after
+            assert state.to_fen() == fen and state.zobrist_hash() == key
+
+    def test_castling_through_or_out_of_check_is_refused(self):
+        # a Move performed directly, as a human player's is, gets the same checks as legal_moves
+        state = Chess(fen='4k3/8/8/8/8/8/5r2/R3K2R w KQ - 0 1').state  # the rook covers f1
+        with self.assertRaises(Exception):
+            Turn([Move((4,0), (6,0))], player=state.player_turn).perform(board_game_state=state)
+        assert state.to_fen() == '4k3/8/8/8/8/8/5r2/R3K2R w KQ - 0 1'
+        Turn([Move((4,0), (2,0))], player=state.player_turn).perform(board_game_state=state)
+        assert state.to_fen().startswith('4k3/8/8/8/8/8/5r2/2KR3R b')
+        state = Chess(fen='4k3/8/8/8/8/8/4r3/R3K2R w KQ - 0 1').state  # in check
+        for to_location in ((6,0), (2,0)):
+            with self.assertRaises(Exception):
+                Turn([Move((4,0), to_location)], player=state.player_turn).perform(board_game_state=state)
+
+if __name__ == '__main__':
+    unittest.main()
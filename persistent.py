@@ -0,0 +1,169 @@
+from collections import namedtuple
+from items import COLORS
+
+# immutable, structurally shared building blocks for snapshots of a game that is still being played
+# a snapshot never changes once taken, so other threads can read it while the game moves on
+
+BRANCH_BITS = 5
+BRANCH = 1 << BRANCH_BITS
+
+
+class PersistentVector():
+    # fixed length vector stored as a 32 way trie of tuples
+    # set() returns a new vector that shares every node except the path to the changed index
+    __slots__ = ('size', 'depth', 'root')
+
+    def __init__(self, size, fill=None, _depth=None, _root=None) -> None:
+        self.size = size
+        if _root is not None:
+            self.depth, self.root = _depth, _root
+            return
+        self.depth = 1
+        while BRANCH ** self.depth < size:
+            self.depth += 1
+        node = (fill,) * BRANCH
+        for _ in range(self.depth - 1):
+            node = (node,) * BRANCH  # an untouched vector is one node per level
+        self.root = node
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __len__(self):
+        return self.size
+
+    def get(self, index):
+        node = self.root
+        for level in range(self.depth - 1, 0, -1):
+            node = node[(index >> (BRANCH_BITS * level)) & (BRANCH - 1)]
+        return node[index & (BRANCH - 1)]
+
+    def set(self, index, value):
+        if not 0 <= index < self.size:
+            raise Exception('index out of range: ' + str(index))
+
+        def set_in(node, level):
+            slot = (index >> (BRANCH_BITS * level)) & (BRANCH - 1)
+            child = value if level == 0 else set_in(node[slot], level - 1)
+            return node[:slot] + (child,) + node[slot + 1:]
+
+        return PersistentVector(self.size, _depth=self.depth, _root=set_in(self.root, self.depth - 1))
+
+
+class TurnHistory():
+    # list-like record of turns, stored as a linked list of (turn, previous) pairs
+    # copies share every turn already played, so branching a hypothetical state doesn't copy the history
+    # indexing builds a list of the turns, oldest first, the first time, and keeps it in step after that, so
+    # turns[i] costs O(1) rather than a walk along the links
+    def __init__(self, turns=()) -> None:
+        self.head = None
+        self.length = 0
+        self.indexed = None
+        for turn in turns:
+            self.append(turn)
+
+    def append(self, turn):
+        self.head = (turn, self.head)
+        self.length += 1
+        if self.indexed is not None:
+            self.indexed.append(turn)
+
+    def pop(self):
+        if self.head is None:
+            raise IndexError('pop from empty TurnHistory')
+        turn, self.head = self.head
+        self.length -= 1
+        if self.indexed is not None:
+            self.indexed.pop()
+        return turn
+
+    def branch(self):
+        history = TurnHistory()
+        history.head, history.length = self.head, self.length
+        return history
+
+    def __copy__(self):
+        return self.branch()
+
+    def __deepcopy__(self, memo):
+        return self.branch()
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if (index == -1 or index == self.length - 1) and self.head is not None:
+            return self.head[0]  # the last turn, the one asked for most, without building the list
+        if self.indexed is None:
+            self.indexed = list(reversed(list(self.latest_first())))
+        try:
+            return self.indexed[index]
+        except IndexError:
+            raise IndexError('TurnHistory index out of range')
+
+    def __iter__(self):
+        if self.indexed is not None:
+            return iter(list(self.indexed))
+        return iter(list(reversed(list(self.latest_first()))))
+
+    def latest_first(self):
+        node = self.head
+        while node is not None:
+            yield node[0]
+            node = node[1]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+# frozen copies of the parts of items and players that a reader needs
+ItemView = namedtuple('ItemView', ['kind', 'letter', 'color', 'player_id', 'location', 'size'])
+PlayerView = namedtuple('PlayerView', ['name', 'id', 'public_inventory', 'private_inventory'])
+
+
+def item_view(item):
+    if item is None:
+        return None
+    return ItemView(type(item), item.letter, item.color, item.player.id if item.player else None, item.location, item.size)
+
+
+def player_view(player):
+    return PlayerView(player.name, player.id, tuple(player.public_inventory), tuple(player.private_inventory))
+
+
+class BoardSnapshot():
+    # read-only view of a BoardGrid at one moment, see BoardGrid.snapshot
+    def __init__(self, x, y, cells: PersistentVector) -> None:
+        self.x = x
+        self.y = y
+        self.cells = cells
+
+    def get_item(self, location):
+        x, y = location
+        if not (0 <= x < self.x and 0 <= y < self.y):
+            return None
+        return self.cells.get(x * self.y + y)
+
+    def items(self):
+        found = {}
+        for x in range(self.x):
+            for y in range(self.y):
+                view = self.cells.get(x * self.y + y)
+                if view is not None:
+                    found[view] = None
+        return list(found)
+
+    def __repr__(self) -> str:
+        s = '\n'
+        for y in reversed(range(self.y)):
+            for x in range(self.x):
+                view = self.get_item((x, y))
+                s = s + (COLORS[view.color] + view.letter + COLORS['end'] if view else ' ')
+            s = s + '\n'
+        return s
+
+
+StateSnapshot = namedtuple('StateSnapshot', ['board', 'players', 'player_turn', 'turn_phase', 'game_phase', 'hypothetical', 'turns'])
@@ -0,0 +1,371 @@
+import os
+import re
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from actions import Turn
+from bitboard import Bitboards, CASTLING as BITBOARD_CASTLING, PAWN_DIRECTION, squares, location
+from chess import Chess, Move, King, FEN_PIECES, encode_move
+from boardgame import GamePhase
+
+# reading games in Portable Game Notation, one at a time however big the file
+# for game in read_games(open('games.pgn')):               headers and SAN moves, nothing played yet
+# for result in validate_games(read_games(f), workers=8):  each game replayed on a process pool, in file order
+
+PGNGame = namedtuple('PGNGame', ['number', 'headers', 'moves', 'result'])  # number counts games from 0 in the file
+ReplayResult = namedtuple('ReplayResult', ['number', 'headers', 'moves', 'fen', 'error'])  # moves as encode_move codes
+
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+HEADER = re.compile(r'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]\s*$')
+TOKEN = re.compile(r'\{[^}]*\}?|;.*|\(|\)|\$\d+|\d+\.(?:\.\.)?|[^\s{}();]+')
+SAN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?[+#]?[!?]*$')
+CASTLING = re.compile(r'^([O0]-[O0](-[O0])?)[+#]?[!?]*$')
+
+
+class PGNError(Exception):
+    pass
+
+
+def read_games(lines):
+    # yields a PGNGame per game from any iterable of lines (an open file, a list...), keeping only one game in memory
+    number = 0
+    headers, tokens = {}, []
+    in_moves = False
+    pending_comment = False  # inside a { comment } that carries on onto the next line
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        if pending_comment:
+            end = line.find('}')
+            if end < 0:
+                continue
+            line, pending_comment = line[end + 1:], False
+        stripped = line.strip()
+        if stripped.startswith('%'):
+            continue  # escaped line
+        if stripped.startswith('['):
+            if in_moves:
+                # a header after moves with no result: start of the next game
+                yield _game(number, headers, tokens)
+                number += 1
+                headers, tokens, in_moves = {}, [], False
+            match = HEADER.match(stripped)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+            continue
+        if not stripped:
+            continue
+        in_moves = True
+        for token in TOKEN.findall(stripped):
+            if token.startswith('{'):
+                pending_comment = not token.endswith('}')
+                continue
+            tokens.append(token)
+            if token in RESULTS:
+                yield _game(number, headers, tokens)
+                number += 1
+                headers, tokens, in_moves = {}, [], False
+    if in_moves or headers:
+        yield _game(number, headers, tokens)
+
+
+def _game(number, headers, tokens):
+    # the main line's moves: drops comments, numbers, NAGs and (variations), however deeply nested
+    moves, depth, result = [], 0, headers.get('Result', '*')
+    for token in tokens:
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth = max(0, depth - 1)
+        elif depth or token[0] in ';$' or token[0].isdigit() and token.rstrip('.').isdigit():
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            moves.append(token)
+    return PGNGame(number, headers, moves, result)
+
+
+def move_from_san(state, san):
+    # the Move that Standard Algebraic Notation such as 'e4', 'Nbd7', 'exd6', 'e8=Q+' or 'O-O-O' means for the player
+    # to move; PGNError if there isn't exactly one legal move it could be
+    board = state.board
+    player = state.player_turn
+    castling = CASTLING.match(san)
+    if castling:
+        rank = 0 if player.id == 'white' else 7
+        to_location = (2 if castling.group(2) else 6, rank)
+        kings = [king for king in board.items_of(player, King) if king.location == (4, rank) and state.is_legal(king, to_location)]
+        if not kings:
+            raise PGNError('illegal castling: ' + san)
+        return Move((4, rank), to_location)
+    match = SAN.match(san)
+    if not match:
+        raise PGNError('not a move: ' + san)
+    letter, from_file, from_rank, to_square, promotion = match.groups()
+    to_location = (ord(to_square[0]) - ord('a'), int(to_square[1]) - 1)
+    from_x = ord(from_file) - ord('a') if from_file else None
+    from_y = int(from_rank) - 1 if from_rank else None
+    pieces = [piece for piece in board.items_of(player, FEN_PIECES[letter or 'P'])
+              if (from_x is None or piece.location[0] == from_x) and (from_y is None or piece.location[1] == from_y)
+              and state.is_legal(piece, to_location)]
+    if len(pieces) != 1:
+        raise PGNError(('ambiguous move: ' if pieces else 'illegal move: ') + san)
+    piece = pieces[0]
+    if piece.letter == 'P' and to_location[1] in (0, 7):
+        if not promotion:
+            raise PGNError('promotion without a piece: ' + san)
+        return Move(piece.location, to_location, promotion)
+    if promotion:
+        raise PGNError('promotion that isn\'t one: ' + san)
+    return Move(piece.location, to_location)
+
+
+def square_name(location):
+    return 'abcdefgh'[location[0]] + str(location[1] + 1)
+
+
+def san_of(state, move):
+    # the SAN for a (from, to[, promotion]) move by the player to move, e.g. 'Nbd7', 'exd6', 'e8=Q+', 'O-O'
+    board = state.board
+    from_location, to_location = tuple(move[0]), tuple(move[1])
+    piece = board.get_item(from_location)
+    if piece is None:
+        raise PGNError('nothing to move at ' + square_name(from_location))
+    if piece.letter == 'K' and abs(to_location[0] - from_location[0]) == 2:
+        text = 'O-O' if to_location[0] == 6 else 'O-O-O'
+    elif piece.letter == 'P':
+        text = square_name(to_location)
+        if from_location[0] != to_location[0]:
+            text = square_name(from_location)[0] + 'x' + text
+        if len(move) > 2:
+            text += '=' + move[2]
+    else:
+        others = [other.location for other in board.items_of(piece.player, type(piece))
+                  if other is not piece and state.is_legal(other, to_location)]
+        if not others:
+            where = ''
+        elif all(other[0] != from_location[0] for other in others):
+            where = square_name(from_location)[0]
+        elif all(other[1] != from_location[1] for other in others):
+            where = square_name(from_location)[1]
+        else:
+            where = square_name(from_location)
+        text = piece.letter + where + ('x' if board.get_item(to_location) else '') + square_name(to_location)
+    with state.hypothetically(Turn([Move(*move)], player=state.player_turn)):
+        if state.in_check(state.player_turn):
+            text += '+' if state.has_legal_move() else '#'
+    return text
+
+
+def write_game(headers, sans, result='*'):
+    # PGN text for a game: headers is a dict, sans the moves in SAN
+    lines = ['[' + name + ' "' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"]' for name, value in headers.items()]
+    movetext = []
+    for ply, san in enumerate(sans):
+        movetext.append(str(ply // 2 + 1) + '. ' + san if ply % 2 == 0 else san)
+    movetext.append(result)
+    return '\n'.join(lines) + '\n\n' + ' '.join(movetext) + '\n'
+
+
+def start_of(game: PGNGame) -> Chess:
+    # the position the game starts from, which the FEN header gives for games that don't start at the beginning
+    fen = game.headers.get('FEN')
+    return Chess(fen=fen) if fen else Chess()
+
+
+def replay(game: PGNGame):
+    # (Chess with every move played, the moves as (from, to[, promotion]) tuples); PGNError at the first bad move
+    # or a FEN header that isn't a position
+    try:
+        chess = start_of(game)
+    except Exception as error:
+        raise PGNError('game ' + str(game.number) + ': bad FEN header: ' + str(error))
+    state = chess.state
+    state.hypothetical = True  # no end of game checks after each move, move_from_san has checked it's legal
+    moves = []
+    try:
+        for ply, san in enumerate(game.moves):
+            try:
+                move = move_from_san(state, san)
+            except PGNError as error:
+                if not state.has_legal_move():
+                    error = 'move after the end of the game: ' + san
+                raise PGNError('game ' + str(game.number) + ', ply ' + str(ply + 1) + ': ' + str(error))
+            Turn([move], player=state.player_turn).perform(board_game_state=state)
+            moves.append(move.as_tuple())
+    finally:
+        state.hypothetical = False
+    state.done()
+    return chess, moves
+
+
+def game_from_pgn(pgn):
+    # the Chess game a PGN string describes, with its moves played
+    for game in read_games(pgn.splitlines()):
+        return replay(game)[0]
+    raise PGNError('no game found')
+
+
+class BitboardReplay():
+    # a game played on Bitboards alone, for validate_games: the same moves, errors and final FEN as replay, without the
+    # ChessPiece items, Turns, undo records and hashes that replay's Chess keeps up to date on every move
+    def __init__(self, fen=None) -> None:
+        pieces, colour, castling, en_passant, halfmove_clock, fullmove_number = _starting_position(fen)
+        self.bitboards = Bitboards()
+        for sq, piece_colour, letter in pieces:
+            self.bitboards.add(piece_colour, letter, sq)
+        self.colour = colour
+        self.castling = castling
+        self.en_passant = en_passant
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+
+    def move_from_san(self, san):
+        # (from square, to square, promotion or None), as move_from_san finds it and with the same PGNErrors
+        bitboards, colour = self.bitboards, self.colour
+        castling = CASTLING.match(san)
+        if castling:
+            king_from = 4 if colour == 'white' else 60
+            king_to = king_from + (-2 if castling.group(2) else 2)
+            if not (bitboards.pieces[(colour, 'K')] >> king_from & 1 and self._is_legal('K', king_from, king_to)):
+                raise PGNError('illegal castling: ' + san)
+            return king_from, king_to, None
+        match = SAN.match(san)
+        if not match:
+            raise PGNError('not a move: ' + san)
+        letter, from_file, from_rank, to_square, promotion = match.groups()
+        letter = letter or 'P'
+        to_sq = (int(to_square[1]) - 1) * 8 + ord(to_square[0]) - ord('a')
+        from_x = ord(from_file) - ord('a') if from_file else None
+        from_y = int(from_rank) - 1 if from_rank else None
+        found = [sq for sq in squares(bitboards.pieces[(colour, letter)])
+                 if (from_x is None or sq % 8 == from_x) and (from_y is None or sq // 8 == from_y)
+                 and self._is_legal(letter, sq, to_sq)]
+        if len(found) != 1:
+            raise PGNError(('ambiguous move: ' if found else 'illegal move: ') + san)
+        if letter == 'P' and to_sq // 8 in (0, 7):
+            if not promotion:
+                raise PGNError('promotion without a piece: ' + san)
+            return found[0], to_sq, promotion
+        if promotion:
+            raise PGNError('promotion that isn\'t one: ' + san)
+        return found[0], to_sq, None
+
+    def _is_legal(self, letter, from_sq, to_sq):
+        bitboards = self.bitboards
+        return (bitboards.can_move(self.colour, letter, from_sq, to_sq, self.en_passant, self.castling)
+                and bitboards.is_legal(self.colour, letter, from_sq, to_sq, self.en_passant, self.castling))
+
+    def play(self, from_sq, to_sq, promotion=None):
+        # makes a legal move, updating the rights and counters as chess.move does
+        bitboards, colour = self.bitboards, self.colour
+        letter = bitboards.piece_on[from_sq][1]
+        captured = bitboards.piece_on[to_sq]
+        if captured:
+            bitboards.remove(captured[0], captured[1], to_sq)
+        elif letter == 'P' and to_sq == self.en_passant:
+            captured = (Bitboards.enemy(colour), 'P')
+            bitboards.remove(captured[0], 'P', to_sq - 8 * PAWN_DIRECTION[colour])
+        bitboards.remove(colour, letter, from_sq)
+        bitboards.add(colour, promotion or letter, to_sq)
+        if letter == 'K' and abs(to_sq - from_sq) == 2:
+            for side, king_from, king_to, rook_from, rook_to in BITBOARD_CASTLING.values():
+                if king_from == from_sq and king_to == to_sq:
+                    bitboards.remove(colour, 'R', rook_from)
+                    bitboards.add(colour, 'R', rook_to)
+        if self.castling:
+            self.castling = ''.join(right for right, (side, king_from, king_to, rook_from, rook_to) in BITBOARD_CASTLING.items()
+                                    if right in self.castling and not (letter == 'K' and side == colour)
+                                    and rook_from != from_sq and rook_from != to_sq)
+        self.en_passant = (from_sq + to_sq) // 2 if letter == 'P' and abs(to_sq - from_sq) == 16 else None
+        self.halfmove_clock = 0 if letter == 'P' or captured else self.halfmove_clock + 1
+        if colour == 'black':
+            self.fullmove_number += 1
+        self.colour = Bitboards.enemy(colour)
+
+    def has_legal_move(self):
+        bitboards, colour = self.bitboards, self.colour
+        return any(bitboards.legal_targets(colour, bitboards.piece_on[sq][1], sq, self.en_passant, self.castling)
+                   for sq in squares(bitboards.colours[colour]))
+
+    def to_fen(self):
+        # the same FEN as ChessState.to_fen
+        rows = []
+        piece_on = self.bitboards.piece_on
+        for y in reversed(range(8)):
+            row, empty = '', 0
+            for x in range(8):
+                piece = piece_on[y * 8 + x]
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    row, empty = row + str(empty), 0
+                row += piece[1] if piece[0] == 'white' else piece[1].lower()
+            rows.append(row + (str(empty) if empty else ''))
+        en_passant = square_name(location(self.en_passant)) if self.en_passant is not None else '-'
+        return ' '.join(['/'.join(rows), 'w' if self.colour == 'white' else 'b', self.castling or '-', en_passant,
+                         str(self.halfmove_clock), str(self.fullmove_number)])
+
+
+@lru_cache(maxsize=64)
+def _starting_position(fen):
+    # what a BitboardReplay starts from, read off a Chess set up from the FEN (checking it) once per distinct FEN:
+    # ((square, colour, letter) per piece, colour to move, castling, en passant square, halfmove clock, fullmove number)
+    state = (Chess(fen=fen) if fen else Chess()).state
+    board = state.board
+    en_passant, castling = board.special_moves()
+    pieces = tuple((sq, piece[0], piece[1]) for sq, piece in enumerate(board.bitboards.piece_on) if piece)
+    return pieces, state.player_turn.id, castling, en_passant, board.halfmove_clock, board.fullmove_number
+
+
+def replay_result(game: PGNGame) -> ReplayResult:
+    # replay's moves, errors and final position, worked out on a BitboardReplay
+    try:
+        position = BitboardReplay(game.headers.get('FEN'))
+    except Exception as error:
+        return ReplayResult(game.number, game.headers, None, None, 'game ' + str(game.number) + ': bad FEN header: ' + str(error))
+    moves = []
+    for ply, san in enumerate(game.moves):
+        try:
+            from_sq, to_sq, promotion = position.move_from_san(san)
+        except PGNError as error:
+            if not position.has_legal_move():
+                error = 'move after the end of the game: ' + san
+            return ReplayResult(game.number, game.headers, None, None,
+                                'game ' + str(game.number) + ', ply ' + str(ply + 1) + ': ' + str(error))
+        position.play(from_sq, to_sq, promotion)
+        moves.append(encode_move(location(from_sq), location(to_sq), promotion))
+    return ReplayResult(game.number, game.headers, moves, position.to_fen(), None)
+
+
+def _replay_chunk(games):
+    return [replay_result(game) for game in games]
+
+
+def validate_games(games, workers=None, chunk_size=32):
+    # replays games (PGNGames, e.g. from read_games) on a pool of worker processes and yields a ReplayResult for each,
+    # in the order they came; error is None for games that are legal all the way through
+    # only a few chunks are in flight at once, so memory stays bounded however many games there are
+    # workers=0 replays in this process
+    if workers == 0:
+        for game in games:
+            yield replay_result(game)
+        return
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        limit = 2 * workers
+        chunk = []
+        for game in games:
+            chunk.append(game)
+            if len(chunk) == chunk_size:
+                in_flight.append(pool.submit(_replay_chunk, chunk))
+                chunk = []
+                if len(in_flight) >= limit:
+                    yield from in_flight.popleft().result()
+        if chunk:
+            in_flight.append(pool.submit(_replay_chunk, chunk))
+        while in_flight:
+            yield from in_flight.popleft().result()
@@ -0,0 +1,139 @@
+import unittest
+
+from boardgame import GamePhase
+import pgn
+from chess import Chess, Move, Turn, decode_move, encode_move
+from pgn import read_games, replay, replay_result, game_from_pgn, move_from_san, san_of, write_game, validate_games, PGNError
+
+OPERA = '''[Event "Paris"]
+[White "Paul Morphy"]
+[Black "Duke Karl / Count Isouard"]
+[Result "1-0"]
+
+1.e4 e5 2.Nf3 d6 3.d4 Bg4 4.dxe5 Bxf3 5.Qxf3 dxe5 6.Bc4 Nf6 7.Qb3 Qe7
+8.Nc3 c6 9.Bg5 b5 10.Nxb5 cxb5 11.Bxb5+ Nbd7 12.O-O-O Rd8 13.Rxd7 Rxd7
+14.Rd1 Qe6 15.Bxd7+ Nxd7 16.Qb8+ Nxb8 17.Rd8# 1-0
+'''
+
+ANNOTATED = '''[Event "annotated"]
+[Result "*"]
+% an escaped line
+{ a comment before
+the first move } 1. e4 $1 ( 1. d4 d5 ( 1... Nf6 ) 2. c4 ) 1... e5 ; to the end of the line
+2. Nf3!? {short} Nc6 *
+'''
+
+SPECIAL = '''[FEN "4k3/1P6/8/3pP3/8/8/8/4K3 w - d6 0 1"]
+[SetUp "1"]
+
+1. exd6 Kd7 2. b8=Q Ke6 *
+'''
+
+ILLEGAL = '''[Event "illegal"]
+
+1. e4 e5 2. Ke3 Nc6 0-1
+'''
+
+
+class TestPGN(unittest.TestCase):
+    def test_read_games(self):
+        games = list(read_games((OPERA + '\n' + ANNOTATED + '\n' + SPECIAL).splitlines()))
+        assert [game.number for game in games] == [0, 1, 2]
+        assert games[0].headers['Black'] == 'Duke Karl / Count Isouard' and games[0].result == '1-0'
+        assert len(games[0].moves) == 33 and games[0].moves[-1] == 'Rd8#'
+        # comments, NAGs, variations and move numbers are gone
+        assert games[1].moves == ['e4', 'e5', 'Nf3!?', 'Nc6'] and games[1].result == '*'
+        assert games[2].headers['FEN'] == '4k3/1P6/8/3pP3/8/8/8/4K3 w - d6 0 1'
+
+    def test_streams(self):
+        # games come out one at a time as the lines are read
+        def lines():
+            yield from OPERA.splitlines()
+            raise AssertionError('read past the first game')
+        assert next(read_games(lines())).moves[0] == 'e4'
+
+    def test_replay(self):
+        chess = game_from_pgn(OPERA)
+        assert chess.state.game_phase == GamePhase.COMPLETE
+        assert chess.state.winner().id == 'white' and not chess.state.hypothetical
+        with self.assertRaises(PGNError) as raised:
+            replay(next(read_games(OPERA.replace('17.Rd8#', '17.Rd8# Ke7').splitlines())))
+        assert str(raised.exception) == 'game 0, ply 34: move after the end of the game: Ke7'
+
+    def test_failed_replay_leaves_no_hypothetical_state(self):
+        game = next(read_games(ILLEGAL.splitlines()))
+        chess = Chess()
+        start_of = pgn.start_of
+        pgn.start_of = lambda game: chess  # to see the state replay gave up on
+        try:
+            with self.assertRaises(PGNError):
+                replay(game)
+        finally:
+            pgn.start_of = start_of
+        assert not chess.state.hypothetical and chess.state.to_fen().startswith('rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w')
+
+    def test_replay_result_matches_replay(self):
+        # replay_result plays on bitboards alone; the moves, final position and errors are replay's
+        text = '\n'.join([OPERA, ILLEGAL, SPECIAL, ANNOTATED, OPERA.replace('17.Rd8#', '17.Rd8# Ke7'),
+                          '[FEN "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1"]\n\n1. O-O-O O-O 2. Rd8 Rfxd8 3. Kb1 Rd1+ *'])
+        for game in read_games(text.splitlines()):
+            result = replay_result(game)
+            try:
+                chess, moves = replay(game)
+            except PGNError as error:
+                assert result.error == str(error) and result.moves is None
+                continue
+            assert result.error is None and result.fen == chess.state.to_fen()
+            assert result.moves == [encode_move(*move) for move in moves]
+
+    def test_special_moves(self):
+        chess, moves = replay(next(read_games(SPECIAL.splitlines())))
+        assert moves[0] == ((4,4), (3,5)) and moves[2] == ((1,6), (1,7), 'Q')
+        assert chess.state.to_fen().startswith('1Q6/8/3Pk3/8/8/8/8/4K3 w - -')
+
+    def test_move_from_san(self):
+        state = Chess(fen='4k3/8/8/8/8/8/8/R3K2R w KQ - 0 1').state
+        assert move_from_san(state, 'O-O').as_tuple() == ((4,0), (6,0))
+        state = Chess(fen='4k3/8/8/8/8/8/4K3/R6R w - - 0 1').state
+        assert move_from_san(state, 'Rad1').as_tuple() == ((0,0), (3,0))
+        with self.assertRaises(PGNError):
+            move_from_san(state, 'Rd1')  # either rook
+        with self.assertRaises(PGNError):
+            move_from_san(state, 'Nf3')
+
+    def test_san_round_trip(self):
+        game = next(read_games(OPERA.splitlines()))
+        chess, moves = replay(game)
+        state = Chess().state
+        sans = []
+        for move in moves:
+            sans.append(san_of(state, move))
+            Turn([Move(*move)], player=state.player_turn).perform(board_game_state=state)
+        assert sans == game.moves
+        again = next(read_games(write_game(game.headers, sans, game.result).splitlines()))
+        assert again.headers == game.headers and again.moves == game.moves and again.result == '1-0'
+
+    def test_validate_games(self):
+        text = '\n'.join([OPERA, ILLEGAL, SPECIAL, ANNOTATED] * 3)
+        expected = [None, 'game 1, ply 3: illegal move: Ke3', None, None] * 3
+        in_process = list(validate_games(read_games(text.splitlines()), workers=0))
+        assert [result.number for result in in_process] == list(range(12))
+        assert [result.error for result in in_process][:4] == expected[:4]
+        assert decode_move(in_process[2].moves[2]) == ((1,6), (1,7), 'Q')
+        # on a pool, in chunks, the results are the same and in the same order
+        pooled = list(validate_games(read_games(text.splitlines()), workers=2, chunk_size=2))
+        assert [(result.number, result.moves, result.fen) for result in pooled] == [(result.number, result.moves, result.fen) for result in in_process]
+        assert [result.error is None for result in pooled] == [error is None for error in expected]
+
+    def test_bad_fen_header(self):
+        # a game that can't be set up is reported like any other bad game, and the games after it still come out
+        bad = '[FEN "8/8/8 w - - 0 1"]\n\n1. e4 *\n'
+        text = '\n'.join([OPERA, bad, SPECIAL])
+        for workers in (0, 1):
+            results = list(validate_games(read_games(text.splitlines()), workers=workers))
+            assert [result.number for result in results] == [0, 1, 2]
+            assert results[0].error is None and results[2].error is None
+            assert results[1].error.startswith('game 1: bad FEN header: ')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,397 @@
+import argparse
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from actions import Turn
+from chess import Chess, Move
+from bitboard import square, location, KING_ATTACKS, KNIGHT_ATTACKS, ROOK_RAYS, BISHOP_RAYS, BETWEEN
+
+# endgame tablebases: distance to mate for every position of a few pawnless endings, worked out backwards from the
+# mates (retrograde analysis) and stored a byte per position
+# python tablebase.py generate --workers 4           KQK, KRK and KBNK into ./tablebases
+# python tablebase.py probe "<fen>"                   what the tables say about a position
+# tablebases = Tablebases('tablebases'); tablebases.probe(state), tablebases.best_move(state)
+# ChessEngine(tablebases=tablebases) plays them perfectly and stops searching where they have the answer
+#
+# the stronger side is always white in the tables, so 'KQK' covers the queen on either side; a table is indexed by
+# (white king, black king, white pieces in the order of the signature, e.g. bishop then knight), with the white king
+# moved into the a1-d1-d4 triangle by one of the board's 8 symmetries, which makes tables 6.4 times smaller
+# each byte is 0 for a draw, 255 for a position that can't come up, otherwise 1 + the number of plies to mate:
+# a win for the stronger side with it to move, a loss for the weaker side with it to move
+
+SIGNATURES = ('KQK', 'KRK', 'KBNK')
+DRAWN_SIGNATURES = ('KK', 'KBK', 'KNK')  # too little to mate with, no table needed
+PIECE_ORDER = 'QRBN'
+DRAW = 0
+ILLEGAL = 255
+STRONG_TO_MOVE = 0
+WEAK_TO_MOVE = 1
+TB_MAGIC = b'BGTB0001'
+TB_HEADER = struct.Struct('<8s8s')  # magic, signature
+
+TablebaseResult = namedtuple('TablebaseResult', ['outcome', 'plies'])  # 'win', 'loss' or 'draw' for the player to move
+
+
+def _bool_table(bitboards):
+    return np.array([[bitboard >> sq & 1 for sq in range(64)] for bitboard in bitboards], dtype=bool)
+
+
+KING_TABLE = _bool_table(KING_ATTACKS)
+EMPTY_BOARD_ATTACKS = {
+    'N': _bool_table(KNIGHT_ATTACKS),
+    'B': _bool_table(BISHOP_RAYS),
+    'R': _bool_table(ROOK_RAYS),
+    'Q': _bool_table([rook | bishop for rook, bishop in zip(ROOK_RAYS, BISHOP_RAYS)]),
+}
+SLIDERS = 'BRQ'
+BETWEEN_TABLE = np.array([_bool_table(row) for row in BETWEEN])  # [from, to, square in between]
+
+SYMMETRIES = [lambda x, y: (x, y), lambda x, y: (7 - x, y), lambda x, y: (x, 7 - y), lambda x, y: (7 - x, 7 - y),
+              lambda x, y: (y, x), lambda x, y: (7 - y, x), lambda x, y: (y, 7 - x), lambda x, y: (7 - y, 7 - x)]
+SYMMETRY_PERMUTATIONS = np.array([[square(symmetry(*location(sq))) for sq in range(64)] for symmetry in SYMMETRIES])
+TRIANGLE = [square((x, y)) for x in range(4) for y in range(x + 1)]
+TRIANGLE_INDEX = {sq: index for index, sq in enumerate(TRIANGLE)}
+# CANONICAL[sq]: the symmetry that takes a king on sq into the triangle
+CANONICAL = [next(index for index, permutation in enumerate(SYMMETRY_PERMUTATIONS) if permutation[sq] in TRIANGLE_INDEX)
+             for sq in range(64)]
+
+
+def signature_pieces(signature):
+    # 'KBNK' -> 'BN', the stronger side's pieces besides its king
+    if len(signature) < 3 or signature[0] != 'K' or signature[-1] != 'K' or any(letter not in PIECE_ORDER for letter in signature[1:-1]):
+        raise Exception('not a pawnless signature against a bare king: ' + signature)
+    return signature[1:-1]
+
+
+def table_shape(signature):
+    return (len(TRIANGLE), 64) + (64,) * len(signature_pieces(signature))
+
+
+def _take(array, axis, index):
+    return array[(slice(None),) * axis + (index,)]
+
+
+class Generator():
+    # everything about the geometry of one ending that the retrograde passes need, worked out once
+    # arrays are (white king, black king, pieces...); the passes work on one white king slice at a time, whose
+    # axes are (black king, pieces...)
+    def __init__(self, signature) -> None:
+        self.signature = signature
+        self.pieces = signature_pieces(signature)
+        shape = table_shape(signature)
+        dimensions = len(shape)
+        grids = [np.array(TRIANGLE).reshape((-1,) + (1,) * (dimensions - 1))]
+        for axis in range(1, dimensions):
+            grids.append(np.arange(64).reshape((1,) * axis + (-1,) + (1,) * (dimensions - axis - 1)))
+        white_king, black_king, piece_squares = grids[0], grids[1], grids[2:]
+
+        distinct = np.ones(shape, dtype=bool)
+        for i in range(dimensions):
+            for j in range(i + 1, dimensions):
+                distinct &= grids[i] != grids[j]
+        kings_touch = KING_TABLE[white_king, black_king]
+        attacked = np.zeros(shape, dtype=bool)  # the black king is in check
+        for i, letter in enumerate(self.pieces):
+            attack = EMPTY_BOARD_ATTACKS[letter][piece_squares[i], black_king]
+            if letter in SLIDERS:
+                for other in [white_king] + piece_squares[:i] + piece_squares[i + 1:]:
+                    attack = attack & ~BETWEEN_TABLE[piece_squares[i], black_king, other]
+            attacked |= attack
+        self.strong_valid = distinct & ~kings_touch & ~attacked
+        weak_valid = distinct & ~kings_touch
+
+        # the black king can take a piece that nothing defends, which always leaves a draw
+        can_capture = np.zeros(shape, dtype=bool)
+        for i, letter in enumerate(self.pieces):
+            capture = KING_TABLE[black_king, piece_squares[i]] & ~KING_TABLE[white_king, piece_squares[i]]
+            for j, other_letter in enumerate(self.pieces):
+                if j != i:
+                    defends = EMPTY_BOARD_ATTACKS[other_letter][piece_squares[j], piece_squares[i]]
+                    if other_letter in SLIDERS:
+                        defends = defends & ~BETWEEN_TABLE[piece_squares[j], piece_squares[i], white_king]
+                    capture = capture & ~defends
+            can_capture |= capture
+        can_capture &= weak_valid
+
+        self.king_steps = [(sq, to) for sq in range(64) for to in range(64) if KING_TABLE[sq, to]]
+        has_move = can_capture.copy()
+        for sq, to in self.king_steps:
+            _take(has_move, 1, sq)[...] |= _take(self.strong_valid, 1, to)
+        self.mated = weak_valid & attacked & ~has_move
+        self.weak_valid = weak_valid
+        self.can_lose = weak_valid & ~can_capture & has_move  # only positions with a king move and no capture can be lost
+        # (axis in a white king slice, from, to, squares that mustn't be in the way or None)
+        self.piece_moves = []
+        for i, letter in enumerate(self.pieces):
+            others = [grid for k, grid in enumerate(grids) if k != 2 + i]
+            for sq in range(64):
+                for to in np.flatnonzero(EMPTY_BOARD_ATTACKS[letter][sq]):
+                    clear = None
+                    if letter in SLIDERS:
+                        between = BETWEEN_TABLE[sq, to]
+                        if between.any():
+                            clear = np.ones(shape[:2 + i] + shape[3 + i:], dtype=bool)
+                            for grid in others:
+                                clear &= ~between[np.squeeze(grid, axis=2 + i)]
+                    self.piece_moves.append((1 + i, sq, int(to), clear))
+        # the white king's moves from each triangle square: (triangle index, permutation of the other axes) of the
+        # position it leads to, taken back into the triangle
+        self.king_moves = []
+        for sq in TRIANGLE:
+            moves = []
+            for to in np.flatnonzero(KING_TABLE[sq]):
+                permutation = SYMMETRY_PERMUTATIONS[CANONICAL[to]]
+                moves.append((TRIANGLE_INDEX[int(permutation[to])], np.ix_(*[permutation] * (dimensions - 1))))
+            self.king_moves.append(moves)
+
+    def initial(self):
+        # (strong to move, weak to move) tables with the mates and the impossible positions filled in
+        strong = np.where(self.strong_valid, DRAW, ILLEGAL).astype(np.uint8)
+        weak = np.where(self.weak_valid, DRAW, ILLEGAL).astype(np.uint8)
+        weak[self.mated] = 1
+        return strong, weak
+
+    def strong_pass(self, strong, weak, n, kings):
+        # strong to move wins in n plies where some move reaches a weak to move position lost in n - 1
+        found = 0
+        for k in kings:
+            unknown = strong[k] == DRAW
+            if not unknown.any():
+                continue
+            reached = np.zeros(unknown.shape, dtype=bool)
+            lost = weak[k] == n
+            for axis, sq, to, clear in self.piece_moves:
+                if clear is None:
+                    _take(reached, axis, sq)[...] |= _take(lost, axis, to)
+                else:
+                    _take(reached, axis, sq)[...] |= _take(lost, axis, to) & clear[k]
+            for target, permutation in self.king_moves[k]:
+                reached |= (weak[target] == n)[permutation]
+            newly = unknown & reached
+            strong[k][newly] = n + 1
+            found += int(newly.sum())
+        return found
+
+    def weak_pass(self, strong, weak, n, kings):
+        # weak to move loses in n + 1 plies where every move reaches a position the strong side wins
+        found = 0
+        for k in kings:
+            candidates = (weak[k] == DRAW) & self.can_lose[k]
+            if not candidates.any():
+                continue
+            all_won = np.ones(candidates.shape, dtype=bool)
+            won = strong[k] != DRAW  # ILLEGAL counts too: those aren't moves the king can make
+            for sq, to in self.king_steps:
+                _take(all_won, 0, sq)[...] &= _take(won, 0, to)
+            newly = candidates & all_won
+            weak[k][newly] = n + 2
+            found += int(newly.sum())
+        return found
+
+
+def _passes(generator, strong, weak, run_pass, report=None):
+    # alternate the two passes until nothing new is found; run_pass(name, n) does one pass over every white king
+    n = 1
+    while True:
+        if n + 2 >= ILLEGAL:
+            raise Exception('mates too long to store in a byte')
+        found = run_pass('strong', n)
+        if not found:
+            break
+        found += run_pass('weak', n)
+        if report:
+            report(generator.signature + ': ' + str(found) + ' positions decided at ' + str(n) + '-' + str(n + 1) + ' plies')
+        n += 2
+    return strong, weak
+
+
+_worker = {}
+
+
+def _attach(signature, name):
+    memory = shared_memory.SharedMemory(name=name)
+    shape = (2,) + table_shape(signature)
+    _worker.clear()
+    _worker.update(generator=Generator(signature), memory=memory, tables=np.ndarray(shape, dtype=np.uint8, buffer=memory.buf))
+
+
+def _worker_pass(name, n, kings):
+    generator, tables = _worker['generator'], _worker['tables']
+    run = generator.strong_pass if name == 'strong' else generator.weak_pass
+    return run(tables[STRONG_TO_MOVE], tables[WEAK_TO_MOVE], n, kings)
+
+
+def generate(signature, workers=0, report=None):
+    # (strong to move, weak to move) distance to mate tables; workers > 0 splits each pass by white king square
+    # between that many processes, which share the tables in shared memory
+    generator = Generator(signature)
+    strong, weak = generator.initial()
+    kings = list(range(len(TRIANGLE)))
+    if not workers:
+        def run_pass(name, n):
+            run = generator.strong_pass if name == 'strong' else generator.weak_pass
+            return run(strong, weak, n, kings)
+        return _passes(generator, strong, weak, run_pass, report)
+
+    memory = shared_memory.SharedMemory(create=True, size=2 * strong.size)
+    try:
+        tables = np.ndarray((2,) + strong.shape, dtype=np.uint8, buffer=memory.buf)
+        tables[STRONG_TO_MOVE], tables[WEAK_TO_MOVE] = strong, weak
+        shares = [kings[i::workers] for i in range(workers) if kings[i::workers]]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(signature, memory.name)) as pool:
+            def run_pass(name, n):
+                return sum(pool.map(_worker_pass, [name] * len(shares), [n] * len(shares), shares))
+            _passes(generator, tables[STRONG_TO_MOVE], tables[WEAK_TO_MOVE], run_pass, report)
+        return tables[STRONG_TO_MOVE].copy(), tables[WEAK_TO_MOVE].copy()
+    finally:
+        del tables
+        memory.close()
+        memory.unlink()
+
+
+def save(path, signature, strong, weak):
+    with open(path, 'wb') as f:
+        f.write(TB_HEADER.pack(TB_MAGIC, signature.encode()))
+        f.write(strong.tobytes())
+        f.write(weak.tobytes())
+
+
+def generate_all(directory, signatures=SIGNATURES, workers=0, report=print):
+    os.makedirs(directory, exist_ok=True)
+    for signature in signatures:
+        started = time.perf_counter()
+        strong, weak = generate(signature, workers, report)
+        save(os.path.join(directory, signature + '.tb'), signature, strong, weak)
+        if report:
+            plies = int(max(strong[strong != ILLEGAL].max(), 1)) - 1
+            report(signature + ': longest win ' + str((plies + 1) // 2) + ' moves, ' + '{:.1f}s'.format(time.perf_counter() - started))
+
+
+class Tablebase():
+    # one ending's tables, mapped from the file rather than read in
+    def __init__(self, path) -> None:
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, signature = TB_HEADER.unpack_from(self.map)
+        if magic != TB_MAGIC:
+            raise Exception('not a tablebase: ' + path)
+        self.signature = signature.rstrip(b'\0').decode()
+        self.tables = np.frombuffer(self.map, dtype=np.uint8, offset=TB_HEADER.size).reshape((2,) + table_shape(self.signature))
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def lookup(self, strong_to_move, white_king, black_king, pieces):
+        # squares with the strong side as white; pieces in the order of the signature
+        permutation = SYMMETRY_PERMUTATIONS[CANONICAL[white_king]]
+        index = (STRONG_TO_MOVE if strong_to_move else WEAK_TO_MOVE, TRIANGLE_INDEX[int(permutation[white_king])],
+                 int(permutation[black_king])) + tuple(int(permutation[sq]) for sq in pieces)
+        return int(self.tables[index])
+
+
+def material_signature(state):
+    # ('KQK', strong colour) for a pawnless ending against a bare king, ('KK', None) for bare kings, otherwise None
+    letters = {'white': [], 'black': []}
+    for item in state.board.items:
+        letters[item.color].append(item.letter)
+    bare = [colour for colour in letters if letters[colour] == ['K']]
+    if len(bare) == 2:
+        return 'KK', None
+    if len(bare) != 1:
+        return None
+    strong = 'white' if bare[0] == 'black' else 'black'
+    pieces = sorted((letter for letter in letters[strong] if letter != 'K'), key=lambda letter: PIECE_ORDER.index(letter) if letter in PIECE_ORDER else -1)
+    return 'K' + ''.join(pieces) + 'K', strong
+
+
+class Tablebases():
+    # every table found in directory, probed by the material on the board
+    def __init__(self, directory='tablebases', signatures=SIGNATURES) -> None:
+        self.tables = {}
+        for signature in signatures:
+            path = os.path.join(directory, signature + '.tb')
+            if os.path.exists(path):
+                self.tables[signature] = Tablebase(path)
+        self.max_pieces = max([len(signature) for signature in self.tables] + [3])
+
+    def __deepcopy__(self, memo):
+        # hypothetical copies of a state share the mapped tables
+        return self
+
+    def probe(self, state):
+        # TablebaseResult for the player to move, or None if the position isn't covered
+        if len(state.board.items) > self.max_pieces or state.board.castling:
+            return None
+        found = material_signature(state)
+        if found is None:
+            return None
+        signature, strong = found
+        if signature in DRAWN_SIGNATURES:
+            return TablebaseResult('draw', 0)
+        table = self.tables.get(signature)
+        if table is None:
+            return None
+        flip = strong == 'black'
+
+        def sq(item):
+            x, y = item.location
+            return square((x, 7 - y)) if flip else square((x, y))
+
+        pieces = {}
+        white_king = black_king = None
+        for item in state.board.items:
+            if item.letter == 'K':
+                if item.color == strong:
+                    white_king = sq(item)
+                else:
+                    black_king = sq(item)
+            else:
+                pieces.setdefault(item.letter, []).append(sq(item))
+        ordered = [pieces[letter].pop() for letter in table.signature[1:-1]]
+        strong_to_move = state.player_turn.id == strong
+        value = table.lookup(strong_to_move, white_king, black_king, ordered)
+        if value == ILLEGAL:
+            return None
+        if value == DRAW:
+            return TablebaseResult('draw', 0)
+        return TablebaseResult('win' if strong_to_move else 'loss', value - 1)
+
+    def best_move(self, state):
+        # the move that wins fastest, or draws, or loses slowest, or None if the position isn't covered
+        if self.probe(state) is None:
+            return None
+        best, best_rank = None, None
+        for move in state.legal_moves():
+            with state.hypothetically(Turn([move], player=state.player_turn)):
+                result = self.probe(state)
+            if result is None:
+                continue
+            # the result is the opponent's: their loss is our win
+            rank = {'loss': (2, -result.plies), 'draw': (1, 0), 'win': (0, result.plies)}[result.outcome]
+            if best_rank is None or rank > best_rank:
+                best, best_rank = move.as_tuple(), rank
+        return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='endgame tablebases: generate them, or look a position up')
+    commands = parser.add_subparsers(dest='command', required=True)
+    make = commands.add_parser('generate')
+    make.add_argument('signatures', nargs='*', default=list(SIGNATURES))
+    make.add_argument('--directory', default='tablebases')
+    make.add_argument('--workers', type=int, default=0)
+    probe = commands.add_parser('probe')
+    probe.add_argument('fen')
+    probe.add_argument('--directory', default='tablebases')
+    args = parser.parse_args()
+    if args.command == 'generate':
+        generate_all(args.directory, args.signatures, args.workers)
+    else:
+        tablebases = Tablebases(args.directory)
+        state = Chess(fen=args.fen).state
+        print(tablebases.probe(state), tablebases.best_move(state))
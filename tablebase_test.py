@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from boardgame import GamePhase
+from chess import Chess, Turn, Move
+from chess_search import ChessEngine, MATE
+from tablebase import Tablebases, generate, generate_all, ILLEGAL, TablebaseResult
+
+class TestTablebases(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        generate_all(cls.directory, ('KQK', 'KRK'), report=None)
+        cls.tablebases = Tablebases(cls.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def probe(self, fen):
+        return self.tablebases.probe(Chess(fen=fen).state)
+
+    def test_longest_mates(self):
+        # the known longest wins: 10 moves with a queen, 16 with a rook
+        for signature, moves in [('KQK', 10), ('KRK', 16)]:
+            table = self.tablebases.tables[signature].tables[0]
+            assert int(table[table != ILLEGAL].max()) - 1 == 2 * moves - 1
+
+    def test_probe(self):
+        assert self.probe('7k/6Q1/6K1/8/8/8/8/8 b - - 0 1') == TablebaseResult('loss', 0)  # mated
+        assert self.probe('7k/5Q2/6K1/8/8/8/8/8 b - - 0 1') == TablebaseResult('draw', 0)  # stalemated
+        assert self.probe('7k/5Q2/6K1/8/8/8/8/8 w - - 0 1') == TablebaseResult('win', 1)
+        # with the colours the other way round
+        assert self.probe('6q1/8/8/8/8/8/5k2/7K b - - 0 1') == TablebaseResult('win', 1)
+        assert self.probe('8/8/8/8/8/8/5kq1/7K w - - 0 1') == TablebaseResult('loss', 0)
+        assert self.probe('8/8/8/8/8/4k3/6q1/7K w - - 0 1') == TablebaseResult('draw', 0)  # takes the queen
+        assert self.probe('8/8/8/8/8/5k2/6q1/7K b - - 0 1') is None  # white is in check with black to move
+        assert self.probe('8/8/8/4k3/8/8/8/4K3 w - - 0 1') == TablebaseResult('draw', 0)
+        assert self.probe('8/8/8/4k3/8/8/3PP3/4K3 w - - 0 1') is None
+
+    def test_best_moves_mate_in_time(self):
+        state = Chess(fen='8/8/8/4k3/8/8/8/R3K3 w - - 0 1').state
+        found = self.tablebases.probe(state)
+        assert found.outcome == 'win'
+        for ply in range(found.plies):
+            move = self.tablebases.best_move(state)
+            Turn([Move(*move)], player=state.player_turn).perform(board_game_state=state)
+            assert self.tablebases.probe(state).plies == found.plies - ply - 1
+        assert state.game_phase == GamePhase.COMPLETE and state.end_of_game() == 'checkmate'
+
+    def test_engine_and_state(self):
+        state = Chess(fen='7k/5Q2/6K1/8/8/8/8/8 w - - 0 1').state
+        result = ChessEngine(tablebases=self.tablebases).search(state)
+        assert result.move == ((5,6), (6,6)) and result.nodes == 0 and result.score == MATE - 1
+        # the state's own tablebases: the search uses them too, and drawn positions end the game
+        state = Chess(fen='8/8/8/8/8/4k3/6q1/7K w - - 0 1').state
+        state.tablebases = self.tablebases
+        assert ChessEngine().search(state).move == ((7,0), (6,1))
+        Turn([Move((7,0), (6,1))], player=state.player_turn).perform(board_game_state=state)
+        assert state.end_of_game() == 'tablebase draw' and state.game_phase == GamePhase.COMPLETE
+
+    def test_parallel_generation(self):
+        serial = generate('KQK')
+        parallel = generate('KQK', workers=2)
+        assert all(np.array_equal(a, b) for a, b in zip(serial, parallel))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,24 +3,43 @@ from board import BoardGrid
 from items import Item
 from actions import Action, Turn
 
+LINES = [tuple((i, j) for j in range(3)) for i in range(3)] + [tuple((j, i) for j in range(3)) for i in range(3)] + \
+    [tuple((j, j) for j in range(3)), tuple((j, 2-j) for j in range(3))]
+LINES_THROUGH = {(x, y): [line for line in LINES if (x, y) in line] for x in range(3) for y in range(3)}
+
 class TicTacToeBoard(BoardGrid):
+    # keeps the completed lines up to date as pieces are placed and taken back, checking only the lines through that square
     def __init__(self) -> None:
         super().__init__(x=3, y=3)
+        self.lines_made = {}  # line -> X or O
+
+    def _index_item(self, item):
+        super()._index_item(item)
+        for line in LINES_THROUGH[tuple(item.location)]:
+            if all(isinstance(self.get_item(cell), type(item)) for cell in line):
+                self.lines_made[line] = type(item)
+
+    def _unindex_item(self, item):
+        super()._unindex_item(item)
+        for line in LINES_THROUGH[tuple(item.location)]:
+            self.lines_made.pop(line, None)
 
     def win_condition_met(self):
-        for i in range(3):
-            if all([isinstance(self.get_item((i,j)), X) for j in range(3)]) or \
-                all([isinstance(self.get_item((j,i)), X) for j in range(3)]) or \
-                    all([isinstance(self.get_item((j,j)), X) for j in range(3)]) or \
-                        all([isinstance(self.get_item((j,2-j)), X) for j in range(3)]):
-                   return X
-            elif all([isinstance(self.get_item((i,j)), O) for j in range(3)]) or \
-                all([isinstance(self.get_item((j,i)), O) for j in range(3)]) or \
-                    all([isinstance(self.get_item((j,j)), O) for j in range(3)]) or \
-                        all([isinstance(self.get_item((j,2-j)), O) for j in range(3)]):
-                   return O
+        made = self.lines_made.values()
+        if X in made:
+            return X
+        elif O in made:
+            return O
         return None
 
+class TicTacToeState(BoardGameState):
+    def legal_turns(self):
+        place = Place_X if self.player_turn.id == 'X' else Place_O
+        return [Turn(actions=[place(location)], player=self.player_turn) for location in self.board.locations if self.board.get_item(location) is None]
+
+    def draw_condition_met(self):
+        return len(self.board.items) == len(self.board.locations) and not self.board.win_condition_met()
+
 class O(Item):
     def __init__(self) -> None:
         super().__init__(letter='O')
@@ -29,6 +48,9 @@ class X(Item):
     def __init__(self) -> None:
         super().__init__(letter='X')
 
+def unplace(board_game_state, player, record, location):
+    board_game_state.board.remove_item(record)
+
 def place_o(board_game_state, player, location):
     board = board_game_state.board
     if board.get_items(location):
@@ -36,13 +58,15 @@ def place_o(board_game_state, player, location):
     elif player.id != 'O':
         raise Exception('player not O')
     else:
-        board.add_item(O(), location)
+        item = O()
+        board.add_item(item, location)
+        return item
 
 class Place_O(Action):
     def __init__(self, location) -> None:
         params = {'location': location}
         fn = place_o
-        super().__init__(fn, params)
+        super().__init__(fn, params, undo_fn=unplace)
 
 def place_x(board_game_state, player, location):
     board = board_game_state.board
@@ -51,20 +75,22 @@ def place_x(board_game_state, player, location):
     elif player.id != 'X':
         raise Exception('player not X')
     else:
-        board.add_item(X(), location)
+        item = X()
+        board.add_item(item, location)
+        return item
 
 class Place_X(Action):
     def __init__(self, location) -> None:
         params = {'location': location}
         fn = place_x
-        super().__init__(fn, params)
+        super().__init__(fn, params, undo_fn=unplace)
 
 class TicTacToe(BoardGame):
     def __init__(self) -> None:
         tictactoe_grid = TicTacToeBoard()
         self.adam = Player(name='X', id='X')
         self.jess = Player(name='O', id='O')
-        bgs = BoardGameState(board=tictactoe_grid, players=[self.adam, self.jess])
+        bgs = TicTacToeState(board=tictactoe_grid, players=[self.adam, self.jess])
         super().__init__(state=bgs)
 
     def play_demo_game(self):
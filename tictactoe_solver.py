@@ -0,0 +1,154 @@
+import os
+from array import array
+from functools import lru_cache
+from actions import Turn
+from tictactoe import Place_X, Place_O
+
+# TicTacToe solved by minimax over every reachable position, once, so best moves and values are lookups
+# a position is the base 3 number with digit y * 3 + x for square (x, y): 0 empty, 1 X, 2 O
+# positions that are rotations or reflections of each other share one entry, under the smallest code among them
+# values are for the player to move: 1 they can force a win, 0 a draw, -1 they lose against best play
+
+WIN, DRAW, LOSS = 1, 0, -1
+POWERS = [3 ** cell for cell in range(9)]
+LINES = [(0, 1, 2), (3, 4, 5), (6, 7, 8), (0, 3, 6), (1, 4, 7), (2, 5, 8), (0, 4, 8), (2, 4, 6)]
+
+
+def _symmetries():
+    # the 8 rotations and reflections of the board, each as cell -> cell
+    def cell(x, y):
+        return y * 3 + x
+    turns = [lambda x, y: (x, y), lambda x, y: (2 - y, x), lambda x, y: (2 - x, 2 - y), lambda x, y: (y, 2 - x)]
+    symmetries = []
+    for turn in turns:
+        for flip in (lambda x, y: (x, y), lambda x, y: (2 - x, y)):
+            symmetries.append(tuple(cell(*flip(*turn(x, y))) for y in range(3) for x in range(3)))
+    return symmetries
+
+
+SYMMETRIES = _symmetries()
+
+
+def encode(cells):
+    return sum(digit * power for digit, power in zip(cells, POWERS))
+
+
+def decode(code):
+    return [code // power % 3 for power in POWERS]
+
+
+def canonical(cells):
+    # (code, symmetry) with the smallest code over the 8 symmetries; symmetry[cell] is where cell ends up
+    best = None
+    for symmetry in SYMMETRIES:
+        code = 0
+        for cell, digit in enumerate(cells):
+            code += digit * POWERS[symmetry[cell]]
+        if best is None or code < best[0]:
+            best = (code, symmetry)
+    return best
+
+
+def line_owner(cells):
+    for a, b, c in LINES:
+        if cells[a] and cells[a] == cells[b] == cells[c]:
+            return cells[a]
+    return 0
+
+
+def cells_of(board):
+    # a TicTacToeBoard as 9 digits
+    cells = [0] * 9
+    for item in board.items:
+        x, y = item.location
+        cells[y * 3 + x] = 1 if item.letter == 'X' else 2
+    return cells
+
+
+class TicTacToeSolver():
+    # table: canonical code -> (value + 1) | mask of the best moves << 2, moves in the canonical position's cells
+    def __init__(self, table=None) -> None:
+        self.table = table if table is not None else {}
+        if table is None:
+            self._solve(decode(0))
+
+    def __len__(self):
+        return len(self.table)
+
+    def _solve(self, cells):
+        # cells must be canonical; negamax over the children, stored under their canonical codes
+        code = encode(cells)
+        entry = self.table.get(code)
+        if entry is not None:
+            return (entry & 3) - 1
+        empty = [cell for cell in range(9) if not cells[cell]]
+        if line_owner(cells):
+            value, best = LOSS, 0  # the last player to move made a line
+        elif not empty:
+            value, best = DRAW, 0
+        else:
+            player = 1 if len(empty) % 2 else 2
+            scores = {}
+            for cell in empty:
+                cells[cell] = player
+                child, symmetry = canonical(cells)
+                cells[cell] = 0
+                scores[cell] = -self._solve(decode(child))
+            value = max(scores.values())
+            best = sum(1 << cell for cell, score in scores.items() if score == value)
+        self.table[code] = (value + 1) | best << 2
+        return value
+
+    def _lookup(self, position):
+        # (value, best cells in position's own numbering) for a TicTacToeState, TicTacToeBoard or list of 9 digits
+        cells = position if isinstance(position, list) else cells_of(getattr(position, 'board', position))
+        code, symmetry = canonical(cells)
+        entry = self.table.get(code)
+        if entry is None:
+            raise Exception('not a reachable TicTacToe position: ' + str(cells))
+        mask = entry >> 2
+        return (entry & 3) - 1, [cell for cell in range(9) if mask >> symmetry[cell] & 1]
+
+    def value(self, position):
+        return self._lookup(position)[0]
+
+    def best_moves(self, position):
+        # every (x, y) that keeps the best value, empty once the game is over
+        return [(cell % 3, cell // 3) for cell in self._lookup(position)[1]]
+
+    def best_move(self, position):
+        moves = self.best_moves(position)
+        return moves[0] if moves else None
+
+    def best_turn(self, state):
+        location = self.best_move(state)
+        if location is None:
+            return None
+        place = Place_X if state.player_turn.id == 'X' else Place_O
+        return Turn(actions=[place(location)], player=state.player_turn)
+
+    def save(self, path):
+        # the table as two arrays of unsigned shorts, codes then entries, sorted by code
+        codes = sorted(self.table)
+        with open(path, 'wb') as f:
+            array('H', codes).tofile(f)
+            array('H', [self.table[code] for code in codes]).tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        words = array('H')
+        with open(path, 'rb') as f:
+            words.frombytes(f.read())
+        half = len(words) // 2
+        return cls(table=dict(zip(words[:half], words[half:])))
+
+
+@lru_cache(maxsize=None)
+def solver(path=None):
+    # the shared solver, loaded from path if it has been saved there, otherwise solved (and saved if path is given)
+    if path and os.path.exists(path):
+        return TicTacToeSolver.load(path)
+    solved = TicTacToeSolver()
+    if path:
+        solved.save(path)
+    return solved
@@ -0,0 +1,90 @@
+import os
+import random
+import tempfile
+import unittest
+from functools import lru_cache
+
+from tictactoe_solver import TicTacToeSolver, solver, canonical, encode, line_owner, SYMMETRIES, WIN, DRAW, LOSS
+from tictactoe import TicTacToe
+from boardgame import GamePhase
+from mcts import MCTS
+
+@lru_cache(maxsize=None)
+def minimax(cells):
+    # plain minimax over positions as they stand, without symmetry, for checking the solver
+    cells = list(cells)
+    empty = [cell for cell in range(9) if not cells[cell]]
+    if line_owner(cells):
+        return LOSS
+    if not empty:
+        return DRAW
+    player = 1 if len(empty) % 2 else 2
+    best = LOSS
+    for cell in empty:
+        cells[cell] = player
+        best = max(best, -minimax(tuple(cells)))
+        cells[cell] = 0
+    return best
+
+def random_position(rng):
+    cells = [0] * 9
+    for ply in range(rng.randrange(9)):
+        if line_owner(cells):
+            break
+        cells[rng.choice([cell for cell in range(9) if not cells[cell]])] = 1 if ply % 2 == 0 else 2
+    return cells
+
+class TestTicTacToeSolver(unittest.TestCase):
+    def setUp(self) -> None:
+        self.solver = solver()
+
+    def test_solved(self):
+        assert len(self.solver) == 765  # positions reachable in play, up to symmetry
+        assert self.solver.value([0] * 9) == DRAW
+        assert self.solver.best_moves([1, 1, 0, 2, 2, 0, 0, 0, 0]) == [(2, 0)]
+        assert self.solver.value([1, 1, 0, 2, 2, 0, 0, 0, 0]) == WIN
+        # X in opposite corners: O has to take an edge
+        assert self.solver.best_moves([1, 0, 0, 0, 2, 0, 0, 0, 1]) == [(1, 0), (0, 1), (2, 1), (1, 2)]
+
+    def test_symmetries(self):
+        assert len(set(SYMMETRIES)) == 8
+        cells = [1, 2, 0, 0, 1, 0, 0, 0, 0]
+        codes = {encode([cells[symmetry.index(cell)] for cell in range(9)]) for symmetry in SYMMETRIES}
+        assert canonical(cells)[0] == min(codes)
+
+    def test_matches_minimax(self):
+        rng = random.Random(1)
+        for _ in range(200):
+            cells = random_position(rng)
+            assert self.solver.value(cells) == minimax(tuple(cells))
+            for x, y in self.solver.best_moves(cells):
+                child = list(cells)
+                child[y * 3 + x] = 1 if cells.count(0) % 2 else 2
+                assert -minimax(tuple(child)) == self.solver.value(cells)
+
+    def test_state_and_save(self):
+        tictactoe = TicTacToe()
+        state = tictactoe.state
+        while state.game_phase != GamePhase.COMPLETE:
+            self.solver.best_turn(state).perform(board_game_state=state)
+        assert state.draw_condition_met() and self.solver.best_turn(state) is None
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tictactoe.bin')
+            TicTacToeSolver().save(path)
+            assert TicTacToeSolver.load(path).table == self.solver.table
+
+    def test_oracle_for_mcts(self):
+        # MCTS should only ever pick moves that keep the game-theoretic value
+        tictactoe = TicTacToe()
+        state = tictactoe.state
+        for location in [(0,0), (1,1), (2,2)]:
+            turn = MCTS(seed=1).search(state, iterations=3000).turn
+            assert turn.actions[0].params['location'] in self.solver.best_moves(state)
+            [turn] = [turn for turn in state.legal_turns() if turn.actions[0].params['location'] == location]
+            turn.perform(board_game_state=state)
+            if state.game_phase == GamePhase.COMPLETE:
+                break
+
+if __name__ == '__main__':
+    unittest.main()
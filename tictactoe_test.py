@@ -1 +1,75 @@
-# TODO unit tests
\ No newline at end of file
+import unittest
+
+import random
+
+from tictactoe import TicTacToe, Place_X, Place_O, X, O, LINES
+from actions import Turn
+
+class TestTicTacToe(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tictactoe = TicTacToe()
+        self.state = self.tictactoe.state
+        self.board = self.state.board
+
+    def test_demogame(self):
+        self.tictactoe.play_demo_game()
+        assert self.board.win_condition_met() == O
+
+    @unittest.expectedFailure
+    def test_place_on_taken_square(self):
+        Turn(actions=[Place_X((1,1))], player=self.tictactoe.adam).perform(board_game_state=self.state)
+        Turn(actions=[Place_O((1,1))], player=self.tictactoe.jess).perform(board_game_state=self.state)
+
+    def test_undo(self):
+        Turn(actions=[Place_X((1,1))], player=self.tictactoe.adam).perform(board_game_state=self.state)
+        with self.state.hypothetically(Turn(actions=[Place_O((0,0))], player=self.tictactoe.jess)):
+            assert isinstance(self.board.get_item((0,0)), O)
+        assert self.board.get_item((0,0)) is None
+        self.state.undo()
+        assert self.board.items == []
+        assert self.state.player_turn == self.tictactoe.adam
+
+    def test_failed_action_rolls_back_the_turn(self):
+        # the second action fails, so the first is taken back and the turn leaves no trace
+        turn = Turn(actions=[Place_X((0,0)), Place_X((0,0))], player=self.tictactoe.adam)
+        with self.assertRaises(Exception):
+            turn.perform(board_game_state=self.state)
+        assert self.board.items == [] and self.board.get_item((0,0)) is None
+        assert len(self.state.turns) == 0 and self.state.undo_records == [] and self.state.player_turn == self.tictactoe.adam
+        with self.assertRaises(Exception):
+            with self.state.hypothetically(turn):
+                pass
+        assert self.board.items == [] and not self.state.hypothetical
+        Turn(actions=[Place_X((0,0))], player=self.tictactoe.adam).perform(board_game_state=self.state)
+        assert isinstance(self.board.get_item((0,0)), X)
+
+    def test_win_follows_turns_and_undo(self):
+        # the lines kept up to date move by move agree with looking at every line
+        def full_check():
+            for line in LINES:
+                for kind in (X, O):
+                    if all(isinstance(self.board.get_item(cell), kind) for cell in line):
+                        return kind
+            return None
+        rng = random.Random(1)
+        for _ in range(50):
+            while not self.state.done():
+                rng.choice(self.state.legal_turns()).perform(board_game_state=self.state)
+                assert self.board.win_condition_met() == full_check()
+            assert self.state.done() == (full_check() or True)
+            while self.state.turns:
+                self.state.undo()
+                assert self.board.win_condition_met() == full_check()
+            assert not self.state.done() and self.board.lines_made == {}
+
+    def test_done_is_cached(self):
+        self.tictactoe.play_demo_game()
+        checks = []
+        check = self.board.win_condition_met
+        self.board.win_condition_met = lambda: checks.append(1) or check()
+        assert self.state.done() == O and checks == []
+        self.state.undo()
+        assert not self.state.done() and checks == [1]
+
+if __name__ == '__main__':
+    unittest.main()
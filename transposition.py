@@ -0,0 +1,213 @@
+from collections import namedtuple, OrderedDict
+from multiprocessing import shared_memory
+import numpy as np
+
+# what a stored result means for the true value of the position
+EXACT = 0
+LOWER_BOUND = 1  # the search failed high, the value is at least this
+UPPER_BOUND = 2  # the search failed low, the value is at most this
+
+TableEntry = namedtuple('TableEntry', ['key', 'depth', 'value', 'flag', 'move', 'generation'])
+
+
+class TranspositionTable():
+    # fixed size table of results keyed by position hash (e.g. ChessState.zobrist_hash), shared by search,
+    # checkmate detection and move generation
+    # each bucket has two slots: one keeps the deepest result, the other always takes the newest, so deep
+    # results survive a flood of shallow ones but results from earlier searches don't squat forever
+    # the slots are only allocated at the first store, so states that never search don't pay for a table
+    def __init__(self, size=1 << 16) -> None:
+        if size & (size - 1):
+            raise Exception('transposition table size must be a power of two, not ' + str(size))
+        self.size = size
+        self.mask = size - 1
+        self.deepest = None
+        self.newest = None
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def __deepcopy__(self, memo):
+        # hypothetical copies of a state keep sharing the table
+        return self
+
+    def __len__(self):
+        if self.deepest is None:
+            return 0
+        return sum(1 for entry in self.deepest + self.newest if entry is not None)
+
+    def new_search(self):
+        # entries from earlier searches become the first to be replaced
+        self.generation += 1
+
+    def clear(self):
+        self.deepest = None
+        self.newest = None
+
+    def probe(self, key):
+        self.probes += 1
+        if self.deepest is None:
+            return None
+        index = key & self.mask
+        for entry in (self.deepest[index], self.newest[index]):
+            if entry is not None and entry.key == key:
+                self.hits += 1
+                return entry
+        return None
+
+    def store(self, key, depth, value, flag=EXACT, move=None):
+        self.stores += 1
+        if self.deepest is None:
+            self.deepest = [None] * self.size
+            self.newest = [None] * self.size
+        index = key & self.mask
+        entry = TableEntry(key, depth, value, flag, move, self.generation)
+        deepest = self.deepest[index]
+        if deepest is None or deepest.key == key or depth >= deepest.depth or deepest.generation != self.generation:
+            self.deepest[index] = entry
+            if deepest is not None and deepest.key != key:
+                self.newest[index] = deepest
+        else:
+            self.newest[index] = entry
+
+
+class PositionCache():
+    # results that only depend on the position, such as its legal moves or whether the game is over, keyed by
+    # ChessState.zobrist_hash; keeps the size most recently used, apart from the search's TranspositionTable so
+    # they don't push its entries out or end up where it expects scores
+    def __init__(self, size=1 << 12) -> None:
+        self.size = size
+        self.entries = OrderedDict()
+        self.probes = 0
+        self.hits = 0
+
+    def __deepcopy__(self, memo):
+        # hypothetical copies of a state keep sharing the cache
+        return self
+
+    def __len__(self):
+        return len(self.entries)
+
+    def probe(self, key, default=None):
+        self.probes += 1
+        entries = self.entries
+        if key not in entries:
+            return default
+        self.hits += 1
+        entries.move_to_end(key)
+        return entries[key]
+
+    def store(self, key, value):
+        entries = self.entries
+        entries[key] = value
+        entries.move_to_end(key)
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+# SharedTranspositionTable packs each entry's data into one 64 bit word:
+# move (16 bits) | depth (8) | flag (2) | generation (8) | value + VALUE_OFFSET (30)
+VALUE_OFFSET = 1 << 29
+HEADER_WORDS = 1  # the shared generation counter
+
+
+class SharedTranspositionTable():
+    # TranspositionTable with the same interface, kept in multiprocessing.shared_memory so that search processes
+    # share results; values must be ints and moves must fit in 16 bits via encode_move / decode_move
+    # other processes attach to it with SharedTranspositionTable(size, name=table.name, ...)
+    # entries are written without locks as (key ^ data, data): a torn write from two processes at once fails the
+    # check on the next probe and is treated as a miss
+    def __init__(self, size=1 << 20, name=None, encode_move=None, decode_move=None) -> None:
+        if size & (size - 1):
+            raise Exception('transposition table size must be a power of two, not ' + str(size))
+        self.size = size
+        self.mask = size - 1
+        self.encode_move = encode_move or (lambda move: move or 0)
+        self.decode_move = decode_move or (lambda code: code or None)
+        nbytes = (HEADER_WORDS + size * 4) * 8  # two slots per bucket, two words per slot
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        words = np.ndarray((HEADER_WORDS + size * 4,), dtype=np.uint64, buffer=self.memory.buf)
+        self.header = words[:HEADER_WORDS]
+        self.slots = words[HEADER_WORDS:].reshape((size, 2, 2))  # [bucket][deepest, newest][check, data]
+        if self.owner:
+            words[:] = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def close(self):
+        self.header = self.slots = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    @property
+    def generation(self):
+        return int(self.header[0])
+
+    def new_search(self):
+        self.header[0] = (int(self.header[0]) + 1) & 0xFF
+
+    def clear(self):
+        self.slots[:] = 0
+
+    def __len__(self):
+        return int((self.slots[:, :, 1] != 0).sum())
+
+    def _pack(self, depth, value, flag, move):
+        return ((self.encode_move(move) & 0xFFFF) | (min(max(depth, 0), 255) << 16) | (flag << 24)
+                | (self.generation << 26) | ((value + VALUE_OFFSET) << 34))
+
+    def _unpack(self, key, data):
+        value = (data >> 34) - VALUE_OFFSET
+        return TableEntry(key, (data >> 16) & 0xFF, value, (data >> 24) & 0x3, self.decode_move(data & 0xFFFF), (data >> 26) & 0xFF)
+
+    def _read(self, index, slot, key=None):
+        check, data = int(self.slots[index, slot, 0]), int(self.slots[index, slot, 1])
+        if not data:
+            return None
+        stored_key = check ^ data
+        if key is not None and stored_key != key:
+            return None
+        return self._unpack(stored_key, data)
+
+    def _write(self, index, slot, key, data):
+        self.slots[index, slot, 0] = key ^ data
+        self.slots[index, slot, 1] = data
+
+    def probe(self, key):
+        self.probes += 1
+        index = key & self.mask
+        for slot in (0, 1):
+            entry = self._read(index, slot, key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+        return None
+
+    def store(self, key, depth, value, flag=EXACT, move=None):
+        self.stores += 1
+        index = key & self.mask
+        data = self._pack(depth, value, flag, move)
+        deepest = self._read(index, 0)
+        if deepest is None or deepest.key == key or depth >= deepest.depth or deepest.generation != self.generation:
+            if deepest is not None and deepest.key != key:
+                self.slots[index, 1] = self.slots[index, 0]
+            self._write(index, 0, key, data)
+        else:
+            self._write(index, 1, key, data)